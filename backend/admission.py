@@ -0,0 +1,136 @@
+"""Per-client admission control with token buckets.
+
+Every client has one bucket per model kind: text requests are charged by
+(estimated) token count and image requests by pixel count, so a client
+sending long texts or huge images uses up its budget faster than one sending
+short posts. Buckets refill continuously at ``rate`` units per second up to
+``burst``. A request is admitted when its bucket holds at least its cost (or,
+for a request costlier than the whole burst, when the bucket is full); the
+bucket may then go negative, which delays that client's next requests.
+
+Clients are identified by the API key or client id they send, but only if
+that id has limits configured; everyone else is bucketed by address, so
+rotating made-up ids doesn't escape the default limit.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+KINDS = ("text", "image")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` would be admitted; 0 if it is admitted now."""
+        self._refill(now)
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self, cost: float) -> None:
+        self.tokens -= cost
+
+
+class ClientLimits:
+    """Refill rates (units per second) and burst sizes for one client."""
+
+    def __init__(
+        self,
+        text_rate: float = 20_000,
+        text_burst: float = 200_000,
+        image_rate: float = 20_000_000,
+        image_burst: float = 200_000_000,
+    ):
+        self.rates = {"text": float(text_rate), "image": float(image_rate)}
+        self.bursts = {"text": float(text_burst), "image": float(image_burst)}
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "ClientLimits":
+        return cls(**values)
+
+
+def parse_limits(value: str) -> tuple[ClientLimits, dict[str, ClientLimits]]:
+    """Parse ``ADMISSION_LIMITS``: a JSON object mapping client ids / API keys
+    (plus an optional ``"default"``) to ``ClientLimits`` fields."""
+    config = json.loads(value) if value.strip() else {}
+    default = ClientLimits.from_dict(config.pop("default", {}))
+    return default, {client: ClientLimits.from_dict(limits) for client, limits in config.items()}
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        default: ClientLimits,
+        clients: Optional[dict[str, ClientLimits]] = None,
+        max_clients: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.default = default
+        self.clients = clients or {}
+        self.max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        # least recently seen first; evicted clients come back with a full bucket
+        self._buckets: OrderedDict[tuple, TokenBucket] = OrderedDict()
+
+    def identify(self, ids: list[Optional[str]], address: str) -> str:
+        """First id (API key, client id, ...) that has configured limits, else the address."""
+        return next((i for i in ids if i and i in self.clients), f"addr:{address}")
+
+    def _bucket(self, client: str, kind: str, now: float) -> TokenBucket:
+        key = (client, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limits = self.clients.get(client, self.default)
+            bucket = self._buckets[key] = TokenBucket(limits.rates[kind], limits.bursts[kind], now)
+            while len(self._buckets) > self.max_clients * len(KINDS):
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, client: str, kind: str, cost: Callable[[], float]) -> float:
+        """Charge ``client``'s ``kind`` bucket; returns 0 if admitted, else the
+        seconds to wait. ``cost`` is only computed once the bucket is known to
+        be non-empty, so a throttled client costs next to nothing."""
+        return self.admit_all(client, {kind: cost})[1]
+
+    def admit_all(self, client: str, costs: dict[str, Callable[[], float]]) -> tuple[Optional[str], float]:
+        """Charge several of ``client``'s buckets (e.g. a post's text and
+        images) together: either every bucket admits its cost and all are
+        charged, or none is. Returns ``(None, 0)`` if admitted, else the first
+        rejecting kind and the seconds to wait for it."""
+        with self._lock:
+            now = self._clock()
+            for kind in costs:
+                wait = self._bucket(client, kind, now).retry_after(0, now)  # still in debt from earlier requests
+                if wait > 0:
+                    return kind, wait
+        amounts = {kind: cost() for kind, cost in costs.items()}
+        with self._lock:
+            now = self._clock()
+            buckets = {kind: self._bucket(client, kind, now) for kind in amounts}
+            for kind, amount in amounts.items():
+                wait = buckets[kind].retry_after(amount, now)
+                if wait > 0:
+                    return kind, wait
+            for kind, amount in amounts.items():
+                buckets[kind].take(amount)
+            return None, 0.0
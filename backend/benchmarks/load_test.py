@@ -0,0 +1,263 @@
+"""Load test and latency benchmark for the detection API.
+
+Drives `/detect` and `/detect-image` with synthetic payloads at a fixed
+concurrency and reports throughput and p50/p95/p99 latency per scenario.
+By default the FastAPI app is imported and driven in-process (no server
+needed); pass --url to hit a running server instead.
+
+Run from the `backend` directory:
+
+    python benchmarks/load_test.py --requests 200 --concurrency 8 --output results.json
+
+Record a baseline once, then fail later runs that regress beyond --tolerance:
+
+    python benchmarks/load_test.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WORDS = (
+    "the a to and of in is it you that for this was on with but just like so not "
+    "have they be are my at if what about people think really would time know get "
+    "one all out more when can post comment thread reddit tweet thanks edit lol "
+    "honestly actually pretty good bad new years game city water music phone work "
+    "school money friend dog cat coffee weekend movie team season update release"
+).split()
+
+# name -> (endpoint, payload factory args)
+SCENARIOS = {
+    "tweet": ("/detect", {"words": (12, 45)}),
+    "reddit": ("/detect", {"words": (250, 800)}),
+    "jpeg-256": ("/detect-image", {"size": 256}),
+    "jpeg-768": ("/detect-image", {"size": 768}),
+    "jpeg-2048": ("/detect-image", {"size": 2048}),
+}
+PERCENTILES = (50, 95, 99)
+
+
+def synthetic_text(rng: random.Random, min_words: int, max_words: int) -> str:
+    """Random post made of common words; unique per call so caches don't hide model cost."""
+    n = rng.randint(min_words, max_words)
+    words = [rng.choice(_WORDS) for _ in range(n)]
+    sentences, i = [], 0
+    while i < n:
+        length = rng.randint(6, 18)
+        sentence = " ".join(words[i : i + length])
+        sentences.append(sentence[:1].upper() + sentence[1:] + rng.choice([".", ".", "!", "?"]))
+        i += length
+    return " ".join(sentences)[:5000]
+
+
+def synthetic_jpeg_base64(rng: random.Random, size: int) -> str:
+    """Smooth noise image (compresses like a photo, unlike white noise)."""
+    np_rng = np.random.default_rng(rng.randrange(2**32))
+    coarse = np_rng.integers(0, 256, size=(max(size // 32, 2), max(size // 32, 2), 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((size, size), Image.BICUBIC)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def build_payloads(scenario: str, count: int, seed: int, image_pool: int = 0) -> list:
+    """``count`` payloads; images are unique unless ``image_pool`` > 0 caps how many distinct ones are encoded."""
+    endpoint, spec = SCENARIOS[scenario]
+    rng = random.Random(f"{seed}-{scenario}")
+    if endpoint == "/detect":
+        return [{"text": synthetic_text(rng, *spec["words"])} for _ in range(count)]
+    # concurrent identical images share one model call (single-flight), so a
+    # reused pool measures coalescing rather than model cost
+    pool = [{"image_base64": synthetic_jpeg_base64(rng, spec["size"])} for _ in range(min(count, image_pool or count))]
+    return [pool[i % len(pool)] for i in range(count)]
+
+
+def summarize(latencies: list, errors: int, wall_seconds: float) -> dict:
+    ms = np.array(latencies) * 1000.0
+    result = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_rps": round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+    }
+    if len(ms):
+        result["mean_ms"] = round(float(ms.mean()), 3)
+        result["max_ms"] = round(float(ms.max()), 3)
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 3)
+    return result
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, payloads: list, concurrency: int) -> dict:
+    endpoint, _ = SCENARIOS[scenario]
+    queue: asyncio.Queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=payload)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    """Poll /ready so startup warmup isn't measured as request latency."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        response = await client.get("/ready")
+        if response.status_code != 503:
+            return
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"API not ready after {timeout:.0f}s")
+
+
+async def run(args) -> dict:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}. Choose from {', '.join(SCENARIOS)}")
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout)
+        lifespan = None
+    else:
+        sys.path.insert(0, _BACKEND_DIR)
+        from main import app  # type: ignore
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=timeout)
+        lifespan = app.router.lifespan_context(app)
+
+    results = {}
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            await wait_until_ready(client, args.ready_timeout)
+            for scenario in scenarios:
+                warmup = build_payloads(scenario, args.warmup, args.seed + 1, args.image_pool)
+                if warmup:
+                    await run_scenario(client, scenario, warmup, args.concurrency)
+                payloads = build_payloads(scenario, args.requests, args.seed, args.image_pool)
+                results[scenario] = await run_scenario(client, scenario, payloads, args.concurrency)
+                print(f"[bench] {scenario:<10} {json.dumps(results[scenario])}", flush=True)
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    return {
+        "config": {
+            "target": args.url or "in-process",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "image_pool": args.image_pool,
+        },
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a message for every latency percentile that regressed by more than ``tolerance``."""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}_ms"
+            if key not in current or key not in base:
+                continue
+            limit = base[key] * (1.0 + tolerance)
+            if current[key] > limit:
+                regressions.append(
+                    f"{scenario} {key}: {current[key]:.1f}ms > {limit:.1f}ms (baseline {base[key]:.1f}ms + {tolerance:.0%})"
+                )
+        if current.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{scenario} errors: {current['errors']} > baseline {base.get('errors', 0)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the SlopMop detection API")
+    parser.add_argument("--url", help="Base URL of a running server (default: drive the app in-process)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent in-flight requests")
+    parser.add_argument("--warmup", type=int, default=8, help="Unmeasured warmup requests per scenario")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for synthetic payloads")
+    parser.add_argument(
+        "--image-pool", type=int, default=0,
+        help="Reuse this many distinct images per image scenario (default 0: a unique image per request)",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=900.0, help="Seconds to wait for /ready")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fractional latency regression")
+    parser.add_argument("--save-baseline", help="Write these results as the new baseline to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[bench] Results written to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[bench] Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("[bench] Latency regression against baseline:")
+            for message in regressions:
+                print(f"  - {message}")
+            sys.exit(1)
+        print("[bench] No regression against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Model micro-benchmark: batch size x sequence length x threads x backend.
+
+Sweeps the text detector (DistilBERT) and the Nonescape image classifier over
+every combination of the requested dimensions and every backend available on
+this machine, then recommends a serving configuration.
+
+Backends:
+    eager        plain PyTorch
+    torchscript  torch.jit.trace, one trace per input shape
+    compiled     torch.compile (needs a working C++ toolchain on CPU)
+    onnxruntime  ONNX export + onnxruntime (skipped if not installed)
+    quantized    dynamic int8 quantization of nn.Linear layers
+
+Run from the `backend` directory:
+
+    python benchmarks/model_bench.py --models text,image --batch-sizes 1,4,16 \\
+        --seq-lens 64,128,512 --threads 1,2,4 --output model_bench.json
+
+Backends that fail to build are reported and skipped rather than aborting the
+sweep.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BACKEND_DIR)
+sys.path.insert(0, os.path.join(_BACKEND_DIR, "nonescape", "python"))
+sys.path.insert(0, os.path.join(_BACKEND_DIR, "..", "model_training", "text_model"))
+
+from metrics import process_rss_bytes  # noqa: E402
+from serving import TextLogits  # noqa: E402
+from thread_tuning import available_cpus  # noqa: E402
+
+BACKENDS = ("eager", "torchscript", "compiled", "onnxruntime", "quantized")
+IMAGE_SIZE = 224
+
+
+# ── Model loading ──────────────────────────────────────────────
+def load_text_model(weights: str = None):
+    from checkpoint_io import load_checkpoint  # type: ignore
+    from text_detector import TextDetectors  # type: ignore
+
+    detector = TextDetectors()
+    if weights and os.path.exists(weights):
+        detector.model.load_state_dict(load_checkpoint(weights), strict=True)
+    model = TextLogits(detector.model.to("cpu")).eval()
+    vocab_size = detector.tokenizer.vocab_size
+    return model, vocab_size
+
+
+def load_image_model(variant: str, weights: str = None):
+    from nonescape import NonescapeClassifier, NonescapeClassifierMini  # type: ignore
+
+    cls = NonescapeClassifierMini if variant == "mini" else NonescapeClassifier
+    model = cls.from_pretrained(weights) if weights else cls()
+    return model.to("cpu").eval()
+
+
+def text_inputs(vocab_size: int, batch: int, seq_len: int) -> tuple:
+    gen = torch.Generator().manual_seed(batch * 10_000 + seq_len)
+    # skip [PAD]/[unused]/special ids at the start of the vocab
+    low = min(1000, vocab_size - 1)
+    input_ids = torch.randint(low, vocab_size, (batch, seq_len), generator=gen)
+    return input_ids, torch.ones_like(input_ids)
+
+
+def image_inputs(batch: int) -> tuple:
+    gen = torch.Generator().manual_seed(batch)
+    return (torch.randn(batch, 3, IMAGE_SIZE, IMAGE_SIZE, generator=gen),)
+
+
+# ── Backends ───────────────────────────────────────────────────
+# each builder returns a callable taking the input tuple, or raises
+def build_eager(model, example, threads):
+    return lambda inputs: model(*inputs)
+
+
+def build_torchscript(model, example, threads):
+    traced = torch.jit.trace(model, example, check_trace=False, strict=False)
+    traced = torch.jit.freeze(traced.eval())
+    return lambda inputs: traced(*inputs)
+
+
+def build_compiled(model, example, threads):
+    compiled = torch.compile(model, dynamic=False)
+    with torch.no_grad():
+        compiled(*example)  # force compilation now so a broken toolchain fails here
+    return lambda inputs: compiled(*inputs)
+
+
+def build_onnxruntime(model, example, threads):
+    import onnxruntime as ort  # type: ignore
+
+    names = ["input_ids", "attention_mask"] if len(example) == 2 else ["pixel_values"]
+    dynamic = {name: {0: "batch", 1: "seq"} if len(example) == 2 else {0: "batch"} for name in names}
+    path = os.path.join(tempfile.mkdtemp(prefix="slopmop_bench_"), "model.onnx")
+    torch.onnx.export(
+        model, example, path,
+        input_names=names, output_names=["logits"],
+        dynamic_axes={**dynamic, "logits": {0: "batch"}},
+        opset_version=17, dynamo=False,
+    )
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    return lambda inputs: session.run(None, {n: t.numpy() for n, t in zip(names, inputs)})
+
+
+def build_quantized(model, example, threads):
+    quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    return lambda inputs: quantized(*inputs)
+
+
+BUILDERS = {
+    "eager": build_eager,
+    "torchscript": build_torchscript,
+    "compiled": build_compiled,
+    "onnxruntime": build_onnxruntime,
+    "quantized": build_quantized,
+}
+# builders whose result is specialised to one input shape
+_PER_SHAPE = {"torchscript", "compiled"}
+
+
+# ── Measurement ────────────────────────────────────────────────
+class _PeakRSS:
+    """Samples process RSS in a background thread while active."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = process_rss_bytes()
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, process_rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, process_rss_bytes())
+
+
+def measure(fn, inputs, batch: int, warmup: int, iters: int, min_seconds: float) -> dict:
+    with torch.inference_mode():
+        for _ in range(warmup):
+            fn(inputs)
+        latencies = []
+        with _PeakRSS() as rss:
+            start = time.perf_counter()
+            while len(latencies) < iters or time.perf_counter() - start < min_seconds:
+                t0 = time.perf_counter()
+                fn(inputs)
+                latencies.append(time.perf_counter() - t0)
+            total = time.perf_counter() - start
+    ms = np.array(latencies) * 1000.0
+    return {
+        "iters": len(latencies),
+        "samples_per_sec": round(batch * len(latencies) / total, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "peak_rss_delta_mb": round((rss.peak - rss.start) / 2**20, 1),
+    }
+
+
+def _sweep_backend(rows, name, model, make_inputs, shapes, backend, thread_counts, args):
+    builder = BUILDERS[backend]
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        fn = None
+        for batch, seq_len in shapes:
+            inputs = make_inputs(batch, seq_len)
+            row = {"model": name, "backend": backend, "threads": threads, "batch": batch, "seq_len": seq_len}
+            if fn is None or backend in _PER_SHAPE:
+                build_start = time.perf_counter()
+                fn = builder(model, inputs, threads)
+                row["build_seconds"] = round(time.perf_counter() - build_start, 3)
+            row.update(measure(fn, inputs, batch, args.warmup, args.iters, args.min_seconds))
+            rows.append(row)
+            print(f"[bench] {json.dumps(row)}", flush=True)
+
+
+def sweep(name, model, make_inputs, shapes, backends, thread_counts, args) -> list:
+    rows = []
+    for backend in backends:
+        try:
+            _sweep_backend(rows, name, model, make_inputs, shapes, backend, thread_counts, args)
+        except Exception as e:  # backend unavailable on this machine
+            print(f"[bench] {name}/{backend} unavailable: {type(e).__name__}: {e}", flush=True)
+    return rows
+
+
+# ── Reporting ──────────────────────────────────────────────────
+def recommend(rows: list, latency_budget_ms: float, cores: int) -> dict:
+    """Per model: highest-throughput (backend, threads, batch) whose p95 fits the budget.
+
+    Sequence length is decided by the traffic, not by us, so each config is
+    scored over all measured lengths: harmonic-mean throughput and worst-case
+    p95. Throughput is then scaled by the number of workers that fit on the
+    machine (cores // threads), since each worker runs its own forward passes.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["model"], row["backend"], row["threads"], row["batch"]), []).append(row)
+
+    best = {}
+    for (model, backend, threads, batch), group in groups.items():
+        worst_p95 = max(r["p95_ms"] for r in group)
+        if worst_p95 > latency_budget_ms:
+            continue
+        throughput = len(group) / sum(1.0 / r["samples_per_sec"] for r in group)
+        workers = max(cores // threads, 1)
+        score = round(throughput * workers, 2)
+        if model not in best or score > best[model]["est_samples_per_sec"]:
+            best[model] = {
+                "backend": backend,
+                "threads": threads,
+                "batch": batch,
+                "workers": workers,
+                "worst_p95_ms": worst_p95,
+                "est_samples_per_sec": score,
+            }
+    return best
+
+
+def format_table(rows: list) -> str:
+    cols = ["model", "backend", "threads", "batch", "seq_len", "samples_per_sec", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"]
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols}
+    lines = ["  ".join(c.ljust(widths[c]) for c in cols)]
+    lines.append("  ".join("-" * widths[c] for c in cols))
+    for r in rows:
+        lines.append("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in cols))
+    return "\n".join(lines)
+
+
+def _ints(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the SlopMop models")
+    parser.add_argument("--models", default="text,image", help="Comma-separated: text, image")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to try")
+    parser.add_argument("--batch-sizes", default="1,4,16", help="Comma-separated batch sizes")
+    parser.add_argument("--seq-lens", default="64,128,256,512", help="Comma-separated text sequence lengths")
+    parser.add_argument("--threads", default=None, help="Comma-separated torch thread counts (default: 1,2,4,...,available CPUs)")
+    parser.add_argument("--image-variant", choices=["mini", "full"], default="mini", help="Nonescape variant")
+    parser.add_argument("--image-weights", help="Nonescape .safetensors (default: random init)")
+    parser.add_argument("--text-weights", help="Text detector .safetensors checkpoint (default: base model)")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured iterations per config")
+    parser.add_argument("--iters", type=int, default=10, help="Minimum measured iterations per config")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Minimum measured time per config")
+    parser.add_argument("--latency-budget-ms", type=float, default=250.0, help="p95 budget for the recommendation")
+    parser.add_argument("--output", help="Write all rows and the recommendation as JSON")
+    args = parser.parse_args()
+
+    # the affinity mask and cgroup quota, as the server sees them, not the host's core count
+    cores = available_cpus()
+    if args.threads:
+        thread_counts = _ints(args.threads)
+    else:
+        thread_counts = sorted({min(2**i, cores) for i in range(cores.bit_length() + 1)})
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BUILDERS]
+    if unknown:
+        raise SystemExit(f"Unknown backend(s): {', '.join(unknown)}. Choose from {', '.join(BACKENDS)}")
+    batch_sizes = _ints(args.batch_sizes)
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+
+    rows = []
+    if "text" in models:
+        model, vocab_size = load_text_model(args.text_weights)
+        shapes = [(b, s) for b in batch_sizes for s in _ints(args.seq_lens)]
+        rows += sweep("text", model, lambda b, s: text_inputs(vocab_size, b, s), shapes, backends, thread_counts, args)
+        del model
+    if "image" in models:
+        model = load_image_model(args.image_variant, args.image_weights)
+        shapes = [(b, IMAGE_SIZE) for b in batch_sizes]
+        rows += sweep(f"image-{args.image_variant}", model, lambda b, s: image_inputs(b), shapes, backends, thread_counts, args)
+
+    if not rows:
+        raise SystemExit("No configuration could be benchmarked.")
+
+    print()
+    print(format_table(rows))
+    recommendation = recommend(rows, args.latency_budget_ms, cores)
+    print(f"\nRecommended serving configuration ({cores} cores, p95 <= {args.latency_budget_ms:.0f}ms):")
+    for model_name, r in recommendation.items():
+        print(
+            f"  {model_name:<12} backend={r['backend']} batch={r['batch']} threads={r['threads']} "
+            f"workers={r['workers']} -> ~{r['est_samples_per_sec']} samples/s (p95 <= {r['worst_p95_ms']:.0f}ms)"
+        )
+    for model_name in sorted({r["model"] for r in rows} - set(recommendation)):
+        print(f"  {model_name:<12} no configuration met the latency budget")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cores": cores, "rows": rows, "recommendation": recommendation}, f, indent=2)
+        print(f"\n[bench] Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Priority- and deadline-aware executor for model work.
+
+A drop-in for ``ThreadPoolExecutor`` whose queue is ordered by priority
+(FIFO within a priority), so the post the user is looking at is scored
+before speculative prefetch for posts far below the viewport. A job may
+carry a deadline (a ``time.perf_counter()`` value); if it is still queued
+when that passes it never reaches the model and its future fails with
+``DeadlineExceeded``. Jobs cancelled while queued are skipped too.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+PRIORITIES = ("high", "normal", "low")
+
+
+class DeadlineExceeded(Exception):
+    """The job's deadline passed before a worker picked it up."""
+
+
+class PriorityExecutor:
+    def __init__(self, max_workers: int, thread_name_prefix: str = "inference"):
+        self._cond = threading.Condition()
+        self._heap: list[tuple] = []
+        self._seq = itertools.count()
+        self._shutdown = False
+        self._expired = {priority: 0 for priority in PRIORITIES}
+        self._thread_name_prefix = thread_name_prefix
+        self._generation = 0
+        self._threads: list[threading.Thread] = []
+        self.resize(max_workers)
+
+    @property
+    def max_workers(self) -> int:
+        return len(self._threads)
+
+    def resize(self, max_workers: int) -> None:
+        """Replace the workers with ``max_workers`` fresh threads.
+
+        Workers of the previous generation finish their current job and exit.
+        Fresh threads matter for torch: a thread adopts the intra-op thread
+        count the first time it runs a parallel op, so only new threads see a
+        changed ``torch.set_num_threads``.
+        """
+        with self._cond:
+            self._generation += 1
+            generation = self._generation
+            self._threads = [
+                threading.Thread(
+                    target=self._work, args=(generation,), name=f"{self._thread_name_prefix}-{generation}-{i}", daemon=True
+                )
+                for i in range(max(max_workers, 1))
+            ]
+            threads = list(self._threads)
+            self._cond.notify_all()
+        for thread in threads:
+            thread.start()
+
+    def submit(
+        self, fn: Callable, *args, priority: str = "normal", deadline: Optional[float] = None
+    ) -> Future:
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {PRIORITIES}, got {priority!r}")
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            heapq.heappush(
+                self._heap, (PRIORITIES.index(priority), next(self._seq), priority, deadline, future, fn, args)
+            )
+            self._cond.notify()
+        return future
+
+    def _work(self, generation: int) -> None:
+        while True:
+            with self._cond:
+                while not self._heap and not self._shutdown and generation == self._generation:
+                    self._cond.wait()
+                if generation != self._generation or not self._heap:
+                    return
+                _, _, priority, deadline, future, fn, args = heapq.heappop(self._heap)
+
+            if not future.set_running_or_notify_cancel():
+                continue  # cancelled while queued
+            if deadline is not None and time.perf_counter() > deadline:
+                with self._cond:
+                    self._expired[priority] += 1
+                future.set_exception(DeadlineExceeded(f"{priority} job expired in the queue"))
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = {priority: 0 for priority in PRIORITIES}
+            for item in self._heap:
+                queued[item[2]] += 1
+            return {"queued": queued, "expired": dict(self._expired)}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs; workers exit once the queue is drained."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
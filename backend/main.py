@@ -1,10 +1,22 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
+from starlette.requests import HTTPConnection
+from typing import Literal, Optional, Union
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
+import asyncio
 import base64
+import contextvars
+import hashlib
 import io
+import math
+import secrets
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
 from PIL import Image
 import torch
 
@@ -16,9 +28,28 @@ from nonescape import NonescapeClassifier, NonescapeClassifierMini, preprocess_i
 
 # Add text model to path so we can import the detector class
 sys.path.insert(0, os.path.join(_THIS_DIR, "..", "model_training", "text_model"))
-from text_detector import TextDetectors # type: ignore
+from text_detector import TextDetectors, preprocess_text # type: ignore
+from checkpoint_io import MANIFEST_SUFFIX, legacy_checkpoint_for, read_manifest # type: ignore
+from multi_head_detector import load_text_weights # type: ignore
 
-app = FastAPI(title="SlopMop Detection API", version="0.1.0")
+import metrics
+import serving
+import thread_tuning
+from admission import AdmissionController, parse_limits
+from inference_queue import DeadlineExceeded, PriorityExecutor
+from model_registry import ModelRegistry, ModelVersion, RegistryBusy, file_digest
+from near_duplicate import NearDuplicateIndex
+from single_flight import SingleFlight
+
+
+# warm the models up in the background so `/` answers while `/ready` is still 503
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=warm_up_models, name="slopmop-warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="SlopMop Detection API", version="0.1.0", lifespan=lifespan)
 
 # allow all origins, credentials, methods, and headers 
 # CORS so the extension can access the API
@@ -28,84 +59,318 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
+)
+
+
+# time every request and report its stages in a Server-Timing header
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    timings = metrics.start_request(request.url.path)
+    response = await call_next(request)
+    now = time.perf_counter()
+    if timings.handler_done is not None:
+        timings.record("serialize", now - timings.handler_done)
+    total = now - timings.received
+    # label by route template so unknown paths don't create new series
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(total, endpoint=getattr(route, "path", "unmatched"))
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    return response
+
+# ── CPU thread layout: concurrent forward passes x intra-op threads ──
+# Without limits every forward pass uses all cores and concurrent requests
+# oversubscribe the CPU. At startup (after warmup) a few layouts that fit the
+# available CPUs (cgroup quota aware) are benchmarked on the loaded models and
+# the best is applied. INFERENCE_WORKERS / INFERENCE_THREADS pin either side
+# (both skip the benchmark); THREAD_TUNING=0 keeps the default layout.
+CPUS = thread_tuning.available_cpus()
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0") or 0)
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0") or 0)
+THREAD_TUNING = os.environ.get("THREAD_TUNING", "1").strip() != "0"
+THREAD_TUNING_SECONDS = float(os.environ.get("THREAD_TUNING_SECONDS", "0.3"))
+try:
+    # workers provide the concurrency; inter-op parallelism would only add threads
+    torch.set_num_interop_threads(int(os.environ.get("TORCH_INTEROP_THREADS", "1")))
+except RuntimeError:
+    pass  # already fixed once torch has run parallel work
+_default_workers = INFERENCE_WORKERS or min(2, CPUS)
+thread_layout = thread_tuning.ThreadLayout(
+    _default_workers,
+    INFERENCE_THREADS or max(CPUS // _default_workers, 1),
+    "env" if INFERENCE_WORKERS and INFERENCE_THREADS else "default",
 )
+torch.set_num_threads(thread_layout.threads)
+
+# ── Serving mode: padding buckets, batch sizes, optional compilation ──
+# Text is padded to the smallest TEXT_PAD_BUCKETS length that fits and batches
+# to the next SERVING_BATCH_SIZES entry, so only a few shapes ever reach the
+# models. All of them are warmed up before /ready reports ready.
+# SERVING_COMPILE=torchscript|compile builds one compiled artifact per shape;
+# if that fails (or disagrees with eager) the model falls back to eager mode.
+SERVING_COMPILE = os.environ.get("SERVING_COMPILE", "off").strip().lower() or "off"
+SERVING_WARMUP = os.environ.get("SERVING_WARMUP", "1").strip() != "0"
+TEXT_PAD_BUCKETS = serving.parse_ints(os.environ.get("TEXT_PAD_BUCKETS", ""), (64, 128, 256, 512))
+SERVING_BATCH_SIZES = serving.parse_ints(os.environ.get("SERVING_BATCH_SIZES", ""), (1,))
 
-# ── Load image detection model once at startup ─────────────────
 IMAGE_MODEL_FILENAME = os.environ.get("HF_IMAGE_MODEL_FILENAME", "nonescape-mini-v0.safetensors").strip() or "nonescape-mini-v0.safetensors"
 HF_IMAGE_MODEL_REPO = os.environ.get("HF_IMAGE_MODEL_REPO", "").strip()
+IMAGE_MODEL_DIR = os.path.join(_THIS_DIR, "nonescape")
+
+# The full Nonescape model switches to its fused SDPA forward (bf16 autocast on
+# CPUs with native bf16) after it's checked against the reference forward.
+IMAGE_FAST_PATH = os.environ.get("IMAGE_FAST_PATH", "auto").strip().lower() or "auto"
+FAST_PATH_DTYPES = {"auto": None, "bf16": torch.bfloat16, "fp32": torch.float32}
+if IMAGE_FAST_PATH not in FAST_PATH_DTYPES and IMAGE_FAST_PATH != "off":
+    raise ValueError(f"IMAGE_FAST_PATH must be auto, bf16, fp32 or off, got {IMAGE_FAST_PATH!r}")
+
+TEXT_MODEL_FILENAME = os.environ.get("HF_TEXT_MODEL_FILENAME", "best_text_detector_smaller.safetensors").strip() or "best_text_detector_smaller.safetensors"
+HF_TEXT_MODEL_REPO = os.environ.get("HF_TEXT_MODEL_REPO", "").strip()
+TEXT_MODEL_DIR = os.path.join(_THIS_DIR, "..", "model_training", "text_model")
+
+
+def resolve_weights(kind: str, repo: str, filename: str, local_dir: str) -> str:
+    """Download ``filename`` from a Hugging Face repo, or point at the local copy.
 
-if HF_IMAGE_MODEL_REPO:
+    A ``.safetensors`` file's ``<name>.manifest.json`` is downloaded with it
+    when the repo has one, so the weights can be verified against it.
+    """
+    if os.path.basename(filename) != filename:
+        raise ValueError(f"model filename must not contain a path: {filename!r}")
+    if not repo:
+        return os.path.join(local_dir, filename)
     from huggingface_hub import hf_hub_download
-    print(f"[SlopMop] Downloading image model from Hugging Face ({HF_IMAGE_MODEL_REPO})...", flush=True)
-    MODEL_PATH = hf_hub_download(
-        repo_id=HF_IMAGE_MODEL_REPO,
-        filename=IMAGE_MODEL_FILENAME,
-        local_dir=os.path.join(_THIS_DIR, "nonescape"),
+    from huggingface_hub.errors import EntryNotFoundError
+    print(f"[SlopMop] Downloading {kind} model from Hugging Face ({repo})...", flush=True)
+    path = hf_hub_download(repo_id=repo, filename=filename, local_dir=local_dir)
+    if filename.endswith(".safetensors"):
+        try:
+            hf_hub_download(repo_id=repo, filename=filename + MANIFEST_SUFFIX, local_dir=local_dir)
+        except EntryNotFoundError:
+            print(f"[SlopMop] WARNING: {repo} has no {filename + MANIFEST_SUFFIX}; weights are unverified", flush=True)
+    print(f"[SlopMop] {kind.capitalize()} model downloaded: {path}", flush=True)
+    return path
+
+
+def _version_of(kind: str, path: str) -> str:
+    # safetensors checkpoints carry their sha256 in a manifest; no need to rehash
+    manifest = read_manifest(path) if path.endswith(".safetensors") else None
+    digest = manifest["sha256"] if manifest else file_digest(path)
+    return f"{kind}:{os.path.basename(path)}@{digest[:12]}"
+
+
+def load_image_model(repo: str = "", filename: str = IMAGE_MODEL_FILENAME, version: str = "") -> ModelVersion:
+    path = resolve_weights("image", repo, filename, IMAGE_MODEL_DIR)
+    variant = "mini" if "mini" in os.path.basename(path).lower() else "full"
+    model_class = NonescapeClassifierMini if variant == "mini" else NonescapeClassifier
+    model = model_class.from_pretrained(path)
+    model.eval()
+    print(f"[SlopMop] Loaded image model: {variant} ({path})", flush=True)
+    fast_path = None
+    if variant == "full" and IMAGE_FAST_PATH != "off":
+        report = model.optimize_for_inference(FAST_PATH_DTYPES[IMAGE_FAST_PATH])
+        fast_path = report["dtype"]
+        print(f"[SlopMop] Image fast path: {fast_path or 'rejected'} (max abs diff {report['max_abs_diff']})", flush=True)
+    runner = serving.BucketedRunner("image", model, SERVING_COMPILE, SERVING_BATCH_SIZES)
+    return ModelVersion(
+        "image", version or _version_of("image", path), model, runner,
+        source=f"{repo}/{filename}" if repo else path, variant=variant, fast_path=fast_path,
     )
-    print(f"[SlopMop] Image model downloaded: {MODEL_PATH}", flush=True)
-else:
-    MODEL_PATH = os.path.join(
-        _THIS_DIR,
-        "nonescape",
-        IMAGE_MODEL_FILENAME,
+
+
+def load_text_model(repo: str = "", filename: str = TEXT_MODEL_FILENAME, version: str = "") -> ModelVersion:
+    path = resolve_weights("text", repo, filename, TEXT_MODEL_DIR)
+    detector = TextDetectors()
+    heads = ("ai",)
+    module = serving.TextLogits(detector.model)
+    legacy = None if os.path.exists(path) else legacy_checkpoint_for(path)
+    if legacy:
+        # an unconverted checkpoint is the trained model; never serve the base model in its place
+        raise FileNotFoundError(
+            f"No text model weights at {path}, but there is a pickled checkpoint at {legacy}. Convert it once "
+            f"by running `python checkpoint_io.py {legacy} {path}` in model_training/text_model"
+        )
+    if os.path.exists(path):
+        # memory-mapped safetensors, checked against its manifest if it has one; pickles are refused
+        multi_head = load_text_weights(detector, path)
+        if multi_head is not None:
+            # shared encoder + AI-text and satire heads: both scores from one forward pass
+            heads = tuple(multi_head.heads)
+            module = serving.MultiHeadLogits(multi_head)
+        print(f"Loaded text model weights from {path} (heads: {', '.join(heads)})")
+        default_version = _version_of("text", path)
+    elif repo or version:
+        # a requested swap must not silently fall back to the base model
+        raise FileNotFoundError(f"No text model weights at {path}")
+    else:
+        print(f"WARNING: No text model weights at {path}, using base model")
+        default_version = f"text:{detector.model_name}@base"
+    runner = serving.BucketedRunner("text", module, SERVING_COMPILE, SERVING_BATCH_SIZES)
+    return ModelVersion(
+        "text", version or default_version, detector, runner,
+        source=f"{repo}/{filename}" if repo else path, heads=list(heads),
     )
 
-image_model.eval()
-print(f"[SlopMop] Loaded image model: {_IMAGE_MODEL_VARIANT} ({MODEL_PATH})", flush=True)
 
-# ── Load text detection model once at startup ──────────────────
-TEXT_MODEL_FILENAME = "best_text_detector_smaller.pt"
-HF_TEXT_MODEL_REPO = os.environ.get("HF_TEXT_MODEL_REPO", "").strip()
+def warm_up(model_version: ModelVersion) -> float:
+    """Run every padding bucket / batch size through a model version; returns seconds."""
+    if not SERVING_WARMUP:
+        return 0.0
+    if model_version.kind == "text":
+        detector = model_version.model
+        examples = serving.text_warmup_examples(
+            detector.tokenizer.vocab_size, TEXT_PAD_BUCKETS, SERVING_BATCH_SIZES, detector.device
+        )
+    else:
+        examples = serving.image_warmup_examples(SERVING_BATCH_SIZES, "cpu")
+    return model_version.runner.warmup(examples)
 
-if HF_TEXT_MODEL_REPO:
-    from huggingface_hub import hf_hub_download
-    print(f"[SlopMop] Downloading text model from Hugging Face ({HF_TEXT_MODEL_REPO})...", flush=True)
-    TEXT_MODEL_WEIGHTS = hf_hub_download(
-        repo_id=HF_TEXT_MODEL_REPO,
-        filename=TEXT_MODEL_FILENAME,
-        local_dir=os.path.join(_THIS_DIR, "..", "model_training", "text_model"),
-    )
-    print(f"[SlopMop] Text model downloaded: {TEXT_MODEL_WEIGHTS}", flush=True)
-else:
-    TEXT_MODEL_WEIGHTS = os.path.join(
-        _THIS_DIR,
-        "..",
-        "model_training",
-        "text_model",
-        TEXT_MODEL_FILENAME,
+
+# ── Load models once at startup ────────────────────────────────
+# Later versions are loaded, warmed and swapped in through /admin/models
+# without a restart; handlers fetch the active version once per request, so
+# in-flight requests finish on the version they started with.
+models = ModelRegistry()
+models.activate(load_image_model(HF_IMAGE_MODEL_REPO, IMAGE_MODEL_FILENAME))
+models.activate(load_text_model(HF_TEXT_MODEL_REPO, TEXT_MODEL_FILENAME))
+readiness = serving.Readiness()
+
+metrics.Gauge(
+    "slopmop_model_info", "Active model version per kind (value is always 1).", ("kind", "version"),
+    function=lambda: {(kind, version): 1 for kind, version in models.versions().items()},
+)
+
+
+def tune_thread_layout(text: ModelVersion, image: ModelVersion) -> thread_tuning.ThreadLayout:
+    if thread_layout.source == "env" or not THREAD_TUNING or not SERVING_WARMUP:
+        return thread_layout
+    detector = text.model
+    # one typical post: batch 1 at the bucket closest to 128 tokens
+    length = min(TEXT_PAD_BUCKETS, key=lambda bucket: abs(bucket - 128))
+    text_args = serving.text_warmup_examples(detector.tokenizer.vocab_size, (length,), (1,), detector.device)[0]
+    image_args = serving.image_warmup_examples((1,), "cpu")[0]
+    layout, results = thread_tuning.tune(
+        {"text": lambda: text.runner(*text_args), "image": lambda: image.runner(*image_args)},
+        thread_tuning.candidate_layouts(CPUS, INFERENCE_WORKERS or None, INFERENCE_THREADS or None),
+        THREAD_TUNING_SECONDS,
     )
+    for row in results:
+        print(f"[SlopMop] Thread tuning: {row}", flush=True)
+    return layout
+
+
+def apply_thread_layout(layout: thread_tuning.ThreadLayout) -> None:
+    global thread_layout
+    thread_layout = layout
+    torch.set_num_threads(layout.threads)
+    forward_slots.set_limit(layout.workers)
+    # fresh worker threads, so they pick up the new intra-op thread count
+    text_executor.resize(TEXT_WORKERS or layout.workers)
+    image_executor.resize(IMAGE_WORKERS or layout.workers)
+    print(f"[SlopMop] Thread layout: {layout} on {CPUS} CPUs", flush=True)
+
+
+def warm_up_models():
+    try:
+        text, image = models.get("text"), models.get("image")
+        text_seconds = warm_up(text)
+        image_seconds = warm_up(image)
+        apply_thread_layout(tune_thread_layout(text, image))
+        readiness.mark_ready(
+            text_mode=text.runner.mode,
+            image_mode=image.runner.mode,
+            warmup_seconds=round(text_seconds + image_seconds, 3),
+            cpus=CPUS,
+            thread_layout=thread_layout.describe(),
+        )
+        print(
+            f"[SlopMop] Ready: text={text.runner.mode} ({text_seconds:.1f}s warmup), "
+            f"image={image.runner.mode} ({image_seconds:.1f}s warmup)",
+            flush=True,
+        )
+    except Exception as e:
+        readiness.mark_failed(f"{type(e).__name__}: {e}")
+        print(f"[SlopMop] Warmup failed: {e}", flush=True)
 
-text_detector = TextDetectors()
-if os.path.exists(TEXT_MODEL_WEIGHTS):
-    state = torch.load(TEXT_MODEL_WEIGHTS, map_location=text_detector.device)
-    text_detector.model.load_state_dict(state, strict=True)
-    text_detector.model.eval()
-    print(f"Loaded text model weights from {TEXT_MODEL_WEIGHTS}")
-else:
-    print(f"WARNING: No text model weights at {TEXT_MODEL_WEIGHTS}, using base model")
 
 MAX_TEXT_LENGTH = 5000
 
+# ── Near-duplicate index for copypasta / bot spam ──────────────
+# Texts whose MinHash Jaccard estimate against an already-scored text is at
+# least NEAR_DUP_THRESHOLD reuse that verdict instead of running the model.
+# NEAR_DUP_MAX_ENTRIES=0 disables the index.
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.9"))
+NEAR_DUP_MAX_ENTRIES = int(os.environ.get("NEAR_DUP_MAX_ENTRIES", "50000"))
+near_duplicates = NearDuplicateIndex(
+    threshold=NEAR_DUP_THRESHOLD,
+    max_entries=NEAR_DUP_MAX_ENTRIES,
+)
+
+metrics.Counter(
+    "slopmop_cache_lookups", "Cache lookups.", ("cache",),
+    function=lambda: {("near_duplicate",): near_duplicates.stats()["lookups"]},
+)
+metrics.Counter(
+    "slopmop_cache_hits", "Cache hits, i.e. model calls saved.", ("cache",),
+    function=lambda: {("near_duplicate",): near_duplicates.stats()["hits"]},
+)
+metrics.Gauge(
+    "slopmop_cache_entries", "Entries currently held by each cache.", ("cache",),
+    function=lambda: {("near_duplicate",): near_duplicates.stats()["entries"]},
+)
+
+
+# ── Single-flight: identical requests that are in flight concurrently ─
+# A viral post is often requested by many clients before its verdict is
+# cached; the first request queues a job and the rest wait for its result.
+# They are matched on the event loop by a hash of the raw text or base64
+# payload, before anything is queued, so waiting requests never hold a
+# worker thread (see enqueue_coalesced).
+in_flight = {"text": SingleFlight(), "image": SingleFlight()}
+
+metrics.Counter(
+    "slopmop_single_flight_shared",
+    "Requests that reused an identical in-flight computation instead of running the model.",
+    ("model",),
+    function=lambda: {(kind,): flight.stats()["shared"] for kind, flight in in_flight.items()},
+)
+
+
+Priority = Literal["high", "normal", "low"]
+
 
 class DetectRequest(BaseModel):
     text: str
+    priority: Priority = "normal"       # "high" for posts on screen, "low" for prefetch
+    deadline_ms: Optional[int] = None   # give up (504) if not started within this many ms
 
 
 class DetectResponse(BaseModel):
     confidence: float  # 0.0 = human, 1.0 = AI
     label: str  # "ai" or "human"
     explanation: str  # explanation for the detection
+    model_version: str  # version of the text model that produced the score
+    satire_score: Optional[float] = None  # 0.0 = sincere, 1.0 = satire; only with a multi-head model
 
 
 class DetectImageRequest(BaseModel):
     image_base64: str          # raw base64-encoded image bytes
     mime_type: str = "image/jpeg"
+    priority: Priority = "normal"       # /detect-image only; posts and batches set it once
+    deadline_ms: Optional[int] = None   # /detect-image only; posts and batches set it once
 
 
 class DetectImageResponse(BaseModel):
     confidence: float          # 0.0 = authentic, 1.0 = AI-generated
     label: str                 # "ai" or "human"
     explanation: str
+    model_version: str
+
+
+class ModelLoadRequest(BaseModel):
+    repo: str = ""             # Hugging Face repo; empty loads from the local model directory
+    filename: str = ""         # defaults to the startup filename for that kind
+    version: str = ""          # label to report; defaults to <kind>:<file>@<sha256 prefix>
 
 
 @app.get("/")
@@ -113,14 +378,112 @@ def root():
     return {"status": "ok", "message": "SlopMop Detection API"}
 
 
+@app.get("/ready")
+def ready():
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content=readiness.detail)
+    return readiness.detail
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# ── Admin: hot model swap ──────────────────────────────────────
+# Disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "").strip()
+_MODEL_LOADERS = {
+    "text": (load_text_model, TEXT_MODEL_FILENAME),
+    "image": (load_image_model, IMAGE_MODEL_FILENAME),
+}
+
+
+def require_admin(token: str) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+def list_models(x_admin_token: str = Header(default="")):
+    require_admin(x_admin_token)
+    return models.describe()
+
+
+@app.post("/admin/models/{kind}", status_code=202)
+def load_model(kind: str, request: ModelLoadRequest, x_admin_token: str = Header(default="")):
+    require_admin(x_admin_token)
+    if kind not in _MODEL_LOADERS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    loader, default_filename = _MODEL_LOADERS[kind]
+    filename = request.filename.strip() or default_filename
+    if os.path.basename(filename) != filename:
+        raise HTTPException(status_code=400, detail="filename must not contain a path")
+    try:
+        return models.load_in_background(
+            kind,
+            lambda: loader(request.repo.strip(), filename, request.version.strip()),
+            warm_up,
+        )
+    except RegistryBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+# clean a text and look it up in the near-duplicate index
+# returns (cleaned, signature, cached result or None)
+def lookup_text(active: ModelVersion, text: str) -> tuple:
+    with metrics.stage("clean"):
+        cleaned = preprocess_text(text)
+    with metrics.stage("dedup"):
+        signature = near_duplicates.signature(cleaned)
+        # only verdicts of the active model version match, so a hot swap starts from misses
+        cached = near_duplicates.query(signature, active.version)
+    return cleaned, signature, cached
+
+
+# score a micro-batch of (cleaned, signature) pairs in one forward pass
+# returns one (confidence, label, model_version, satire_score or None) per item
+def score_cleaned_texts(active: ModelVersion, items: list[tuple]) -> list[tuple]:
+    detector = active.model
+    with metrics.stage("tokenize"):
+        enc = detector.tokenize([cleaned for cleaned, _ in items], pad_buckets=TEXT_PAD_BUCKETS)
+    with forward_slots, metrics.stage("forward"):
+        logits = active.runner(enc["input_ids"], enc["attention_mask"])
+        # multi-head models return every head's logits side by side
+        head_logits = dict(zip(active.info["heads"], logits.chunk(len(active.info["heads"]), dim=-1)))
+        probs = detector.logits_to_probs(head_logits["ai"])
+        satire = head_logits.get("satire")
+        satire_scores = (
+            torch.softmax(satire, dim=-1)[:, 1].tolist() if satire is not None else [None] * len(items)
+        )
+    metrics.BATCH_SIZE.observe(len(items), model="text")
+
+    results = []
+    with metrics.stage("postprocess"):
+        for (cleaned, signature), prob, satire_score in zip(items, probs, satire_scores):
+            confidence, label = detector.finalize(cleaned, prob)
+            # finalize returns float 0..1 and label "human"/"mixed"/"ai"
+            # normalize label to "ai" or "human" for the API response
+            if label == "mixed":
+                label = "ai" if confidence >= 0.5 else "human"
+            satire_score = round(satire_score, 4) if satire_score is not None else None
+            results.append((round(confidence, 4), label, active.version, satire_score))
+    for (_, signature), result in zip(items, results):
+        near_duplicates.add(signature, result, active.version)
+    return results
+
+
 # helper function to score text using the trained model
-def score_text(text: str) -> tuple[float, str]:
-    confidence, label = text_detector.calculate_confidence(text, clean=True)
-    # calculate_confidence returns float 0..1 and label "human"/"mixed"/"ai"
-    # normalize label to "ai" or "human" for the API response
-    if label == "mixed":
-        label = "ai" if confidence >= 0.5 else "human"
-    return round(confidence, 4), label
+# returns (confidence, label, model_version, satire_score or None)
+def score_text(text: str) -> tuple[float, str, str, Optional[float]]:
+    # one registry lookup per request: a concurrent swap can't mix versions
+    active = models.get("text")
+    cleaned, signature, cached = lookup_text(active, text)
+    if cached is not None:
+        return cached
+    return score_cleaned_texts(active, [(cleaned, signature)])[0]
 
 def generate_explanation(confidence: float, label: str) -> str:
     if label == "ai":
@@ -133,10 +496,9 @@ def generate_explanation(confidence: float, label: str) -> str:
         "The text contains few AI-style marker phrases based on current rules."
     )
 
-@app.post("/detect", response_model=DetectResponse)
-def detect(request: DetectRequest):
+def check_text(text: str) -> str:
     # strip spaces from head and tail of text
-    clean_text = request.text.strip()
+    clean_text = text.strip()
 
     # return HTTP 400 if text is empty
     if not clean_text:
@@ -148,37 +510,621 @@ def detect(request: DetectRequest):
             status_code=400,
             detail=f"text must be at most {MAX_TEXT_LENGTH} characters",
         )
-    
-    # connect to model here in week 2 of sprint 1
-    confidence, label = score_text(clean_text)
-    explanation = generate_explanation(confidence, label)
-    return DetectResponse(confidence=confidence, label=label, explanation=explanation)
+    return clean_text
 
 
-@app.post("/detect-image", response_model=DetectImageResponse)
-def detect_image(request: DetectImageRequest):
+def text_response(result: tuple) -> DetectResponse:
+    confidence, label, model_version, satire_score = result
+    return DetectResponse(
+        confidence=confidence,
+        label=label,
+        explanation=generate_explanation(confidence, label),
+        model_version=model_version,
+        satire_score=satire_score,
+    )
+
+
+def run_detect(text: str) -> DetectResponse:
+    return text_response(score_text(check_text(text)))
+
+
+def image_bytes(request: DetectImageRequest) -> bytes:
     raw = request.image_base64.strip()
     if not raw:
         raise HTTPException(status_code=400, detail="image_base64 is required")
+    try:
+        return base64.b64decode(raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid image data")
 
+
+# decode and preprocess image bytes into a [3, H, W] tensor
+def load_image(img_bytes: bytes) -> torch.Tensor:
     try:
-        img_bytes = base64.b64decode(raw)
-        image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+        with metrics.stage("decode"):
+            image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid image data")
 
-    tensor = preprocess_image(image).unsqueeze(0)  # add batch dim
+    with metrics.stage("clean"):
+        return preprocess_image(image)
+
+
+def decode_image(request: DetectImageRequest) -> torch.Tensor:
+    return load_image(image_bytes(request))
+
+
+# score a micro-batch of preprocessed images in one forward pass
+def score_images(active: ModelVersion, tensors: list[torch.Tensor]) -> list[DetectImageResponse]:
+    with forward_slots, metrics.stage("forward"):
+        probs = active.runner(torch.stack(tensors))
+        ai_probs = probs[:, 1].tolist()
+    metrics.BATCH_SIZE.observe(len(tensors), model="image")
+
+    results = []
+    with metrics.stage("postprocess"):
+        for ai_prob in ai_probs:
+            label = "ai" if ai_prob > 0.5 else "human"
+            confidence = round(ai_prob, 4)
+            explanation = (
+                f"Nonescape-mini classified this image as {'AI-generated' if label == 'ai' else 'authentic'} "
+                f"with {confidence:.1%} confidence."
+            )
+            results.append(DetectImageResponse(
+                confidence=confidence, label=label, explanation=explanation, model_version=active.version
+            ))
+    return results
+
+
+def run_detect_image(request: DetectImageRequest) -> DetectImageResponse:
+    active = models.get("image")
+    return score_images(active, [load_image(image_bytes(request))])[0]
+
+
+# ── Admission control: per-client budgets and load shedding ─────
+# Requests are refused before any image decoding or tokenization: 503 when
+# the inference queue for their model already holds MAX_QUEUED_JOBS jobs,
+# 429 when the client has spent its budget. ADMISSION_LIMITS is a JSON object
+# of per-client limits (see admission.py); "off" disables the per-client
+# budgets, MAX_QUEUED_JOBS=0 disables shedding.
+ADMISSION_LIMITS = os.environ.get("ADMISSION_LIMITS", "").strip()
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "256"))
+IMAGE_SNIFF_CHARS = 64 * 1024  # base64 chars read to find an image's dimensions
+admission = None if ADMISSION_LIMITS.lower() == "off" else AdmissionController(*parse_limits(ADMISSION_LIMITS))
+
+THROTTLED = metrics.Counter(
+    "slopmop_throttled", "Requests refused by admission control.", ("model", "reason")
+)
+
+
+def text_cost(text: str) -> int:
+    # ~4 characters per token; the model never sees more than the largest bucket
+    return min(len(text) // 4 + 1, max(TEXT_PAD_BUCKETS))
+
+
+def image_cost(image_base64: str) -> int:
+    # pixel count from the image header, read from a short prefix only
+    prefix = image_base64.strip()[:IMAGE_SNIFF_CHARS]
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(prefix[:len(prefix) // 4 * 4]))) as image:
+            width, height = image.size
+        return width * height
+    except Exception:
+        # header not within the prefix (or not an image): assume ~1 bit per pixel
+        return len(image_base64) * 6
+
+
+def client_identity(connection: HTTPConnection) -> str:
+    if admission is None:
+        return ""
+    return admission.identify(
+        [connection.headers.get("x-api-key"), connection.headers.get("x-client-id")],
+        connection.client.host if connection.client else "unknown",
+    )
+
+
+def admit(client: str, kind: str, cost) -> None:
+    """Charge ``cost()`` to the client's ``kind`` budget or raise 503 / 429."""
+    admit_all(client, {kind: cost})
+
+
+def admit_all(client: str, costs: dict) -> None:
+    """Charge each ``kind: cost`` to the client's budgets, or raise 503 / 429
+    without charging any of them."""
+    for kind in costs:
+        if MAX_QUEUED_JOBS and sum(executor_for(kind).stats()["queued"].values()) >= MAX_QUEUED_JOBS:
+            THROTTLED.inc(model=kind, reason="overloaded")
+            raise HTTPException(status_code=503, detail="Server overloaded", headers={"Retry-After": "1"})
+    if admission is None:
+        return
+    kind, wait = admission.admit_all(client, costs)
+    if wait > 0:
+        THROTTLED.inc(model=kind, reason="rate_limited")
+        raise HTTPException(
+            status_code=429, detail="Rate limit exceeded", headers={"Retry-After": str(math.ceil(min(wait, 3600)))}
+        )
+
+
+# ── Inference queues: priorities and deadlines ────────────────
+# Text and image inference run on separate worker pools, so a burst of
+# image-heavy work can't starve text scoring (or vice versa). Each pool's
+# queue serves "high" before "normal" before "low" (FIFO within a level), so
+# the post on screen is scored before prefetch for posts further down the
+# feed. A request whose deadline_ms runs out while it is queued never reaches
+# the model and gets a 504.
+# Pool sizes follow the thread layout unless TEXT_WORKERS / IMAGE_WORKERS pin
+# them; either way at most thread_layout.workers forward passes run at once.
+TEXT_WORKERS = int(os.environ.get("TEXT_WORKERS", "0") or 0)
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "0") or 0)
+text_executor = PriorityExecutor(TEXT_WORKERS or thread_layout.workers, thread_name_prefix="slopmop-text")
+image_executor = PriorityExecutor(IMAGE_WORKERS or thread_layout.workers, thread_name_prefix="slopmop-image")
+forward_slots = serving.ConcurrencyLimit(thread_layout.workers)
+
+INFERENCE_QUEUE_WAIT = metrics.Histogram(
+    "slopmop_inference_queue_wait_seconds",
+    "Time a job waited in an inference queue before a worker picked it up.",
+    ("model", "priority"),
+)
+
+
+def _queue_stats(key: str) -> dict:
+    return {
+        (kind, priority): count
+        for kind in ("text", "image")
+        for priority, count in executor_for(kind).stats()[key].items()
+    }
+
+
+metrics.Gauge(
+    "slopmop_inference_queue_depth", "Jobs waiting in each inference queue.", ("model", "priority"),
+    function=lambda: _queue_stats("queued"),
+)
+metrics.Counter(
+    "slopmop_deadline_expired", "Jobs dropped because their deadline passed while queued.", ("model", "priority"),
+    function=lambda: _queue_stats("expired"),
+)
+
+
+def executor_for(kind: str) -> PriorityExecutor:
+    return text_executor if kind == "text" else image_executor
+
 
-    with torch.no_grad():
-        probs = image_model(tensor)
-        authentic_prob = probs[0][0].item()
-        ai_prob = probs[0][1].item()
+def _run_queued(kind: str, priority: str, submitted: float, fn, *args):
+    wait = time.perf_counter() - submitted
+    INFERENCE_QUEUE_WAIT.observe(wait, model=kind, priority=priority)
+    timings = metrics.current_request()
+    if timings is not None:
+        timings.record("inference_queue", wait)
+    return fn(*args)
 
-    label = "ai" if ai_prob > 0.5 else "human"
-    confidence = round(ai_prob, 4)
-    explanation = (
-        f"Nonescape-mini classified this image as {'AI-generated' if label == 'ai' else 'authentic'} "
-        f"with {confidence:.1%} confidence."
+
+def enqueue(kind: str, fn, *args, priority: str = "normal", deadline: Optional[float] = None) -> Future:
+    # executor threads don't inherit contextvars; copy them so stages are
+    # still recorded on this request's timings (one copy per job, since a
+    # context can't be entered by two threads at once)
+    ctx = contextvars.copy_context()
+    return executor_for(kind).submit(
+        ctx.run, _run_queued, kind, priority, time.perf_counter(), fn, *args, priority=priority, deadline=deadline
     )
 
-    return DetectImageResponse(confidence=confidence, label=label, explanation=explanation)
+
+def submit(kind: str, fn, *args, priority: str = "normal", deadline: Optional[float] = None) -> asyncio.Future:
+    return asyncio.wrap_future(enqueue(kind, fn, *args, priority=priority, deadline=deadline))
+
+
+# single-flight key of a request's content for the active model version
+def content_key(kind: str, content: str) -> tuple:
+    return (models.get(kind).version, hashlib.sha256(content.strip().encode("utf-8")).hexdigest())
+
+
+# enqueue a job unless an identical one (same content and priority) is in
+# flight; a follower gets a ticket for the leader's job and takes no worker
+def enqueue_coalesced(
+    kind: str, key: tuple, fn, *args, priority: str = "normal", deadline: Optional[float] = None
+) -> Future:
+    return in_flight[kind].join(
+        (priority, *key), lambda: enqueue(kind, fn, *args, priority=priority, deadline=deadline)
+    )
+
+
+async def submit_coalesced(
+    kind: str, key: tuple, fn, *args, priority: str = "normal", deadline: Optional[float] = None
+):
+    try:
+        return await asyncio.wrap_future(enqueue_coalesced(kind, key, fn, *args, priority=priority, deadline=deadline))
+    except DeadlineExceeded:
+        # the leader's deadline expired, but a follower's may not have
+        if deadline is not None and time.perf_counter() > deadline:
+            raise
+        return await submit(kind, fn, *args, priority=priority, deadline=deadline)
+
+
+DEADLINE_EXCEEDED = "Deadline exceeded before inference"
+
+
+# a request's deadline counts from when it was received
+def request_deadline(request) -> Optional[float]:
+    if request.deadline_ms is None:
+        return None
+    timings = metrics.current_request()
+    received = timings.received if timings is not None else time.perf_counter()
+    return received + request.deadline_ms / 1000
+
+
+# run one /detect or /detect-image job at the request's priority and deadline,
+# sharing an identical job already in flight
+async def schedule(kind: str, request, key: tuple, fn, *args):
+    try:
+        return await submit_coalesced(kind, key, fn, *args, priority=request.priority, deadline=request_deadline(request))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail=DEADLINE_EXCEEDED)
+
+
+# images nested in a post or batch run at the enclosing request's priority
+def _reject_per_image_scheduling(images: list[DetectImageRequest]) -> list[DetectImageRequest]:
+    for i, image in enumerate(images):
+        if image.model_fields_set & {"priority", "deadline_ms"}:
+            raise ValueError(f"images[{i}]: set priority/deadline_ms on the request, not on each image")
+    return images
+
+
+@app.post("/detect", response_model=DetectResponse)
+@metrics.instrumented
+async def detect(request: DetectRequest, client: str = Depends(client_identity)):
+    admit(client, "text", lambda: text_cost(request.text))
+    check_text(request.text)
+    return await schedule("text", request, content_key("text", request.text), run_detect, request.text)
+
+
+@app.post("/detect-image", response_model=DetectImageResponse)
+@metrics.instrumented
+async def detect_image(request: DetectImageRequest, client: str = Depends(client_identity)):
+    admit(client, "image", lambda: image_cost(request.image_base64))
+    return await schedule("image", request, content_key("image", request.image_base64), run_detect_image, request)
+
+
+# ── Posts: text and images scored concurrently ─────────────────
+# Text and image jobs go to their own pools, so a post's latency is the
+# slower of the two paths rather than their sum.
+MAX_POST_IMAGES = int(os.environ.get("MAX_POST_IMAGES", "8"))
+
+
+async def score_post_image(index: int, request: DetectImageRequest, **schedule_args) -> DetectImageResponse:
+    try:
+        return await submit_coalesced(
+            "image", content_key("image", request.image_base64), run_detect_image, request, **schedule_args
+        )
+    except HTTPException as e:
+        raise HTTPException(status_code=e.status_code, detail=f"images[{index}]: {e.detail}")
+
+
+class DetectPostRequest(BaseModel):
+    text: str = ""
+    images: list[DetectImageRequest] = []
+    priority: Priority = "normal"       # applies to the text and every image
+    deadline_ms: Optional[int] = None
+
+    _check_images = field_validator("images")(_reject_per_image_scheduling)
+
+
+class DetectPostResponse(BaseModel):
+    confidence: float          # highest confidence across the post's text and images
+    label: str                 # "ai" if the text or any image is flagged
+    text: Optional[DetectResponse] = None
+    images: list[DetectImageResponse] = []
+
+
+@app.post("/detect-post", response_model=DetectPostResponse)
+@metrics.instrumented
+async def detect_post(request: DetectPostRequest, client: str = Depends(client_identity)):
+    has_text = bool(request.text.strip())
+    if not has_text and not request.images:
+        raise HTTPException(status_code=400, detail="text or images is required")
+    if len(request.images) > MAX_POST_IMAGES:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_POST_IMAGES} images per post")
+    costs = {}
+    if has_text:
+        costs["text"] = lambda: text_cost(request.text)
+    if request.images:
+        costs["image"] = lambda: sum(image_cost(image.image_base64) for image in request.images)
+    admit_all(client, costs)
+    if has_text:
+        check_text(request.text)
+
+    schedule_args = {"priority": request.priority, "deadline": request_deadline(request)}
+    jobs = [asyncio.ensure_future(score_post_image(i, image, **schedule_args)) for i, image in enumerate(request.images)]
+    if has_text:
+        jobs.append(asyncio.ensure_future(
+            submit_coalesced("text", content_key("text", request.text), run_detect, request.text, **schedule_args)
+        ))
+    try:
+        results = await asyncio.gather(*jobs)
+    except BaseException as e:
+        for job in jobs:
+            job.cancel()
+        if isinstance(e, DeadlineExceeded):
+            raise HTTPException(status_code=504, detail=DEADLINE_EXCEEDED)
+        raise
+
+    text_result = results.pop() if has_text else None
+    parts = results + ([text_result] if text_result is not None else [])
+    return DetectPostResponse(
+        confidence=max(part.confidence for part in parts),
+        label="ai" if any(part.label == "ai" for part in parts) else "human",
+        text=text_result,
+        images=results,
+    )
+
+
+# ── Batches: micro-batched, optionally streamed ────────────────
+# A feed page is sent as one batch. Near-duplicate cache hits are answered
+# first, the rest is scored in micro-batches of MICRO_BATCH_SIZE on the text
+# and image pools. With `Accept: application/x-ndjson` or
+# `text/event-stream` every item is written as soon as its micro-batch
+# finishes, so overlays can render before the slowest item is done.
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "64"))
+MICRO_BATCH_SIZE = int(os.environ.get("MICRO_BATCH_SIZE", "8"))
+
+
+class DetectBatchRequest(BaseModel):
+    texts: list[str] = []
+    images: list[DetectImageRequest] = []
+    priority: Priority = "normal"       # applies to every micro-batch
+    deadline_ms: Optional[int] = None   # micro-batches still queued then report an error per item
+
+    _check_images = field_validator("images")(_reject_per_image_scheduling)
+
+
+class BatchItemResult(BaseModel):
+    kind: str                  # "text" or "image"
+    index: int                 # position in the request's texts / images
+    cached: bool = False       # answered from the near-duplicate cache
+    result: Optional[Union[DetectResponse, DetectImageResponse]] = None
+    error: Optional[str] = None  # per-item validation error; the rest of the batch still runs
+
+
+class DetectBatchResponse(BaseModel):
+    results: list[BatchItemResult]  # texts then images, in request order
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), max(size, 1))]
+
+
+# validate + cache lookup for every text; returns (hits and errors, misses)
+def lookup_batch_texts(active: ModelVersion, texts: list[str]) -> tuple[list[BatchItemResult], list[tuple]]:
+    answered, misses = [], []
+    for index, text in enumerate(texts):
+        try:
+            cleaned, signature, cached = lookup_text(active, check_text(text))
+        except HTTPException as e:
+            answered.append(BatchItemResult(kind="text", index=index, error=e.detail))
+            continue
+        if cached is not None:
+            answered.append(BatchItemResult(kind="text", index=index, cached=True, result=text_response(cached)))
+        else:
+            misses.append((index, cleaned, signature))
+    return answered, misses
+
+
+def score_batch_texts(active: ModelVersion, chunk: list[tuple]) -> list[BatchItemResult]:
+    results = score_cleaned_texts(active, [(cleaned, signature) for _, cleaned, signature in chunk])
+    return [
+        BatchItemResult(kind="text", index=index, result=text_response(result))
+        for (index, _, _), result in zip(chunk, results)
+    ]
+
+
+def score_batch_images(active: ModelVersion, chunk: list[tuple]) -> list[BatchItemResult]:
+    items, indices, tensors = [], [], []
+    for index, request in chunk:
+        try:
+            tensors.append(decode_image(request))
+            indices.append(index)
+        except HTTPException as e:
+            items.append(BatchItemResult(kind="image", index=index, error=e.detail))
+    if tensors:
+        items += [
+            BatchItemResult(kind="image", index=index, result=result)
+            for index, result in zip(indices, score_images(active, tensors))
+        ]
+    return items
+
+
+# yields results as they complete: cache hits and invalid items first, then
+# one group per finished micro-batch
+async def iter_batch(request: DetectBatchRequest):
+    text_model, image_model = models.get("text"), models.get("image")
+    priority, deadline = request.priority, request_deadline(request)
+    # the cache lookup has no deadline: it's cheap and answers what it can
+    answered, misses = await submit("text", lookup_batch_texts, text_model, request.texts, priority=priority)
+    if answered:
+        yield answered
+
+    jobs = {
+        submit("text", score_batch_texts, text_model, chunk, priority=priority, deadline=deadline):
+            ("text", [index for index, _, _ in chunk])
+        for chunk in _chunks(misses, MICRO_BATCH_SIZE)
+    }
+    jobs.update({
+        submit("image", score_batch_images, image_model, chunk, priority=priority, deadline=deadline):
+            ("image", [index for index, _ in chunk])
+        for chunk in _chunks(list(enumerate(request.images)), MICRO_BATCH_SIZE)
+    })
+    pending = set(jobs)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for job in done:
+                try:
+                    yield job.result()
+                except DeadlineExceeded:
+                    kind, indices = jobs[job]
+                    yield [BatchItemResult(kind=kind, index=index, error=DEADLINE_EXCEEDED) for index in indices]
+    finally:
+        # client went away (or a batch failed): drop micro-batches not started yet
+        for job in pending:
+            job.cancel()
+
+
+def _ndjson(item: BatchItemResult) -> str:
+    return item.model_dump_json(exclude_none=True) + "\n"
+
+
+def _sse(item: BatchItemResult) -> str:
+    return f"event: result\ndata: {item.model_dump_json(exclude_none=True)}\n\n"
+
+
+async def stream_batch(request: DetectBatchRequest, encode):
+    async for items in iter_batch(request):
+        for item in items:
+            yield encode(item)
+    if encode is _sse:
+        yield "event: done\ndata: {}\n\n"
+
+
+@app.post("/detect-batch", response_model=DetectBatchResponse)
+@metrics.instrumented
+async def detect_batch(
+    request: DetectBatchRequest, accept: str = Header(default=""), client: str = Depends(client_identity)
+):
+    total = len(request.texts) + len(request.images)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="texts or images is required")
+    if total > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_BATCH_ITEMS} items per batch")
+    costs = {}
+    if request.texts:
+        costs["text"] = lambda: sum(text_cost(text) for text in request.texts)
+    if request.images:
+        costs["image"] = lambda: sum(image_cost(image.image_base64) for image in request.images)
+    admit_all(client, costs)
+
+    if "application/x-ndjson" in accept:
+        return StreamingResponse(stream_batch(request, _ndjson), media_type="application/x-ndjson")
+    if "text/event-stream" in accept:
+        return StreamingResponse(
+            stream_batch(request, _sse), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+        )
+
+    results = [item async for items in iter_batch(request) for item in items]
+    results.sort(key=lambda item: (item.kind != "text", item.index))
+    return DetectBatchResponse(results=results)
+
+
+# ── WebSocket sessions: continuous feed scanning ───────────────
+# One connection per tab instead of one HTTP request per post. The client
+# sends {"id", "type": "text" | "image", ...} jobs and gets
+# {"id", "type": "result" | "error", ...} back as each finishes, in completion
+# order. {"id", "type": "cancel"} drops a job for a post that scrolled away:
+# if it is still queued it never runs, otherwise its result is discarded.
+MAX_SESSION_JOBS = int(os.environ.get("MAX_SESSION_JOBS", "64"))
+
+SESSION_JOBS = metrics.Counter(
+    "slopmop_session_jobs",
+    "WebSocket session jobs by outcome (dropped = cancelled before it ran, "
+    "discarded = cancelled while running).",
+    ("outcome",),
+)
+
+
+class SessionMessage(BaseModel):
+    id: str
+    type: str                  # "text", "image" or "cancel"
+    priority: Priority = "normal"
+    text: str = ""
+    image_base64: str = ""
+    mime_type: str = "image/jpeg"
+
+
+@metrics.instrumented
+def run_session_job(message: SessionMessage):
+    if message.type == "text":
+        return run_detect(message.text)
+    return run_detect_image(DetectImageRequest(image_base64=message.image_base64, mime_type=message.mime_type))
+
+
+@app.websocket("/ws")
+async def detect_session(websocket: WebSocket):
+    await websocket.accept()
+    client = client_identity(websocket)
+    jobs: dict[str, Future] = {}
+    deliveries: set[asyncio.Task] = set()
+    send_lock = asyncio.Lock()
+
+    async def send(message: dict) -> None:
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def deliver(job_id: str, job: Future, timings: metrics.RequestTimings) -> None:
+        try:
+            result = await asyncio.wrap_future(job)
+            message, outcome = {"id": job_id, "type": "result", "result": result.model_dump()}, "completed"
+        except asyncio.CancelledError:
+            return  # cancelled before it ran; already answered
+        except HTTPException as e:
+            message, outcome = {"id": job_id, "type": "error", "error": e.detail}, "failed"
+        except Exception as e:
+            message, outcome = {"id": job_id, "type": "error", "error": type(e).__name__}, "failed"
+        if jobs.get(job_id) is not job:
+            return  # cancelled while running: nobody wants the result
+        del jobs[job_id]
+        SESSION_JOBS.inc(outcome=outcome)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - timings.received, endpoint="/ws")
+        await send(message)
+
+    def cancel(job_id: str) -> bool:
+        dropped = jobs.pop(job_id).cancel()
+        SESSION_JOBS.inc(outcome="dropped" if dropped else "discarded")
+        return dropped
+
+    try:
+        while True:
+            try:
+                message = SessionMessage.model_validate_json(await websocket.receive_text())
+            except ValidationError as e:
+                await send({"type": "error", "error": f"invalid message: {e.errors()[0]['msg']}"})
+                continue
+
+            if message.type == "cancel":
+                if message.id in jobs:
+                    await send({"id": message.id, "type": "cancelled", "dropped": cancel(message.id)})
+                else:
+                    await send({"id": message.id, "type": "error", "error": "unknown or finished job"})
+                continue
+            if message.type not in ("text", "image"):
+                await send({"id": message.id, "type": "error", "error": f"unknown message type: {message.type}"})
+                continue
+            if message.id in jobs:
+                await send({"id": message.id, "type": "error", "error": "a job with this id is already running"})
+                continue
+            if len(jobs) >= MAX_SESSION_JOBS:
+                await send({"id": message.id, "type": "error", "error": f"at most {MAX_SESSION_JOBS} pending jobs"})
+                continue
+
+            try:
+                if message.type == "text":
+                    admit(client, "text", lambda: text_cost(message.text))
+                else:
+                    admit(client, "image", lambda: image_cost(message.image_base64))
+            except HTTPException as e:
+                await send({"id": message.id, "type": "error", "error": e.detail, "status": e.status_code})
+                continue
+
+            # each job gets its own timings so stages land under endpoint="/ws"
+            timings = metrics.start_request("/ws")
+            content = message.text if message.type == "text" else message.image_base64
+            jobs[message.id] = enqueue_coalesced(
+                message.type, content_key(message.type, content), run_session_job, message, priority=message.priority
+            )
+            task = asyncio.create_task(deliver(message.id, jobs[message.id], timings))
+            deliveries.add(task)
+            task.add_done_callback(deliveries.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # the tab is gone: drop everything it still had queued
+        for job_id in list(jobs):
+            cancel(job_id)
+        for task in deliveries:
+            task.cancel()
@@ -0,0 +1,284 @@
+"""Latency and resource metrics for the detection API.
+
+A small in-process registry rendered in the Prometheus text exposition format
+(served on ``/metrics``), plus per-request stage timing. Handlers wrap each
+stage in ``stage("forward")`` etc.; the durations land both in the
+``slopmop_stage_seconds`` histogram and in the request's ``Server-Timing``
+header.
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+# seconds; spans cache hits (sub-ms) up to a cold full-model forward pass
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[tuple[str, dict, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic counter. ``function`` turns it into a read-only view of an
+    external counter, returning either a number or ``{label_tuple: value}``."""
+
+    type_name = "counter"
+
+    def __init__(self, *args, function: Optional[Callable] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._function = function
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _current(self) -> dict[tuple, float]:
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self._function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def _samples(self):
+        for key, value in sorted(self._current().items()):
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    """Point-in-time value; same interface as ``Counter`` plus ``set``."""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        for key, value in sorted(self._current().items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: tuple = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: dict[tuple, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        with self._lock:
+            snapshot = {k: (list(c), s) for k, (c, s) in self._values.items()}
+        for key, (counts, total) in sorted(snapshot.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for upper, count in zip(self.buckets, counts):
+                cumulative += count
+                le = "+Inf" if math.isinf(upper) else repr(float(upper))
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def process_rss_bytes() -> float:
+    """Current resident set size; falls back to peak RSS where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return float(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return float(peak if sys.platform == "darwin" else peak * 1024)
+
+
+# ── Serving metrics shared by every endpoint ───────────────────
+REQUEST_SECONDS = Histogram(
+    "slopmop_request_seconds", "End-to-end request latency.", ("endpoint",)
+)
+STAGE_SECONDS = Histogram(
+    "slopmop_stage_seconds", "Time spent in each request stage.", ("endpoint", "stage")
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "slopmop_queue_wait_seconds",
+    "Time between receiving a request and a worker starting on it.",
+    ("endpoint",),
+)
+BATCH_SIZE = Histogram(
+    "slopmop_batch_size", "Number of inputs per model forward pass.", ("model",), buckets=BATCH_SIZE_BUCKETS
+)
+PROCESS_RSS = Gauge(
+    "slopmop_process_resident_memory_bytes", "Resident memory of the API process.", function=process_rss_bytes
+)
+
+
+# ── Per-request stage timing ───────────────────────────────────
+class RequestTimings:
+    """Stage durations (seconds) for one request, in the order they ran."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.received = time.perf_counter()
+        self.handler_done: Optional[float] = None
+        self.stages: list[tuple[str, float]] = []
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages.append((name, seconds))
+        STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("slopmop_request_timings", default=None)
+
+
+def start_request(endpoint: str) -> RequestTimings:
+    timings = RequestTimings(endpoint)
+    _current.set(timings)
+    return timings
+
+
+def current_request() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage ``name`` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.record(name, time.perf_counter() - start)
+
+
+def instrumented(handler: Callable) -> Callable:
+    """Decorator for endpoint handlers (sync or async): records queue wait
+    before the handler runs and marks when it finished so serialization
+    time can be measured."""
+
+    def started():
+        timings = _current.get()
+        if timings is not None:
+            wait = time.perf_counter() - timings.received
+            timings.record("queue", wait)
+            QUEUE_WAIT_SECONDS.observe(wait, endpoint=timings.endpoint)
+        return timings
+
+    def finished(timings):
+        if timings is not None:
+            timings.handler_done = time.perf_counter()
+
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(*args, **kwargs):
+            timings = started()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                finished(timings)
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        timings = started()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            finished(timings)
+
+    return wrapper
@@ -0,0 +1,140 @@
+"""Versioned model registry with background loading and atomic hot swap.
+
+Each model kind ("text", "image") has exactly one active ``ModelVersion``.
+Request handlers call ``registry.get(kind)`` once and use that object for the
+whole request, so swapping in a new version never affects requests already in
+flight: they finish on the old version, which is freed once the last of them
+drops its reference.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a weights file, used to derive a default version string."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelVersion:
+    """A loaded model plus everything needed to serve it."""
+
+    def __init__(self, kind: str, version: str, model: Any, runner: Any, source: str, **info):
+        self.kind = kind
+        self.version = version
+        self.model = model
+        self.runner = runner
+        self.source = source
+        self.info = info
+        self.loaded_at = time.time()
+
+    def describe(self) -> dict:
+        return {
+            "kind": self.kind,
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            **self.info,
+        }
+
+
+class RegistryBusy(Exception):
+    """A load for this model kind is already in progress."""
+
+
+class ModelRegistry:
+    def __init__(self, max_jobs: int = 20):
+        self._lock = threading.Lock()
+        self._active: dict[str, ModelVersion] = {}
+        # job records in start order; only the last ``max_jobs`` are kept
+        self._jobs: dict[str, dict] = {}
+        self._max_jobs = max_jobs
+        self._loading: set[str] = set()
+
+    def activate(self, model_version: ModelVersion) -> Optional[ModelVersion]:
+        """Atomically make ``model_version`` the active one; returns the previous."""
+        with self._lock:
+            previous = self._active.get(model_version.kind)
+            self._active[model_version.kind] = model_version
+        return previous
+
+    def get(self, kind: str) -> ModelVersion:
+        return self._active[kind]
+
+    def kinds(self) -> list[str]:
+        return list(self._active)
+
+    def versions(self) -> dict[str, str]:
+        return {kind: mv.version for kind, mv in self._active.items()}
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "active": {kind: mv.describe() for kind, mv in self._active.items()},
+                "jobs": [dict(job) for job in reversed(self._jobs.values())],
+            }
+
+    def job(self, job_id: str) -> Optional[dict]:
+        """Snapshot of a job record, or None if it is unknown or was evicted."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _update_job(self, job: dict, **fields) -> None:
+        with self._lock:
+            job.update(fields)
+
+    def load_in_background(
+        self,
+        kind: str,
+        loader: Callable[[], ModelVersion],
+        warmup: Callable[[ModelVersion], Any],
+    ) -> dict:
+        """Load, warm up and then activate a new version of ``kind`` on a thread.
+
+        Returns a snapshot of the new job record; ``job(id)`` and
+        ``describe()`` show it moving through ``loading`` -> ``warming`` ->
+        ``active`` (or ``failed``). Raises ``RegistryBusy`` if a load for
+        ``kind`` is already running.
+        """
+        with self._lock:
+            if kind in self._loading:
+                raise RegistryBusy(f"a {kind} model load is already in progress")
+            self._loading.add(kind)
+            job = {"id": uuid.uuid4().hex[:12], "kind": kind, "state": "loading", "started_at": time.time()}
+            self._jobs[job["id"]] = job
+            # evict the oldest finished jobs; running ones (one per kind at most) stay
+            finished = [j["id"] for j in self._jobs.values() if "finished_at" in j]
+            for job_id in finished[: max(len(self._jobs) - self._max_jobs, 0)]:
+                del self._jobs[job_id]
+            snapshot = dict(job)
+
+        def run():
+            result = {"state": "failed"}
+            try:
+                model_version = loader()
+                self._update_job(job, version=model_version.version, state="warming")
+                warmup(model_version)
+                previous = self.activate(model_version)
+                result = {"state": "active", "replaced": previous.version if previous else None}
+                print(f"[SlopMop] Activated {kind} model {model_version.version}", flush=True)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                print(f"[SlopMop] Loading {kind} model failed: {result['error']}", flush=True)
+            finally:
+                # the final state and the free load slot become visible together
+                with self._lock:
+                    job.update(result, finished_at=time.time())
+                    self._loading.discard(kind)
+
+        threading.Thread(target=run, name=f"slopmop-load-{kind}", daemon=True).start()
+        return snapshot
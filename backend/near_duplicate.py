@@ -0,0 +1,171 @@
+"""Near-duplicate index for repeated text (copypasta, bot spam).
+
+Copies of the same post usually differ by a few words, so an exact-match cache
+misses them. Each cleaned text is reduced to a MinHash signature over word
+shingles; LSH banding buckets the signatures so a lookup only compares against
+the handful of entries that share at least one band, and a candidate is reused
+when its estimated Jaccard similarity clears the configured threshold.
+"""
+
+from __future__ import annotations
+
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _choose_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Pick (bands, rows) with bands * rows == num_perm for the given threshold.
+
+    The LSH S-curve has its steepest point near (1 / bands) ** (1 / rows). We take
+    the largest such point that is still at or below the threshold so true
+    near-duplicates become candidates; false candidates are filtered afterwards
+    by the signature comparison.
+    """
+    options = []
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        options.append(((1.0 / bands) ** (1.0 / rows), bands, rows))
+
+    below = [o for o in options if o[0] <= threshold]
+    _, bands, rows = max(below) if below else min(options)
+    return bands, rows
+
+
+class NearDuplicateIndex:
+    """Bounded MinHash/LSH index mapping near-duplicate texts to a stored value.
+
+    Entries are evicted least-recently-used once ``max_entries`` is reached.
+    Each entry belongs to a ``namespace`` (e.g. the model version that
+    produced it) and only matches queries in the same namespace, so entries
+    from an old namespace are never hits and simply age out.
+    All public methods are thread-safe.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        max_entries: int = 50_000,
+        shingle_size: int = 3,
+        seed: int = 1,
+    ):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        if num_perm <= 0:
+            raise ValueError("num_perm must be positive")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.max_entries = max_entries
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[np.ndarray, Any, Hashable]] = OrderedDict()
+        self._buckets: list[dict[bytes, set[int]]] = [{} for _ in range(self.bands)]
+        self._next_id = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.inserts = 0
+        self.evictions = 0
+
+    def _shingles(self, text: str) -> set[str]:
+        words = text.lower().split()
+        if len(words) < self.shingle_size:
+            return {" ".join(words)}
+        k = self.shingle_size
+        return {" ".join(words[i : i + k]) for i in range(len(words) - k + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of ``text`` (expected to be cleaned already)."""
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in self._shingles(text)),
+            dtype=np.uint64,
+        )
+        # uint64 products wrap on overflow, which is fine for hashing purposes
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        r = self.rows
+        return [signature[i * r : (i + 1) * r].tobytes() for i in range(self.bands)]
+
+    def query(self, signature: np.ndarray, namespace: Hashable = None) -> Optional[Any]:
+        """Return the value of the most similar entry in ``namespace`` above the threshold, if any."""
+        with self._lock:
+            self.lookups += 1
+            candidates: set[int] = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(key, ()))
+
+            best_id, best_sim = None, self.threshold
+            for entry_id in candidates:
+                entry_signature, _, entry_namespace = self._entries[entry_id]
+                if entry_namespace != namespace:
+                    continue
+                sim = float(np.mean(entry_signature == signature))
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][1]
+
+    def add(self, signature: np.ndarray, value: Any, namespace: Hashable = None) -> None:
+        """Store ``value`` under ``signature`` in ``namespace``, evicting the oldest entries if full."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._evict_oldest()
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, value, namespace)
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(key, set()).add(entry_id)
+            self.inserts += 1
+
+    def _evict_oldest(self) -> None:
+        entry_id, (signature, _, _) = self._entries.popitem(last=False)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            ids = bucket.get(key)
+            if ids is None:
+                continue
+            ids.discard(entry_id)
+            if not ids:
+                del bucket[key]
+        self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets = [{} for _ in range(self.bands)]
+
+    def stats(self) -> dict:
+        """Counters; ``hits`` is the number of model calls the index saved."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "inserts": self.inserts,
+                "evictions": self.evictions,
+            }
@@ -23,21 +23,36 @@ Single GPU/CPU:
 
 Multi-GPU with torchrun:
 `torchrun --nproc_per_node=8 aria_test.py model.safetensors --data-path ./aria_dataset`
+
+Cached tensor shards (decode + preprocess once, then stream memory-mapped uint8 shards):
+`python aria_test.py model.safetensors --data-path ./aria_dataset --cache-dir ./aria_cache`
 """
 
 import argparse
+import hashlib
+import json
 import os
 import random
+import time
+import uuid
 from pathlib import Path
 from typing import List, Tuple
 
+import numpy as np
 import torch
 import torch.distributed as dist
+import torchvision
 from PIL import Image
-from sklearn.metrics import accuracy_score, average_precision_score
-from torch.utils.data import Dataset, DataLoader, DistributedSampler
+from torch.utils.data import Dataset, DataLoader, DistributedSampler, Subset
 from tqdm import tqdm
-from nonescape import NonescapeClassifier, NonescapeClassifierMini, preprocess_image
+from nonescape import (
+    PREPROCESS_CONFIG,
+    NonescapeClassifier,
+    NonescapeClassifierMini,
+    normalize_image,
+    preprocess_image,
+    preprocess_image_uint8,
+)
 
 AI_DIRS = ["DALL-E", "DreamStudio", "Midjourney", "StarryAI"]
 IMG_TYPES = ["T2I", "IT2I"]
@@ -54,8 +69,9 @@ CAT_TO_ID = {name: cat_id for cat_id, name in CATEGORIES.items()}
 
 
 class ARIADataset(Dataset):
-    def __init__(self, image_paths_and_categories: List[Tuple[str, int]]):
+    def __init__(self, image_paths_and_categories: List[Tuple[str, int]], raw: bool = False):
         self.items = image_paths_and_categories
+        self.preprocess = preprocess_image_uint8 if raw else preprocess_image
 
     def __len__(self):
         return len(self.items)
@@ -63,10 +79,228 @@ class ARIADataset(Dataset):
     def __getitem__(self, idx):
         img_path, category_id = self.items[idx]
         with Image.open(img_path) as image:
-            tensor = preprocess_image(image.convert("RGB"))
+            tensor = self.preprocess(image.convert("RGB"))
         return tensor, category_id
 
 
+def preprocess_config_hash() -> str:
+    """Hash of everything that determines the cached uint8 tensors."""
+    payload = {"config": PREPROCESS_CONFIG, "torchvision": torchvision.__version__}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def feature_config_hash(model: NonescapeClassifier, dtype: str) -> str:
+    """Hash of everything that determines cached DINOv2 features: preprocessing, backbone weights, dtype."""
+    h = hashlib.sha256(f"{preprocess_config_hash()}:{dtype}".encode())
+    for name, tensor in sorted(model.vit_backbone.state_dict().items()):
+        h.update(name.encode())
+        h.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class ShardedARIADataset(Dataset):
+    """Reads fixed-shape rows from memory-mapped ``.npy`` shards."""
+
+    def __init__(self, root: Path, locations: List[Tuple[str, int, int]]):
+        self.root = root
+        self.locations = locations  # (shard file, row, category_id)
+        self._shards = {}  # opened lazily, so every DataLoader worker maps its own view
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __getitem__(self, idx):
+        shard, row, category_id = self.locations[idx]
+        if shard not in self._shards:
+            self._shards[shard] = np.load(self.root / shard, mmap_mode="r")
+        return torch.from_numpy(np.array(self._shards[shard][row])), category_id
+
+
+class PairedARIADataset(Dataset):
+    """Zips images with their cached DINOv2 features: ``(image, features, category_id)``."""
+
+    def __init__(self, images: Dataset, features: ShardedARIADataset):
+        self.images = images
+        self.features = features
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        image, category_id = self.images[idx]
+        features, _ = self.features[idx]
+        return image, features, category_id
+
+
+class ShardStore:
+    """Per-image rows stored in memory-mapped ``.npy`` shards under ``root``.
+
+    Each build session writes its own ``shard-<session>-NNNNN.npy`` files
+    and an ``index-<session>.json`` mapping images (relative to the dataset
+    root, with size and mtime) to shard rows, so several processes can add
+    to one store at once. A shard is indexed only once fully written, so an
+    interrupted build resumes from the last complete shard, and changed
+    images are simply written again.
+    """
+
+    def __init__(self, root: Path, data_path: Path, shard_size: int = 4096):
+        self.root = root
+        self.data_path = data_path
+        self.shard_size = shard_size
+        self.reload()
+
+    def reload(self):
+        self.index = {}
+        for index_path in sorted(self.root.glob("index-*.json"), key=lambda p: p.stat().st_mtime_ns):
+            self.index.update(json.loads(index_path.read_text()))
+
+    def _key(self, img_path: str) -> str:
+        return str(Path(img_path).relative_to(self.data_path))
+
+    @staticmethod
+    def _stamp(img_path: str) -> List[int]:
+        stat = os.stat(img_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def missing(self, items: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        return [
+            item for item in items
+            if self.index.get(self._key(item[0]), {}).get("stamp") != self._stamp(item[0])
+        ]
+
+    def write(
+        self,
+        items: List[Tuple[str, int]],
+        batches,
+        shape: Tuple[int, ...],
+        dtype,
+        writer: str = "0",
+        desc: str = "Caching",
+        show_progress: bool = True,
+    ):
+        """Store ``batches`` (tensors whose rows line up with ``items``) as new shards."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        session = f"{time.strftime('%Y%m%d%H%M%S')}-{writer}-{uuid.uuid4().hex[:6]}"
+        index_path = self.root / f"index-{session}.json"
+        session_index = {}
+        progress = tqdm(total=len(items), desc=desc, disable=not show_progress)
+
+        shard, written = None, 0
+        for batch in batches:
+            for row_data in batch:
+                if shard is None:
+                    chunk = items[written : written + self.shard_size]
+                    name = f"shard-{session}-{written // self.shard_size:05d}.npy"
+                    shard = np.lib.format.open_memmap(
+                        self.root / name, mode="w+", dtype=dtype, shape=(len(chunk), *shape)
+                    )
+                row = written % self.shard_size
+                shard[row] = row_data.numpy()
+                written += 1
+                if row + 1 == len(chunk):
+                    shard.flush()
+                    shard = None
+                    for i, (img_path, _) in enumerate(chunk):
+                        session_index[self._key(img_path)] = {
+                            "shard": name, "row": i, "stamp": self._stamp(img_path)
+                        }
+                    tmp = index_path.with_suffix(".tmp")
+                    tmp.write_text(json.dumps(session_index))
+                    os.replace(tmp, index_path)
+            progress.update(len(batch))
+        progress.close()
+        self.index.update(session_index)
+
+    def dataset(self, items: List[Tuple[str, int]]) -> ShardedARIADataset:
+        locations = []
+        for img_path, category_id in items:
+            entry = self.index[self._key(img_path)]
+            locations.append((entry["shard"], entry["row"], category_id))
+        return ShardedARIADataset(self.root, locations)
+
+
+class TensorShardCache(ShardStore):
+    """Preprocessed images, keyed by the preprocessing config.
+
+    Images are decoded, resized, cropped and JPEG round-tripped once and
+    stored as ``uint8`` under ``cache_dir/pixels-<config hash>/``;
+    normalization runs on the device at evaluation time.
+    """
+
+    def __init__(self, cache_dir: Path, data_path: Path, shard_size: int = 4096):
+        super().__init__(Path(cache_dir) / f"pixels-{preprocess_config_hash()}", data_path, shard_size)
+
+    def build(self, items: List[Tuple[str, int]], batch_size: int = 64, workers: int = 4, show_progress: bool = True):
+        """Preprocess every image in ``items`` that is not cached yet."""
+        todo = self.missing(items)
+        if not todo:
+            return
+        loader = DataLoader(ARIADataset(todo, raw=True), batch_size=batch_size, num_workers=workers)
+        crop = PREPROCESS_CONFIG["crop"]
+        self.write(
+            todo, (batch for batch, _ in loader), (3, crop, crop), np.uint8,
+            desc="Caching tensors", show_progress=show_progress,
+        )
+
+
+class FeatureCache(ShardStore):
+    """DINOv2 ``vit_features`` of the full NonescapeClassifier, one row per image.
+
+    Stored under ``cache_dir/features-<hash>/``, keyed by the preprocessing
+    config, the backbone weights and the storage dtype. ``float16`` halves the
+    roughly 1 MB per image of ``float32`` features.
+    """
+
+    def __init__(self, cache_dir: Path, data_path: Path, model: NonescapeClassifier, dtype: str = "float16"):
+        self.dtype = dtype
+        super().__init__(Path(cache_dir) / f"features-{feature_config_hash(model, dtype)}", data_path, shard_size=1024)
+
+    def build(
+        self,
+        model: NonescapeClassifier,
+        items: List[Tuple[str, int]],
+        images: Dataset,
+        device: str,
+        batch_size: int = 64,
+        workers: int = 4,
+        rank: int = 0,
+        world_size: int = 1,
+    ):
+        """Extract features for uncached ``items``; ``images[i]`` must be the image of ``items[i]``.
+
+        With several processes each rank extracts a disjoint slice.
+        """
+        position = {self._key(path): i for i, (path, _) in enumerate(items)}
+        todo = self.missing(items)[rank::world_size]
+        if not todo:
+            return
+        loader = DataLoader(
+            Subset(images, [position[self._key(path)] for path, _ in todo]),
+            batch_size=batch_size,
+            num_workers=workers,
+            pin_memory=torch.cuda.is_available(),
+        )
+
+        def batches():
+            model.eval()
+            for batch, _ in loader:
+                features = model.extract_features(to_model_input(batch, device))
+                yield features.to(getattr(torch, self.dtype)).cpu()
+
+        tokens = (PREPROCESS_CONFIG["crop"] // model.vit_backbone.config.patch_size) ** 2 + 1
+        self.write(
+            todo, batches(), (tokens, model.embedding_size), np.dtype(self.dtype),
+            writer=str(rank), desc="Caching features", show_progress=rank == 0,
+        )
+
+
+def to_model_input(batch: torch.Tensor, device: str) -> torch.Tensor:
+    batch = batch.to(device, non_blocking=True)
+    if batch.dtype == torch.uint8:  # cached shards are normalized on the device
+        batch = normalize_image(batch)
+    return batch
+
+
 def setup_distributed():
     if "WORLD_SIZE" not in os.environ or "RANK" not in os.environ:
         device = "cuda" if torch.cuda.is_available() else "mps" if torch.mps.is_available() else "cpu"
@@ -90,40 +324,6 @@ def cleanup_distributed():
         dist.destroy_process_group()
 
 
-def gather_results(
-    scores: List[float], categories: List[int], rank: int, world_size: int, device: str
-) -> Tuple[List[float], List[int]]:
-    if world_size == 1:
-        return scores, categories
-
-    num_samples = torch.tensor(len(scores), dtype=torch.long, device=device)
-    all_num_samples = [torch.zeros_like(num_samples) for _ in range(world_size)]
-    dist.all_gather(all_num_samples, num_samples)
-    all_num_samples = [t.item() for t in all_num_samples]
-    max_samples = max(all_num_samples)
-
-    padded_scores = scores + [0.0] * (max_samples - len(scores))
-    scores_tensor = torch.tensor(padded_scores, dtype=torch.float32, device=device)
-    all_scores = [torch.zeros_like(scores_tensor) for _ in range(world_size)]
-    dist.all_gather(all_scores, scores_tensor)
-
-    padded_categories = categories + [0] * (max_samples - len(categories))
-    categories_tensor = torch.tensor(padded_categories, dtype=torch.long, device=device)
-    all_categories = [torch.zeros_like(categories_tensor) for _ in range(world_size)]
-    dist.all_gather(all_categories, categories_tensor)
-
-    if rank != 0:
-        return [], []
-
-    final_scores = []
-    final_categories = []
-    for scores_t, cats_t, n_samples in zip(all_scores, all_categories, all_num_samples):
-        final_scores.extend(scores_t[:n_samples].cpu().tolist())
-        final_categories.extend(cats_t[:n_samples].cpu().tolist())
-
-    return final_scores, final_categories
-
-
 CORRUPTED_IMAGES = ["StarryAI/IT2I/ins/1489777465165169105.png"]  # Dataset contains corrupted images
 
 
@@ -159,48 +359,96 @@ def collect_images(data_path: Path, max_samples: int = None) -> List[Tuple[str,
     return images
 
 
-def evaluate_model(model, dataloader: DataLoader, device: str, rank: int = 0) -> Tuple[List[float], List[int]]:
-    all_scores, all_categories = [], []
-
-    model.eval()
-    with torch.no_grad():
-        for batch_tensors, batch_categories in tqdm(dataloader, desc="Evaluating", disable=(rank != 0)):
-            probs = model(batch_tensors.to(device))
-            synth_probs = probs[:, 1].cpu().tolist()
-
-            all_scores.extend(synth_probs)
-            all_categories.extend(batch_categories.tolist())
-
-    return all_scores, all_categories
-
-
-def calculate_metrics(scores: List[float], categories: List[int], threshold: float = 0.5) -> dict:
-    if not scores or not categories:
-        raise Exception("Cannot calculate metrics for empty scores and/or categories")
+THRESHOLDS = (0.5, 0.65, 0.8)
+
+
+class StreamingMetrics:
+    """Constant-memory, mergeable accuracy/AP accumulator.
+
+    Each rank keeps two score histograms (real vs. synthetic) for average
+    precision and, per category, the sample count and how many scores
+    exceed each threshold. Accuracy is exact. AP treats scores in the same
+    bin as ties, which is within ~1e-4 of sklearn at the default bin count.
+    Every counter lives in one int64 tensor, so merging across ranks is a
+    single ``all_reduce``.
+    """
+
+    def __init__(self, thresholds=THRESHOLDS, num_bins: int = 10_000):
+        self.thresholds = tuple(thresholds)
+        self.num_bins = num_bins
+        self.num_categories = len(CATEGORIES)
+        histograms = 2 * num_bins
+        per_category = self.num_categories * (1 + len(self.thresholds))
+        self.counts = torch.zeros(histograms + per_category, dtype=torch.long)
+        self.score_hist = self.counts[:histograms].view(2, num_bins)  # [real, synthetic] x bins
+        self.category_counts = self.counts[histograms:].view(self.num_categories, 1 + len(self.thresholds))
+
+    def update(self, scores: torch.Tensor, categories: torch.Tensor):
+        scores = scores.detach().float().cpu()
+        categories = categories.cpu().long()
+        is_ai = (categories != REAL_CATEGORY).long()
+        bins = (scores * self.num_bins).long().clamp_(0, self.num_bins - 1)
+        self.score_hist.view(-1).index_add_(0, is_ai * self.num_bins + bins, torch.ones_like(bins))
+        self.category_counts[:, 0].index_add_(0, categories, torch.ones_like(categories))
+        for i, threshold in enumerate(self.thresholds):
+            self.category_counts[:, 1 + i].index_add_(0, categories, (scores > threshold).long())
+
+    def all_reduce(self, device: str):
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        counts = self.counts.to(device)
+        dist.all_reduce(counts, op=dist.ReduceOp.SUM)
+        self.counts.copy_(counts.cpu())
+
+    def average_precision(self) -> float:
+        real, synthetic = self.score_hist.flip(-1).double()  # descending score
+        tp, fp = synthetic.cumsum(0), real.cumsum(0)
+        if tp[-1] == 0:
+            return 0.0
+        hit = synthetic > 0  # recall only moves in bins that contain positives
+        precision = tp[hit] / (tp[hit] + fp[hit])
+        return float((precision * synthetic[hit]).sum() / tp[-1])
+
+    def compute(self, threshold: float) -> dict:
+        if self.category_counts[:, 0].sum() == 0:
+            raise Exception("Cannot calculate metrics for empty scores and/or categories")
+        column = 1 + self.thresholds.index(threshold)
+
+        correct = 0
+        category_stats = {}
+        for cat_id in range(self.num_categories):
+            count, above = self.category_counts[cat_id, 0].item(), self.category_counts[cat_id, column].item()
+            if count == 0:
+                continue
+            cat_correct = count - above if cat_id == REAL_CATEGORY else above
+            correct += cat_correct
+            category_stats[CATEGORIES[cat_id]] = {"accuracy": cat_correct / count, "count": count}
 
-    y_true = [0 if cat == REAL_CATEGORY else 1 for cat in categories]
-    y_pred = [1 if score > threshold else 0 for score in scores]
+        num_real = self.category_counts[REAL_CATEGORY, 0].item()
+        total = self.category_counts[:, 0].sum().item()
+        return {
+            "total_accuracy": correct / total,
+            "total_ap": self.average_precision(),
+            "category_stats": category_stats,
+            "num_real": num_real,
+            "num_ai": total - num_real,
+        }
 
-    total_acc = accuracy_score(y_true, y_pred)
-    total_ap = average_precision_score(y_true, scores)
 
-    category_stats = {}
-    for cat_id in set(categories):
-        cat_name = CATEGORIES[cat_id]
-        cat_indices = [i for i, cat in enumerate(categories) if cat == cat_id]
-        cat_true = [y_true[i] for i in cat_indices]
-        cat_pred = [y_pred[i] for i in cat_indices]
+def evaluate_model(model, dataloader: DataLoader, device: str, rank: int = 0, thresholds=THRESHOLDS) -> StreamingMetrics:
+    metrics = StreamingMetrics(thresholds)
 
-        accuracy = sum(1 for t, p in zip(cat_true, cat_pred) if t == p) / len(cat_true)
-        category_stats[cat_name] = {"accuracy": accuracy, "count": len(cat_indices)}
+    model.eval()
+    with torch.no_grad():
+        for *batch_inputs, batch_categories in tqdm(dataloader, desc="Evaluating", disable=(rank != 0)):
+            if len(batch_inputs) == 2:  # (image, cached vit_features)
+                vit_features = batch_inputs[1].to(device, non_blocking=True).float()
+                probs = model(to_model_input(batch_inputs[0], device), vit_features=vit_features)
+            else:
+                probs = model(to_model_input(batch_inputs[0], device))
+            metrics.update(probs[:, 1], batch_categories)
 
-    return {
-        "total_accuracy": total_acc,
-        "total_ap": total_ap,
-        "category_stats": category_stats,
-        "num_real": sum(1 for cat in categories if cat == REAL_CATEGORY),
-        "num_ai": sum(1 for cat in categories if cat != REAL_CATEGORY),
-    }
+    return metrics
 
 
 def main():
@@ -218,6 +466,17 @@ def main():
         default=4,
         help="Number of worker threads for image loading (for multiple GPUs, this is per GPU)",
     )
+    parser.add_argument(
+        "--cache-dir",
+        help="Preprocess images once into memory-mapped tensor shards here and evaluate from them",
+    )
+    parser.add_argument(
+        "--feature-cache",
+        help="Store DINOv2 features (full model only) here and reuse them instead of rerunning the backbone",
+    )
+    parser.add_argument(
+        "--feature-dtype", default="float16", choices=["float16", "float32"], help="Storage dtype of cached features"
+    )
     parser.add_argument("--seed", type=int, default=42, help="Random seed")
     args = parser.parse_args()
 
@@ -251,11 +510,48 @@ def main():
         cleanup_distributed()
         return
 
+    if args.feature_cache and args.mini:
+        log("--feature-cache needs the full model (the mini model has no DINOv2 backbone)")
+        cleanup_distributed()
+        return
+
     log(f"Using {device} on {world_size} process(es)")
     log("Collecting images (types: T2I, IT2I)...")
 
     images = collect_images(data_path, args.max_samples)
-    dataset = ARIADataset(images)
+    if args.cache_dir:
+        cache = TensorShardCache(Path(args.cache_dir), data_path)
+        if rank == 0:
+            start = time.perf_counter()
+            todo = len(cache.missing(images))
+            cache.build(images, workers=args.workers * world_size)
+            if todo:
+                log(f"Cached {todo} images in {time.perf_counter() - start:.1f}s at {cache.root}")
+            else:
+                log(f"Using cached tensor shards at {cache.root}")
+        if world_size > 1:
+            dist.barrier()
+            cache.reload()
+        dataset = cache.dataset(images)
+    else:
+        dataset = ARIADataset(images)
+
+    if args.feature_cache:
+        features = FeatureCache(Path(args.feature_cache), data_path, model, args.feature_dtype)
+        start = time.perf_counter()
+        todo = len(features.missing(images))
+        features.build(
+            model, images, dataset, device, batch_size=args.batch_size, workers=args.workers,
+            rank=rank, world_size=world_size,
+        )
+        if world_size > 1:
+            dist.barrier()
+            features.reload()
+        if todo:
+            log(f"Cached features of {todo} images in {time.perf_counter() - start:.1f}s at {features.root}")
+        else:
+            log(f"Using cached features at {features.root}")
+        dataset = PairedARIADataset(dataset, features.dataset(images))
 
     sampler = DistributedSampler(dataset, shuffle=False) if world_size > 1 else None
     dataloader = DataLoader(
@@ -264,13 +560,14 @@ def main():
         sampler=sampler,
         num_workers=args.workers,
         pin_memory=torch.cuda.is_available(),
+        persistent_workers=args.workers > 0,
         drop_last=False,
     )
 
     log(f"Evaluating model on {len(images)} images across {world_size} process(es)...")
 
-    local_scores, local_categories = evaluate_model(model, dataloader, device, rank)
-    final_scores, final_categories = gather_results(local_scores, local_categories, rank, world_size, device)
+    metrics = evaluate_model(model, dataloader, device, rank)
+    metrics.all_reduce(device)
 
     if rank != 0:
         cleanup_distributed()
@@ -280,8 +577,8 @@ def main():
     print("EVALUATION RESULTS")
     print("=" * 50)
 
-    for threshold in [0.5, 0.65, 0.8]:
-        results = calculate_metrics(final_scores, final_categories, threshold)
+    for threshold in metrics.thresholds:
+        results = metrics.compute(threshold)
 
         print(("=" * 16) + f" threshold: {threshold} " + ("=" * 16))
         print(f"Total samples:    {results['num_real'] + results['num_ai']:,}")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+#
+# Copyright 2025 Aedilic Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Score every image in directories or a manifest with one loaded model.
+
+Directories are walked recursively; a manifest lists one image path per line.
+DataLoader workers read, hash, decode and preprocess the images while the
+model scores the previous batch, and results are appended to a CSV or JSONL
+file after every batch.
+
+Rerunning with the same output file resumes: images whose path is already
+in it are skipped. Copies of an image (same sha256) under other names are only
+scored once; each gets its own row with the first copy's result, so resuming
+skips them by path too. Files that failed to decode are recorded with their
+error and not retried.
+
+`python bulk_inference.py model.safetensors results.csv ./photos ./more_photos`
+`python bulk_inference.py model.safetensors results.jsonl --manifest paths.txt --mini`
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from pathlib import Path
+from typing import Container, Dict, Iterable, List, Optional, Set
+
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from tqdm import tqdm
+from nonescape import NonescapeClassifier, NonescapeClassifierMini, normalize_image, preprocess_image_uint8
+
+IMG_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+FIELDS = ["path", "sha256", "synthetic_prob", "label", "error"]
+
+
+def collect_paths(directories: Iterable[str], manifest: Optional[str] = None) -> List[str]:
+    """Image paths under ``directories`` (sorted, recursive) followed by those listed in ``manifest``."""
+    paths = []
+    for directory in directories:
+        paths.extend(
+            sorted(str(p) for p in Path(directory).rglob("*") if p.suffix.lower() in IMG_EXTENSIONS and p.is_file())
+        )
+    if manifest:
+        with open(manifest, encoding="utf-8") as f:
+            paths.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return paths
+
+
+class ImageFileDataset(Dataset):
+    """Reads, hashes and preprocesses image files to ``uint8`` tensors.
+
+    Files whose sha256 is in ``skip_hashes`` are not decoded. Unreadable
+    images come back with an ``error`` instead of raising, so one broken file
+    doesn't stop the run.
+    """
+
+    def __init__(self, paths: List[str], skip_hashes: Container[str]):
+        self.paths = paths
+        self.skip_hashes = skip_hashes
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        item = {"path": self.paths[idx], "sha256": None, "tensor": None, "error": None, "skipped": False}
+        try:
+            with open(item["path"], "rb") as f:
+                data = f.read()
+            item["sha256"] = hashlib.sha256(data).hexdigest()
+            if item["sha256"] in self.skip_hashes:
+                item["skipped"] = True
+                return item
+            with Image.open(io.BytesIO(data)) as image:
+                item["tensor"] = preprocess_image_uint8(image.convert("RGB"))
+        except Exception as e:
+            item["error"] = f"{type(e).__name__}: {e}"
+        return item
+
+
+def collate(items: List[dict]) -> dict:
+    tensors = [item["tensor"] for item in items if item["tensor"] is not None]
+    return {"items": items, "pixels": torch.stack(tensors) if tensors else None}
+
+
+class ResultFile:
+    """Appends results to a CSV or JSONL file and remembers what it already holds.
+
+    A line cut short by a crash is removed when the file is opened.
+    """
+
+    def __init__(self, path: str):
+        self.format = "jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+        self.done_paths: Set[str] = set()
+        self.done_hashes: Dict[str, dict] = {}  # sha256 -> first successful row
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self._truncate_partial_line(path)
+            with open(path, encoding="utf-8", newline="") as f:
+                rows = csv.DictReader(f) if self.format == "csv" else (json.loads(line) for line in f if line.strip())
+                for row in rows:
+                    self._remember(row)
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        if self.format == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if not exists or os.path.getsize(path) == 0:
+                self.writer.writeheader()
+
+    @staticmethod
+    def _truncate_partial_line(path: str):
+        with open(path, "rb+") as f:
+            data = f.read()
+            if not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def write(self, rows: List[dict]):
+        for row in rows:
+            if self.format == "csv":
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(row) + "\n")
+            self._remember(row)
+        self.file.flush()
+
+    def _remember(self, row: dict):
+        # unreadable files aren't retried; delete their rows to try them again
+        self.done_paths.add(row["path"])
+        if not row["error"]:
+            self.done_hashes.setdefault(row["sha256"], row)
+
+    def close(self):
+        self.file.close()
+
+
+def score_batch(model, batch: dict, device: str, threshold: float, done_hashes: Dict[str, dict]) -> List[dict]:
+    """Score a collated batch into one row per item.
+
+    Copies of an already scored image (in ``done_hashes`` or earlier in this
+    batch) get that image's result under their own path.
+    """
+    probs = None
+    if batch["pixels"] is not None:
+        with torch.no_grad():
+            probs = model(normalize_image(batch["pixels"].to(device)))[:, 1].float().cpu().tolist()
+
+    rows, firsts, i = [], {}, 0
+    for item in batch["items"]:
+        if item["tensor"] is None and not item["skipped"]:
+            rows.append({"path": item["path"], "sha256": item["sha256"], "synthetic_prob": None, "label": None,
+                         "error": item["error"]})
+            continue
+        if item["tensor"] is not None:
+            prob, i = probs[i], i + 1
+        first = done_hashes.get(item["sha256"]) or firsts.get(item["sha256"])
+        if first is not None:
+            rows.append(dict(first, path=item["path"]))
+            continue
+        firsts[item["sha256"]] = {"path": item["path"], "sha256": item["sha256"], "synthetic_prob": round(prob, 6),
+                                  "label": "synthetic" if prob > threshold else "authentic", "error": None}
+        rows.append(firsts[item["sha256"]])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score directories of images as authentic or AI-generated")
+    parser.add_argument("model_path", help="Path to model file (.safetensors)")
+    parser.add_argument("output", help="Results file (.csv or .jsonl); appended to and resumed from")
+    parser.add_argument("directories", nargs="*", help="Directories to scan recursively for images")
+    parser.add_argument("--manifest", help="Text file with one image path per line")
+    parser.add_argument("--mini", action="store_true", help="Use mini model variant")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader processes reading and preprocessing images")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Synthetic probability above which to label synthetic")
+    parser.add_argument(
+        "--no-fast-path", action="store_true", help="Full model: keep the reference forward instead of optimize_for_inference"
+    )
+    args = parser.parse_args()
+
+    if not args.directories and not args.manifest:
+        parser.error("give at least one directory or --manifest")
+
+    device = "cuda" if torch.cuda.is_available() else "mps" if torch.mps.is_available() else "cpu"
+    model = (NonescapeClassifierMini if args.mini else NonescapeClassifier).from_pretrained(args.model_path)
+    model.to(device)
+    model.eval()
+    if not args.mini and not args.no_fast_path and device == "cpu":
+        report = model.optimize_for_inference()
+        print(f"Fast path: {report['dtype'] or 'rejected'} (max abs diff {report['max_abs_diff']})")
+
+    results = ResultFile(args.output)
+    paths = collect_paths(args.directories, args.manifest)
+    todo = [p for p in paths if p not in results.done_paths]
+    print(f"Found {len(paths):,} images, {len(paths) - len(todo):,} already scored in {args.output}")
+
+    loader = DataLoader(
+        ImageFileDataset(todo, results.done_hashes),
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        collate_fn=collate,
+        pin_memory=torch.cuda.is_available(),
+    )
+    start, scored, copies, failed = time.perf_counter(), 0, 0, 0
+    progress = tqdm(total=len(todo), unit="img", desc="Scoring")
+    try:
+        for batch in loader:
+            rows = score_batch(model, batch, device, args.threshold, results.done_hashes)
+            num_hashes = len(results.done_hashes)
+            results.write(rows)
+            errors = sum(1 for row in rows if row["error"])
+            failed += errors
+            scored += len(results.done_hashes) - num_hashes
+            copies += len(rows) - errors - (len(results.done_hashes) - num_hashes)
+            progress.update(len(batch["items"]))
+            progress.set_postfix(images_per_sec=f"{scored / (time.perf_counter() - start):.1f}")
+    finally:
+        progress.close()
+        results.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Scored {scored:,} images in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):.1f} images/sec); "
+        f"{copies:,} copies of already scored images, {failed:,} failed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+#
+# Copyright 2025 Aedilic Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Distill the full NonescapeClassifier into a NonescapeClassifierMini student.
+
+The teacher (DINOv2 + EfficientNetV2-L) runs once per image and its
+probabilities are cached in memory-mapped shards keyed by the teacher
+checkpoint, the preprocessing config and the forward pass it ran with (the
+CPU fast path in bf16 or fp32, or the reference), so every epoch only pays for
+the student. The student learns from a mix of the teacher's
+temperature-softened distribution and the real/synthetic labels. The best
+epoch is picked by AP on a validation split and then compared with the
+teacher per ARIA category on a separate test split.
+
+The output is a plain ``NonescapeClassifierMini`` checkpoint. Keep ``mini`` in
+its file name and the backend serves it with
+``HF_IMAGE_MODEL_FILENAME=<name>.safetensors``.
+
+`python distill.py nonescape-v0.safetensors --data-path ./aria_dataset --cache-dir ./aria_cache`
+`python distill.py nonescape-v0.safetensors --init nonescape-mini-v0.safetensors --epochs 5`
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from safetensors.torch import save_file
+from torch.utils.data import DataLoader, Dataset, Subset
+from tqdm import tqdm
+from nonescape import NonescapeClassifier, NonescapeClassifierMini, bf16_fast_on_cpu
+
+from aria_test import (
+    ARIADataset,
+    PairedARIADataset,
+    REAL_CATEGORY,
+    ShardStore,
+    StreamingMetrics,
+    TensorShardCache,
+    collect_images,
+    evaluate_model,
+    preprocess_config_hash,
+    to_model_input,
+)
+
+
+def checkpoint_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+class TeacherCache(ShardStore):
+    """Teacher class probabilities, one ``float32`` row per image.
+
+    Stored under ``cache_dir/teacher-<hash>/``, keyed by the teacher
+    checkpoint, the preprocessing config and ``forward``: ``"bfloat16"`` or
+    ``"float32"`` for the fast path, ``"reference"`` otherwise.
+    """
+
+    def __init__(self, cache_dir: Path, data_path: Path, teacher_path: str, forward: str):
+        key = f"{checkpoint_hash(teacher_path)}:{preprocess_config_hash()}:{forward}"
+        super().__init__(
+            Path(cache_dir) / f"teacher-{hashlib.sha256(key.encode()).hexdigest()[:16]}", data_path, shard_size=16384
+        )
+        self.forward = forward
+
+    def build(
+        self,
+        teacher: NonescapeClassifier,
+        items: List[Tuple[str, int]],
+        images: Dataset,
+        device: str,
+        batch_size: int = 64,
+        workers: int = 4,
+    ):
+        """Run the teacher on uncached ``items``; ``images[i]`` must be the image of ``items[i]``."""
+        position = {self._key(path): i for i, (path, _) in enumerate(items)}
+        todo = self.missing(items)
+        if not todo:
+            return
+        loader = DataLoader(
+            Subset(images, [position[self._key(path)] for path, _ in todo]),
+            batch_size=batch_size,
+            num_workers=workers,
+            pin_memory=torch.cuda.is_available(),
+        )
+
+        def batches():
+            teacher.eval()
+            with torch.no_grad():
+                for batch, _ in loader:
+                    yield teacher(to_model_input(batch, device)).float().cpu()
+
+        self.write(todo, batches(), (2,), np.float32, desc="Teacher outputs")
+
+
+def distillation_loss(
+    student_probs: torch.Tensor,
+    teacher_probs: torch.Tensor,
+    categories: torch.Tensor,
+    temperature: float,
+    alpha: float,
+) -> torch.Tensor:
+    """``alpha`` x soft-target KL (Hinton et al.) + ``(1 - alpha)`` x hard-label NLL.
+
+    Both models output probabilities, so their log-probabilities stand in for
+    logits (softmax is shift-invariant) when softening with ``temperature``.
+    """
+    student_log = torch.log(student_probs.clamp_min(1e-8))
+    teacher_log = torch.log(teacher_probs.clamp_min(1e-8))
+    soft = F.kl_div(
+        F.log_softmax(student_log / temperature, dim=-1),
+        F.log_softmax(teacher_log / temperature, dim=-1),
+        reduction="batchmean",
+        log_target=True,
+    ) * temperature**2
+    hard = F.nll_loss(student_log, (categories != REAL_CATEGORY).long())
+    return alpha * soft + (1 - alpha) * hard
+
+
+def teacher_metrics(outputs: Dataset, indices: List[int]) -> StreamingMetrics:
+    """ARIA metrics of the teacher, straight from its cached outputs."""
+    rows = [outputs[idx] for idx in indices]
+    metrics = StreamingMetrics()
+    metrics.update(torch.stack([probs for probs, _ in rows])[:, 1], torch.tensor([category for _, category in rows]))
+    return metrics
+
+
+def print_comparison(teacher: StreamingMetrics, student: StreamingMetrics, threshold: float = 0.5):
+    t, s = teacher.compute(threshold), student.compute(threshold)
+    print(("=" * 16) + f" threshold: {threshold} " + ("=" * 16))
+    print(f"{'':<20} {'teacher':>8} {'student':>8}")
+    print(f"{'Total accuracy':<20} {t['total_accuracy']:>8.3f} {s['total_accuracy']:>8.3f}")
+    print(f"{'Average precision':<20} {t['total_ap']:>8.3f} {s['total_ap']:>8.3f}")
+    cats = list(s["category_stats"].keys())
+    for category in [c for c in cats if c == "Real"] + sorted(c for c in cats if c != "Real"):
+        count = s["category_stats"][category]["count"]
+        print(
+            f"  {category:<18} {t['category_stats'][category]['accuracy']:>8.3f} "
+            f"{s['category_stats'][category]['accuracy']:>8.3f} ({count:,} samples)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the full nonescape classifier into the mini architecture")
+    parser.add_argument("teacher_path", help="Full model checkpoint (.safetensors)")
+    parser.add_argument("--data-path", default="./aria_dataset", help="ARIA-layout dataset directory")
+    parser.add_argument("--cache-dir", default="./aria_cache", help="Where teacher outputs (and pixels) are cached")
+    parser.add_argument("--no-pixel-cache", action="store_true", help="Decode JPEGs every epoch instead of caching")
+    parser.add_argument("--init", help="Start the student from this mini checkpoint instead of random weights")
+    parser.add_argument("--output", default="nonescape-mini-distilled.safetensors", help="Student checkpoint")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--lr", type=float, help="AdamW learning rate (default 1e-3, 1e-4 with --init)")
+    parser.add_argument("--temperature", type=float, default=2.0, help="Softening of both distributions")
+    parser.add_argument("--alpha", type=float, default=0.7, help="Weight of the teacher term vs. the labels")
+    parser.add_argument("--val-fraction", type=float, default=0.1, help="Held-out share used to pick the best epoch")
+    parser.add_argument(
+        "--test-fraction", type=float, default=0.1, help="Held-out share the best student is reported on"
+    )
+    parser.add_argument(
+        "--no-fast-path", action="store_true", help="Run the teacher's reference forward instead of optimize_for_inference"
+    )
+    parser.add_argument("--max-samples", type=int, help="Maximum number of samples to use")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes for image loading")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    if "mini" not in os.path.basename(args.output).lower():
+        parser.error("--output must contain 'mini' in its name so the backend loads it as NonescapeClassifierMini")
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    device = "cuda" if torch.cuda.is_available() else "mps" if torch.mps.is_available() else "cpu"
+    data_path = Path(args.data_path)
+    if not (data_path / "REAL").exists():
+        print(f"Dataset not found at {data_path}; see aria_test.py for how to download it")
+        return
+
+    images = collect_images(data_path, args.max_samples)
+    if args.no_pixel_cache:
+        pixels = ARIADataset(images, raw=True)
+    else:
+        cache = TensorShardCache(Path(args.cache_dir), data_path)
+        cache.build(images, workers=args.workers)
+        pixels = cache.dataset(images)
+
+    use_fast_path = device == "cpu" and not args.no_fast_path
+    forward = ("bfloat16" if bf16_fast_on_cpu() else "float32") if use_fast_path else "reference"
+    teacher_cache = TeacherCache(Path(args.cache_dir), data_path, args.teacher_path, forward)
+    if teacher_cache.missing(images):
+        teacher = NonescapeClassifier.from_pretrained(args.teacher_path).to(device)
+        if use_fast_path:
+            # a rejected bf16 path falls back to fp32 or the reference, whose outputs are cached separately
+            forward = teacher.optimize_for_inference(getattr(torch, forward))["dtype"] or "reference"
+            if forward != teacher_cache.forward:
+                teacher_cache = TeacherCache(Path(args.cache_dir), data_path, args.teacher_path, forward)
+        start = time.perf_counter()
+        teacher_cache.build(teacher, images, pixels, device, batch_size=args.batch_size, workers=args.workers)
+        print(f"Cached teacher outputs in {time.perf_counter() - start:.1f}s at {teacher_cache.root}")
+        del teacher
+    teacher_outputs = teacher_cache.dataset(images)
+    dataset = PairedARIADataset(pixels, teacher_outputs)
+
+    order = list(range(len(dataset)))
+    random.shuffle(order)
+    num_val = max(int(len(order) * args.val_fraction), 1)
+    num_test = max(int(len(order) * args.test_fraction), 1)
+    # the best epoch is chosen on val_idx, so it is reported on test_idx, which selection never sees
+    val_idx, test_idx = order[:num_val], order[num_val : num_val + num_test]
+    train_set = Subset(dataset, order[num_val + num_test :])
+    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=args.workers, drop_last=True)
+    val_loader = DataLoader(Subset(pixels, val_idx), batch_size=args.batch_size, num_workers=args.workers)
+    test_loader = DataLoader(Subset(pixels, test_idx), batch_size=args.batch_size, num_workers=args.workers)
+    print(f"Training on {len(train_set):,} images, validating on {len(val_idx):,}, testing on {len(test_idx):,}")
+
+    student = NonescapeClassifierMini.from_pretrained(args.init) if args.init else NonescapeClassifierMini()
+    student.to(device)
+    lr = args.lr or (1e-4 if args.init else 1e-3)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=0.01)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs * max(len(train_loader), 1))
+
+    best_ap, best_state = -1.0, None
+    for epoch in range(args.epochs):
+        student.train()
+        total = 0.0
+        for batch, teacher_probs, categories in tqdm(train_loader, desc=f"Epoch {epoch + 1}/{args.epochs}"):
+            probs = student(to_model_input(batch, device))
+            loss = distillation_loss(probs, teacher_probs.to(device), categories.to(device), args.temperature, args.alpha)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += loss.item()
+
+        student_val = evaluate_model(student, val_loader, device)
+        ap = student_val.average_precision()
+        print(f"Epoch {epoch + 1}: loss {total / max(len(train_loader), 1):.4f} | val AP {ap:.3f}")
+        if ap > best_ap:
+            best_ap = ap
+            best_state = {k: v.detach().cpu().contiguous() for k, v in student.state_dict().items()}
+            save_file(
+                best_state, args.output, metadata={"teacher": os.path.basename(args.teacher_path), "epoch": str(epoch + 1)}
+            )
+
+    if best_state is None:
+        # a NaN AP never beats best_ap, e.g. once the student's weights have diverged
+        reason = "--epochs is 0" if args.epochs == 0 else (
+            "val AP was NaN in every epoch; check the losses above for divergence and try a lower --lr"
+        )
+        print(f"\nNo student saved to {args.output}: {reason}")
+        return
+    student.load_state_dict(best_state)
+    student_test = evaluate_model(student, test_loader, device)
+    print(f"\nSaved the best student (val AP {best_ap:.3f}) to {args.output}; test split vs. the teacher:\n")
+    teacher_test = teacher_metrics(teacher_outputs, test_idx)
+    for threshold in student_test.thresholds:
+        print_comparison(teacher_test, student_test, threshold)
+
+
+if __name__ == "__main__":
+    main()
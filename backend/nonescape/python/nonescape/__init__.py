@@ -13,35 +13,210 @@
 # limitations under the License.
 
 from __future__ import annotations
+from typing import Optional
+import warnings
 import torch
 from torch import Tensor, nn
+import torch.nn.functional as F
 import torchvision.models as models
 import torchvision.transforms.v2 as T
-from transformers import Dinov2Model
+from transformers import Dinov2Config, Dinov2Model
 from safetensors.torch import load_file
 from PIL import Image
 
 
-def preprocess_image(image: Image.Image) -> Tensor:
-    """Preprocess image for Nonescape models.
+PREPROCESS_CONFIG = {
+    "resize": 256,
+    "crop": 224,
+    "jpeg_quality": 100,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+
+def preprocess_image_uint8(image: Image.Image) -> Tensor:
+    """Resize, crop and JPEG round-trip an image, stopping before normalization.
+
+    The result is a compact ``uint8`` tensor that can be cached to disk and
+    turned into model input later with ``normalize_image``.
 
     Args:
         image: PIL Image
 
     Returns:
-        Preprocessed tensor ready for model input
+        ``uint8`` tensor of shape ``[3, crop, crop]``
     """
     transform = T.Compose(
         [
             T.ToImage(),
-            T.Resize(256),
-            T.CenterCrop(224),
-            T.JPEG(quality=100),
+            T.Resize(PREPROCESS_CONFIG["resize"]),
+            T.CenterCrop(PREPROCESS_CONFIG["crop"]),
+            T.JPEG(quality=PREPROCESS_CONFIG["jpeg_quality"]),
+        ]
+    )
+    return transform(image).as_subclass(Tensor)
+
+
+def normalize_image(tensor: Tensor) -> Tensor:
+    """Scale ``uint8`` image tensors to float and normalize them.
+
+    Args:
+        tensor: ``uint8`` tensor of shape ``[..., 3, H, W]`` (single image or batch)
+
+    Returns:
+        Normalized ``float32`` tensor of the same shape
+    """
+    transform = T.Compose(
+        [
             T.ToDtype(torch.float32, scale=True),
-            T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            T.Normalize(mean=PREPROCESS_CONFIG["mean"], std=PREPROCESS_CONFIG["std"]),
         ]
     )
-    return transform(image)
+    return transform(tensor)
+
+
+def preprocess_image(image: Image.Image) -> Tensor:
+    """Preprocess image for Nonescape models.
+
+    Args:
+        image: PIL Image
+
+    Returns:
+        Preprocessed tensor ready for model input
+    """
+    return normalize_image(preprocess_image_uint8(image))
+
+
+# Architecture of facebook/dinov2-large, so the backbone can be built from a
+# checkpoint without downloading (or even initializing) the pretrained weights
+DINOV2_LARGE_CONFIG = {
+    "hidden_size": 1024,
+    "num_hidden_layers": 24,
+    "num_attention_heads": 16,
+    "mlp_ratio": 4,
+    "hidden_act": "gelu",
+    "layer_norm_eps": 1e-6,
+    "image_size": 518,
+    "patch_size": 14,
+    "num_channels": 3,
+    "qkv_bias": True,
+    "layerscale_value": 1.0,
+    "drop_path_rate": 0.0,
+    "use_swiglu_ffn": False,
+}
+
+
+def load_pretrained(
+    model_factory, path: str, device: str = "cpu", strict: bool = False, fill_missing=None
+) -> nn.Module:
+    """Build a model on the meta device and load a safetensors checkpoint into it.
+
+    No weights are allocated or initialized before loading: parameters are
+    created as shapes only and then take over the checkpoint's tensors
+    (memory-mapped on CPU) instead of being copied into a second buffer.
+
+    Parameters the checkpoint doesn't provide can't be run, so they raise.
+    Missing buffers (e.g. BatchNorm ``num_batches_tracked``) are filled in with
+    defaults, and unexpected keys are reported with a warning, or raise when
+    ``strict``.
+
+    Args:
+        model_factory: Callable returning the (uninitialized) model
+        path: Path to a ``.safetensors`` checkpoint
+        device: Device to load the tensors onto
+        strict: Raise on unexpected or missing buffer keys instead of warning
+        fill_missing: Optional ``(model, missing_keys) -> handled_keys`` that can
+            supply parameters the checkpoint doesn't contain
+
+    Returns:
+        The model in eval mode, with ``load_report`` listing missing and unexpected keys
+    """
+    with torch.device("meta"):
+        model = model_factory()
+    state_dict = load_file(path, device=str(device))
+
+    # keep the model's dtypes; only mismatching tensors are converted (copied)
+    expected = model.state_dict()
+    for key, tensor in state_dict.items():
+        if key in expected and tensor.dtype != expected[key].dtype:
+            state_dict[key] = tensor.to(expected[key].dtype)
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+
+    parameters = dict(model.named_parameters())
+    missing_parameters = [key for key in result.missing_keys if key in parameters]
+    if missing_parameters and fill_missing is not None:
+        handled = set(fill_missing(model, missing_parameters))
+        missing_parameters = [key for key in missing_parameters if key not in handled]
+    if missing_parameters:
+        raise ValueError(f"{path} is missing {len(missing_parameters)} parameters: {missing_parameters[:10]}")
+    missing_buffers = [key for key in result.missing_keys if key not in parameters and _is_meta(model, key)]
+    problems = []
+    if missing_buffers:
+        problems.append(f"missing buffers (filled with defaults): {missing_buffers[:10]}")
+        _materialize_buffers(model, missing_buffers, device)
+    if result.unexpected_keys:
+        problems.append(f"unexpected keys (ignored): {result.unexpected_keys[:10]}")
+    if problems:
+        message = f"{path}: " + "; ".join(problems)
+        if strict:
+            raise ValueError(message)
+        warnings.warn(message, stacklevel=3)
+
+    model.load_report = {"missing": missing_buffers, "unexpected": list(result.unexpected_keys)}
+    return model.eval()
+
+
+def _is_meta(model: nn.Module, name: str) -> bool:
+    module_name, _, attr = name.rpartition(".")
+    return getattr(model.get_submodule(module_name), attr).is_meta
+
+
+def _materialize_buffers(model: nn.Module, names: list, device: str) -> None:
+    defaults = {
+        "_input_mean": torch.tensor(PREPROCESS_CONFIG["mean"]).reshape(3, 1, 1),
+        "_input_std": torch.tensor(PREPROCESS_CONFIG["std"]).reshape(3, 1, 1),
+    }
+    for name in names:
+        module_name, _, buffer_name = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        meta = getattr(module, buffer_name)
+        value = defaults.get(buffer_name, torch.zeros(meta.shape, dtype=meta.dtype))
+        module.register_buffer(buffer_name, value.to(device=device, dtype=meta.dtype))
+
+
+def _fill_vit_backbone(model: nn.Module, missing: list) -> list:
+    """Checkpoints without backbone weights rely on the frozen pretrained
+    DINOv2; load it (from the local Hugging Face cache when offline)."""
+    backbone_keys = [key for key in missing if key.startswith("vit_backbone.")]
+    if not backbone_keys:
+        return []
+    warnings.warn("checkpoint has no DINOv2 weights; loading facebook/dinov2-large", stacklevel=4)
+    pretrained = Dinov2Model.from_pretrained("facebook/dinov2-large").state_dict()
+    prefix = len("vit_backbone.")
+    model.load_state_dict({key: pretrained[key[prefix:]] for key in backbone_keys}, strict=False, assign=True)
+    return backbone_keys
+
+
+def bf16_fast_on_cpu() -> bool:
+    """Whether this CPU has native bf16 matmul support (AVX512-BF16 or AMX).
+
+    Without it oneDNN emulates bf16 and autocast is slower than fp32.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {"avx512_bf16", "amx_bf16"}) and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def _validation_images() -> Tensor:
+    crop = PREPROCESS_CONFIG["crop"]
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randn(2, 3, crop, crop, generator=generator)
+    # low-frequency content, closer to natural images than white noise
+    smooth = nn.functional.interpolate(torch.randn(2, 3, 8, 8, generator=generator), size=crop, mode="bicubic")
+    return torch.cat([noise, smooth])
 
 
 class NonescapeClassifier(nn.Module):
@@ -50,13 +225,19 @@ class NonescapeClassifier(nn.Module):
     Uses a vision transformer as backbone with EfficientNet v2 to compute an attention maps for the ViT features.
     """
 
-    def __init__(self, num_classes: int = 2, num_heads=16, num_queries: int = 128):
+    def __init__(
+        self, num_classes: int = 2, num_heads=16, num_queries: int = 128, vit_config: Optional[Dinov2Config] = None
+    ):
         super().__init__()
 
         self.embedding_size = 1024
         self.num_queries = num_queries
 
-        vit_backbone = Dinov2Model.from_pretrained("facebook/dinov2-large")
+        # without a config the pretrained DINOv2 weights are downloaded (for training)
+        if vit_config is None:
+            vit_backbone = Dinov2Model.from_pretrained("facebook/dinov2-large")
+        else:
+            vit_backbone = Dinov2Model(vit_config)
         efficientnet = models.efficientnet_v2_l(weights=None, num_classes=num_queries * self.embedding_size)
         self.vit_backbone = vit_backbone
         self.query_net = efficientnet
@@ -67,22 +248,56 @@ class NonescapeClassifier(nn.Module):
 
         self.register_buffer("_input_mean", torch.empty((3, 1, 1)))
         self.register_buffer("_input_std", torch.empty((3, 1, 1)))
+        self._fast_path: Optional[torch.dtype] = None  # set by optimize_for_inference
 
     @classmethod
-    def from_pretrained(cls, path: str) -> NonescapeClassifier:
-        state_dict = load_file(path)
+    def from_pretrained(cls, path: str, device: str = "cpu", strict: bool = False) -> NonescapeClassifier:
+        """Load a checkpoint without network access or a second copy of the weights.
 
-        model = cls()
-        model.load_state_dict(state_dict, strict=False)
+        See ``load_pretrained``; the DINOv2 backbone is built from
+        ``DINOV2_LARGE_CONFIG`` and its weights come from the checkpoint.
+        """
+        return load_pretrained(
+            lambda: cls(vit_config=Dinov2Config(**DINOV2_LARGE_CONFIG)), path, device, strict, _fill_vit_backbone
+        )
 
-        return model
+    def extract_features(self, x: Tensor) -> Tensor:
+        """Run the frozen DINOv2 backbone.
 
-    def forward(self, x: Tensor) -> Tensor:
-        B = x.shape[0]
+        The backbone is never trained, so its output for an image can be
+        computed once, cached and passed back to ``forward`` as ``vit_features``.
 
+        Args:
+            x: Normalized image batch ``[B, 3, H, W]``
+
+        Returns:
+            ViT token features ``[B, tokens, embed_dim]``
+        """
         with torch.no_grad():
-            vit_output = self.vit_backbone(x)
-            vit_features = vit_output.last_hidden_state  # CLS token [B, embed_dim]
+            return self.vit_backbone(x).last_hidden_state
+
+    def forward(self, x: Tensor, vit_features: Optional[Tensor] = None) -> Tensor:
+        """Classify a batch of images.
+
+        Uses the fast path once ``optimize_for_inference`` has enabled it.
+
+        Args:
+            x: Normalized image batch ``[B, 3, H, W]``
+            vit_features: Optional precomputed ``extract_features(x)``; skips the backbone
+
+        Returns:
+            Class probabilities ``[B, num_classes]``
+        """
+        if self._fast_path is not None:
+            return self._forward_fast(x, vit_features)
+        return self.forward_reference(x, vit_features)
+
+    def forward_reference(self, x: Tensor, vit_features: Optional[Tensor] = None) -> Tensor:
+        """The original fp32 forward pass, used for training and to validate the fast path."""
+        B = x.shape[0]
+
+        if vit_features is None:
+            vit_features = self.extract_features(x)  # [B, D, embed_dim]
         q = self.query_net.forward(x).reshape(B, self.num_queries, -1)  # [B, num_queries, embed_dim]
         k = self.key_net.forward(vit_features)  # [B, D, embed_dim]
         v = self.value_net.forward(vit_features)  # [B, D, embed_dim]
@@ -94,6 +309,111 @@ class NonescapeClassifier(nn.Module):
 
         return probs
 
+    def optimize_for_inference(
+        self, dtype: Optional[torch.dtype] = None, sample: Optional[Tensor] = None, atol: Optional[float] = None
+    ) -> dict:
+        """Switch ``forward`` to a fused, SDPA-based inference path.
+
+        - The DINOv2 backbone uses ``scaled_dot_product_attention``.
+        - ``key_net``/``value_net`` are folded into the attention's key/value
+          input projections, so the ViT features go through one ``[2E, E]``
+          matmul instead of four.
+        - The cross-attention runs through ``scaled_dot_product_attention``
+          without materializing the averaged attention weights, and the mean
+          over queries is taken before ``out_proj`` (which is linear).
+        - With ``dtype=torch.bfloat16`` everything runs under CPU autocast.
+
+        The fast path is checked against ``forward_reference`` on ``sample``,
+        computed before anything is switched. If bf16 is off by more than
+        ``atol`` the check is repeated in fp32, and if that fails too the
+        backbone's attention is restored and the reference forward stays in use.
+
+        Args:
+            dtype: ``torch.bfloat16`` or ``torch.float32``; defaults to bf16
+                when ``bf16_fast_on_cpu()`` and fp32 otherwise
+            sample: Normalized input used for validation, ideally a few real
+                images; defaults to four seeded images (two white-noise, two
+                smooth)
+            atol: Allowed max abs difference in probabilities (default ``1e-4``
+                for fp32, ``2e-2`` for bf16)
+
+        Returns:
+            Report with the chosen ``dtype`` (None if the fast path was
+            rejected) and the ``max_abs_diff`` of each attempt
+        """
+        if dtype is None:
+            dtype = torch.bfloat16 if bf16_fast_on_cpu() else torch.float32
+        if dtype not in (torch.bfloat16, torch.float32):
+            raise ValueError(f"dtype must be torch.bfloat16 or torch.float32, got {dtype}")
+        if sample is None:
+            sample = _validation_images()
+        sample = sample.to(self._input_mean.device)
+        with torch.no_grad():
+            # the reference runs before anything is switched, so the backbone's
+            # attention change is validated too
+            expected = self.forward_reference(sample)
+            previous_attention = self._set_backbone_attention("sdpa")
+            self._fuse_projections()
+            report = {"dtype": None, "max_abs_diff": {}}
+            for candidate in (dtype, torch.float32) if dtype != torch.float32 else (dtype,):
+                self._fast_path = candidate
+                tolerance = atol if atol is not None else (2e-2 if candidate == torch.bfloat16 else 1e-4)
+                diff = (self._forward_fast(sample) - expected).abs().max().item()
+                report["max_abs_diff"][str(candidate).removeprefix("torch.")] = diff
+                if diff <= tolerance:
+                    report["dtype"] = str(candidate).removeprefix("torch.")
+                    break
+            else:
+                self._fast_path = None
+                self._set_backbone_attention(previous_attention)
+                warnings.warn(f"fast path disagrees with the reference forward ({report}); not using it", stacklevel=2)
+        self.inference_report = report
+        return report
+
+    def _set_backbone_attention(self, implementation: Optional[str]) -> Optional[str]:
+        previous = self.vit_backbone.config._attn_implementation
+        if hasattr(self.vit_backbone, "set_attn_implementation"):
+            self.vit_backbone.set_attn_implementation(implementation)
+        else:
+            self.vit_backbone.config._attn_implementation = implementation
+        return previous
+
+    def _fuse_projections(self) -> None:
+        E = self.embedding_size
+        w_in, b_in = self.attention.in_proj_weight, self.attention.in_proj_bias
+        with torch.no_grad():
+            # in_proj(key_net(f)) = (W_in @ W_key) f + (W_in @ b_key + b_in), same for values
+            kv_weight = torch.cat(
+                [w_in[E : 2 * E] @ self.key_net.weight, w_in[2 * E :] @ self.value_net.weight]
+            )
+            kv_bias = torch.cat(
+                [
+                    w_in[E : 2 * E] @ self.key_net.bias + b_in[E : 2 * E],
+                    w_in[2 * E :] @ self.value_net.bias + b_in[2 * E :],
+                ]
+            )
+        # not persistent: checkpoints keep the original layout
+        self.register_buffer("_kv_weight", kv_weight, persistent=False)
+        self.register_buffer("_kv_bias", kv_bias, persistent=False)
+
+    def _forward_fast(self, x: Tensor, vit_features: Optional[Tensor] = None) -> Tensor:
+        B, E = x.shape[0], self.embedding_size
+        H = self.attention.num_heads
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self._fast_path == torch.bfloat16):
+            if vit_features is None:
+                vit_features = self.vit_backbone(x).last_hidden_state  # [B, D, embed_dim]
+            q = self.query_net(x).reshape(B, self.num_queries, E)
+            q = F.linear(q, self.attention.in_proj_weight[:E], self.attention.in_proj_bias[:E])
+            q = q.view(B, self.num_queries, H, E // H).transpose(1, 2)  # [B, heads, num_queries, head_dim]
+            kv = F.linear(vit_features, self._kv_weight, self._kv_bias)
+            k, v = kv.view(B, -1, 2, H, E // H).permute(2, 0, 3, 1, 4)  # 2 x [B, heads, D, head_dim]
+
+            emb = F.scaled_dot_product_attention(q, k, v)  # [B, heads, num_queries, head_dim]
+            emb = emb.mean(dim=2).reshape(B, E)
+            emb = self.attention.out_proj(emb)
+            logits = self.head(emb)
+        return nn.functional.softmax(logits.float(), dim=-1)
+
 
 class NonescapeClassifierMini(nn.Module):
     """EfficientNet-based fake image detector"""
@@ -107,13 +427,9 @@ class NonescapeClassifierMini(nn.Module):
         self.head = nn.Linear(embedding_size, num_classes)
 
     @classmethod
-    def from_pretrained(cls, path: str) -> NonescapeClassifierMini:
-        state_dict = load_file(path)
-
-        model = cls()
-        model.load_state_dict(state_dict, strict=False)
-
-        return model
+    def from_pretrained(cls, path: str, device: str = "cpu", strict: bool = False) -> NonescapeClassifierMini:
+        """Load a checkpoint onto the meta-built model; see ``load_pretrained``."""
+        return load_pretrained(cls, path, device, strict)
 
     def forward(self, x: Tensor) -> Tensor:
         emb = self.backbone(x)
@@ -123,4 +439,14 @@ class NonescapeClassifierMini(nn.Module):
         return probs
 
 
-__all__ = ["NonescapeClassifier", "NonescapeClassifierMini", "preprocess_image"]
+__all__ = [
+    "DINOV2_LARGE_CONFIG",
+    "NonescapeClassifier",
+    "NonescapeClassifierMini",
+    "PREPROCESS_CONFIG",
+    "bf16_fast_on_cpu",
+    "load_pretrained",
+    "normalize_image",
+    "preprocess_image",
+    "preprocess_image_uint8",
+]
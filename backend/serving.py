@@ -0,0 +1,206 @@
+"""Serving-mode model wrappers: optional compilation and shape-bucketed warmup.
+
+Compiled artifacts (TorchScript traces, ``torch.compile`` graphs) are
+specialised to one input shape, and even eager mode pays one-time allocation
+and kernel selection on the first call of every new shape. Requests are
+therefore padded to a small set of shapes - text to a length bucket, batches
+to a configured batch size - and ``BucketedRunner.warmup`` builds and runs
+every one of them before the API reports ready.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+import torch
+from torch import nn
+
+COMPILE_MODES = ("off", "torchscript", "compile")
+
+
+def parse_ints(value: str, default: Sequence[int]) -> tuple[int, ...]:
+    """Parse a comma-separated env value like ``"64,128,512"``."""
+    parsed = tuple(sorted({int(v) for v in value.split(",") if v.strip()})) if value else ()
+    return parsed or tuple(default)
+
+
+class TextLogits(nn.Module):
+    """Positional-args wrapper returning only the logits tensor, so the HF
+    text model can be traced or compiled like a plain module."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return outputs["logits"] if isinstance(outputs, dict) else outputs.logits
+
+
+class MultiHeadLogits(nn.Module):
+    """Concatenates every head's logits into one ``[B, heads * classes]``
+    tensor (in ``model.heads`` order) so a multi-head model can be traced,
+    compiled and batch-padded like a single-output one."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        outputs = self.model(input_ids, attention_mask=attention_mask)
+        return torch.cat(list(outputs.values()), dim=-1)
+
+
+def _next_size(n: int, sizes: Sequence[int]) -> Optional[int]:
+    return next((s for s in sizes if s >= n), None)
+
+
+class BucketedRunner:
+    """Runs a module through per-shape compiled artifacts, eager otherwise.
+
+    Inputs whose batch dimension is below a configured batch size are padded
+    up to it (by repeating the first row) so they hit a warmed shape; outputs
+    are sliced back. Shapes that were never warmed run eagerly. If building
+    any artifact fails, or its output disagrees with eager, the runner falls
+    back to eager mode for every shape.
+    """
+
+    def __init__(self, name: str, module: nn.Module, mode: str = "off", batch_sizes: Sequence[int] = (1,)):
+        if mode not in COMPILE_MODES:
+            raise ValueError(f"compile mode must be one of {COMPILE_MODES}, got {mode!r}")
+        self.name = name
+        self.module = module.eval()
+        self.requested_mode = mode
+        self.mode = mode
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self._artifacts: dict[tuple, Callable] = {}
+        self._compiled: Optional[Callable] = None
+        if mode == "compile":
+            _raise_recompile_limit()
+
+    @staticmethod
+    def _shape_key(args: Sequence[torch.Tensor]) -> tuple:
+        return tuple(tuple(a.shape) for a in args)
+
+    def _build(self, args: Sequence[torch.Tensor]) -> Callable:
+        if self.mode == "torchscript":
+            traced = torch.jit.trace(self.module, tuple(args), check_trace=False, strict=False)
+            return torch.jit.freeze(traced.eval())
+        # one compiled module; dynamo specialises it per shape on first call
+        if self._compiled is None:
+            self._compiled = torch.compile(self.module, dynamic=False)
+        return self._compiled
+
+    def _fall_back(self, reason: str) -> None:
+        print(f"[SlopMop] {self.name}: {self.mode} mode failed ({reason}); falling back to eager", flush=True)
+        self.mode = "off"
+        self._artifacts.clear()
+        self._compiled = None
+
+    def warmup(self, examples: Sequence[Sequence[torch.Tensor]]) -> float:
+        """Build (if compiling) and run every example shape once; returns seconds taken."""
+        start = time.perf_counter()
+        with torch.no_grad():
+            for args in examples:
+                if self.mode != "off":
+                    try:
+                        artifact = self._build(args)
+                        expected = self.module(*args)
+                        actual = artifact(*args)
+                        if not torch.allclose(actual, expected, rtol=1e-3, atol=1e-4):
+                            raise RuntimeError("output does not match eager")
+                        self._artifacts[self._shape_key(args)] = artifact
+                    except Exception as e:
+                        self._fall_back(f"{type(e).__name__}: {e}")
+                self(*args)
+        return time.perf_counter() - start
+
+    def __call__(self, *args: torch.Tensor) -> torch.Tensor:
+        n = args[0].shape[0]
+        target = _next_size(n, self.batch_sizes)
+        if target is not None and target > n:
+            pad = target - n
+            args = tuple(torch.cat([a, a[:1].expand(pad, *a.shape[1:])]) for a in args)
+
+        fn = self._artifacts.get(self._shape_key(args), self.module)
+        with torch.no_grad():
+            out = fn(*args)
+        return out[:n]
+
+
+def _raise_recompile_limit(limit: int = 64) -> None:
+    # torch.compile(dynamic=False) recompiles per shape and silently drops to
+    # eager after the limit (default 8), which a bucket grid easily exceeds
+    config = torch._dynamo.config
+    for attr in ("recompile_limit", "cache_size_limit"):
+        if hasattr(config, attr):
+            setattr(config, attr, max(getattr(config, attr), limit))
+
+
+def text_warmup_examples(vocab_size: int, buckets: Sequence[int], batch_sizes: Sequence[int], device) -> list:
+    low = min(1000, vocab_size - 1)
+    examples = []
+    for batch in batch_sizes:
+        for length in buckets:
+            input_ids = torch.randint(low, vocab_size, (batch, length), device=device)
+            examples.append((input_ids, torch.ones_like(input_ids)))
+    return examples
+
+
+def image_warmup_examples(batch_sizes: Sequence[int], device, size: int = 224) -> list:
+    return [(torch.zeros(batch, 3, size, size, device=device),) for batch in batch_sizes]
+
+
+class ConcurrencyLimit:
+    """Caps how many forward passes run at once across every worker pool;
+    the limit can be changed at runtime (e.g. after thread tuning)."""
+
+    def __init__(self, limit: int):
+        self._cond = threading.Condition()
+        self._limit = max(limit, 1)
+        self._active = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def set_limit(self, limit: int) -> None:
+        with self._cond:
+            self._limit = max(limit, 1)
+            self._cond.notify_all()
+
+    def __enter__(self) -> "ConcurrencyLimit":
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+
+class Readiness:
+    """Tracks startup warmup so ``/ready`` can report 503 until it finishes."""
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self.detail: dict = {"status": "starting"}
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def mark_ready(self, **detail) -> None:
+        self.detail = {"status": "ready", **detail}
+        self._ready.set()
+
+    def mark_failed(self, error: str) -> None:
+        self.detail = {"status": "failed", "error": error}
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
@@ -0,0 +1,91 @@
+"""Single-flight coalescing of identical in-flight jobs.
+
+When a post goes viral, many clients ask about the same text or image within
+a few hundred milliseconds, before its verdict is cached. The first request
+for a key starts a job (e.g. on an inference executor); requests arriving
+while it is in flight get a ticket for the same job instead of starting
+their own. Tickets are handed out before anything is queued, so followers
+never occupy a worker thread while they wait. Keys are forgotten as soon as
+the job finishes, so this only deduplicates concurrent work; caching
+finished results is the near-duplicate index's job.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+
+class _Call:
+    def __init__(self, job: Future):
+        self.job = job
+        self.tickets: set[Ticket] = set()
+
+
+class Ticket(Future):
+    """One caller's handle on a shared job; resolves with the job's outcome.
+
+    ``cancel()`` detaches only this caller. The shared job itself is
+    cancelled when its last caller cancels, with ``Future.cancel``'s result:
+    False once the job has started running, in which case the ticket still
+    resolves when it finishes.
+    """
+
+    def __init__(self, flight: SingleFlight, call: _Call):
+        super().__init__()
+        self._flight = flight
+        self._call = call
+
+    def cancel(self) -> bool:
+        return self._flight._cancel(self._call, self)
+
+
+class SingleFlight:
+    def __init__(self):
+        # reentrant: cancelling a job runs its done callback on this thread
+        self._lock = threading.RLock()
+        self._calls: dict[Hashable, _Call] = {}
+        self._calls_total = 0
+        self._shared = 0
+
+    def join(self, key: Hashable, start: Callable[[], Future]) -> Ticket:
+        """A ticket for ``key``'s job; ``start()`` runs only if none is in flight."""
+        with self._lock:
+            self._calls_total += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call(start())
+                call.job.add_done_callback(lambda job: self._finish(key, call))
+            else:
+                self._shared += 1
+            ticket = Ticket(self, call)
+            call.tickets.add(ticket)
+        return ticket
+
+    def _finish(self, key: Hashable, call: _Call) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            tickets, call.tickets = call.tickets, set()
+        job = call.job
+        for ticket in tickets:
+            if job.cancelled():
+                Future.cancel(ticket)
+            elif job.exception() is not None:
+                ticket.set_exception(job.exception())
+            else:
+                ticket.set_result(job.result())
+
+    def _cancel(self, call: _Call, ticket: Ticket) -> bool:
+        with self._lock:
+            if ticket not in call.tickets:
+                return Future.cancel(ticket)  # already resolved (or cancelled)
+            if len(call.tickets) == 1 and not call.job.cancel():
+                return False  # the last caller's job is already running
+            call.tickets.discard(ticket)
+            return Future.cancel(ticket)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self._calls_total, "shared": self._shared, "in_flight": len(self._calls)}
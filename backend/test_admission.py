@@ -0,0 +1,84 @@
+import json
+
+from admission import AdmissionController, ClientLimits, parse_limits
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _controller(**clients):
+    clock = FakeClock()
+    default = ClientLimits(text_rate=10, text_burst=100, image_rate=1000, image_burst=10_000)
+    return AdmissionController(default, clients, clock=clock), clock
+
+
+def test_bucket_admits_until_spent_then_refills():
+    controller, clock = _controller()
+    assert controller.admit("a", "text", lambda: 60) == 0
+    assert controller.admit("a", "text", lambda: 40) == 0
+    # empty: 5 tokens take half a second at 10/s
+    assert controller.admit("a", "text", lambda: 5) == 0.5
+    clock.now = 0.5
+    assert controller.admit("a", "text", lambda: 5) == 0
+
+
+def test_kinds_and_clients_have_separate_buckets():
+    controller, _ = _controller()
+    assert controller.admit("a", "text", lambda: 100) == 0
+    assert controller.admit("a", "image", lambda: 10_000) == 0
+    assert controller.admit("b", "text", lambda: 100) == 0
+    assert controller.admit("a", "text", lambda: 1) > 0
+
+
+def test_oversized_request_needs_a_full_bucket_and_leaves_debt():
+    controller, clock = _controller()
+    assert controller.admit("a", "text", lambda: 300) == 0
+    # 200 tokens of debt: nothing is admitted (or even costed) for 20s
+    costed = []
+    assert controller.admit("a", "text", lambda: costed.append(1) or 1) == 20
+    assert costed == []
+    clock.now = 20.1
+    assert controller.admit("a", "text", lambda: 1) == 0
+
+
+def test_admit_all_charges_every_bucket_or_none():
+    controller, _ = _controller()
+    assert controller.admit("a", "image", lambda: 9_000) == 0
+    # the image cost is rejected, so the text bucket keeps its full burst
+    assert controller.admit_all("a", {"text": lambda: 100, "image": lambda: 5_000}) == ("image", 4)
+    assert controller.admit("a", "text", lambda: 100) == 0
+    assert controller.admit_all("b", {"text": lambda: 50, "image": lambda: 5_000}) == (None, 0)
+    assert controller.admit("b", "text", lambda: 51) > 0
+
+
+def test_only_configured_ids_get_their_own_limits():
+    controller, _ = _controller(**{"partner-key": ClientLimits(text_rate=1, text_burst=1000)})
+    assert controller.identify(["partner-key", None], "1.2.3.4") == "partner-key"
+    # made-up ids fall back to the address, so rotating them doesn't help
+    assert controller.identify(["random-id"], "1.2.3.4") == "addr:1.2.3.4"
+    assert controller.admit("partner-key", "text", lambda: 1000) == 0
+
+
+def test_least_recently_seen_clients_are_evicted():
+    clock = FakeClock()
+    # room for one client's text + image buckets, i.e. two text-only clients
+    controller = AdmissionController(ClientLimits(text_rate=1, text_burst=10), max_clients=1, clock=clock)
+    controller.admit("a", "text", lambda: 10)
+    controller.admit("b", "text", lambda: 10)
+    controller.admit("c", "text", lambda: 10)
+    # "a" was evicted and comes back with a full bucket
+    assert controller.admit("a", "text", lambda: 10) == 0
+    assert controller.admit("c", "text", lambda: 1) > 0
+
+
+def test_parse_limits():
+    default, clients = parse_limits(json.dumps({"default": {"text_rate": 5}, "key-1": {"image_burst": 7}}))
+    assert default.rates["text"] == 5
+    assert clients["key-1"].bursts["image"] == 7
+    default, clients = parse_limits("")
+    assert clients == {} and default.rates["text"] > 0
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from inference_queue import DeadlineExceeded, PriorityExecutor
+
+
+def _blocked_executor():
+    # a single worker held busy, so everything submitted next stays queued
+    executor = PriorityExecutor(1)
+    started, release = threading.Event(), threading.Event()
+    executor.submit(lambda: (started.set(), release.wait()))
+    assert started.wait(5)
+    return executor, release
+
+
+def test_high_priority_runs_before_normal_and_low():
+    executor, release = _blocked_executor()
+    order = []
+    futures = [
+        executor.submit(order.append, "low-1", priority="low"),
+        executor.submit(order.append, "normal-1"),
+        executor.submit(order.append, "high-1", priority="high"),
+        executor.submit(order.append, "normal-2"),
+        executor.submit(order.append, "high-2", priority="high"),
+    ]
+    assert executor.stats()["queued"] == {"high": 2, "normal": 2, "low": 1}
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["high-1", "high-2", "normal-1", "normal-2", "low-1"]
+    executor.shutdown()
+
+
+def test_expired_jobs_never_run():
+    executor, release = _blocked_executor()
+    ran = []
+    expired = executor.submit(ran.append, "late", priority="low", deadline=time.perf_counter() + 0.01)
+    on_time = executor.submit(ran.append, "on time", deadline=time.perf_counter() + 60)
+    time.sleep(0.02)
+    release.set()
+
+    with pytest.raises(DeadlineExceeded):
+        expired.result(timeout=5)
+    on_time.result(timeout=5)
+    assert ran == ["on time"]
+    assert executor.stats()["expired"] == {"high": 0, "normal": 0, "low": 1}
+    executor.shutdown()
+
+
+def test_cancelled_jobs_are_skipped_and_errors_propagate():
+    executor, release = _blocked_executor()
+    ran = []
+    cancelled = executor.submit(ran.append, "cancelled")
+    failing = executor.submit(lambda: 1 / 0)
+    assert cancelled.cancel()
+    release.set()
+
+    with pytest.raises(ZeroDivisionError):
+        failing.result(timeout=5)
+    assert ran == []
+    executor.shutdown()
+    with pytest.raises(RuntimeError):
+        executor.submit(ran.append, "after shutdown")
+
+
+def test_rejects_unknown_priority():
+    executor = PriorityExecutor(1)
+    with pytest.raises(ValueError):
+        executor.submit(print, priority="urgent")
+    executor.shutdown()
+
+
+def test_resize_replaces_workers_and_keeps_the_queue():
+    executor, release = _blocked_executor()
+    names = []
+    queued = [executor.submit(lambda: names.append(threading.current_thread().name)) for _ in range(3)]
+    executor.resize(2)
+    assert executor.max_workers == 2
+    for future in queued:
+        future.result(timeout=5)
+    release.set()
+    # every queued job ran on a new-generation worker
+    assert all("-2-" in name for name in names)
+    executor.shutdown()
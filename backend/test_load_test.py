@@ -0,0 +1,43 @@
+import random
+
+from benchmarks.load_test import build_payloads, compare_to_baseline, summarize
+
+
+def _results(p50, p95, p99, errors=0):
+    return {"scenarios": {"tweet": {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "errors": errors}}}
+
+
+def test_summarize_reports_percentiles_and_throughput():
+    result = summarize([0.01] * 99 + [1.0], errors=1, wall_seconds=2.0)
+    assert result["requests"] == 101
+    assert result["errors"] == 1
+    assert result["throughput_rps"] == 50.0
+    assert result["p50_ms"] == 10.0
+    assert result["p99_ms"] > 10.0
+
+
+def test_compare_to_baseline_within_tolerance():
+    baseline = _results(10.0, 20.0, 30.0)
+    assert compare_to_baseline(_results(11.0, 23.0, 35.0), baseline, tolerance=0.2) == []
+
+
+def test_compare_to_baseline_flags_regressions():
+    baseline = _results(10.0, 20.0, 30.0)
+    regressions = compare_to_baseline(_results(13.0, 20.0, 30.0, errors=2), baseline, tolerance=0.2)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("tweet p50_ms")
+
+
+def test_payloads_are_deterministic_and_valid():
+    first = build_payloads("tweet", 5, seed=7)
+    assert first == build_payloads("tweet", 5, seed=7)
+    assert all(0 < len(p["text"]) <= 5000 for p in first)
+    assert len(set(p["text"] for p in first)) == 5
+    assert "image_base64" in build_payloads("jpeg-256", 1, seed=random.randint(0, 100))[0]
+
+
+def test_image_payloads_are_unique_unless_pooled():
+    unique = build_payloads("jpeg-256", 4, seed=7)
+    assert len(set(p["image_base64"] for p in unique)) == 4
+    pooled = build_payloads("jpeg-256", 4, seed=7, image_pool=2)
+    assert len(set(p["image_base64"] for p in pooled)) == 2
@@ -2,6 +2,7 @@ from fastapi.testclient import TestClient
 from main import app
 import base64
 import io
+import pytest
 from PIL import Image
 
 client = TestClient(app)
@@ -23,6 +24,7 @@ def test_detect_success_human_text():
     assert "label" in data
     assert "explanation" in data
     assert data["label"] in ["ai", "human"]
+    assert data["model_version"].startswith("text:")
 
 
 def test_detect_success_ai_marker_text():
@@ -72,6 +74,7 @@ def test_detect_image_success():
     assert "explanation" in data
     assert data["label"] in ["ai", "human"]
     assert 0.0 <= data["confidence"] <= 1.0
+    assert data["model_version"].startswith("image:")
 
 
 def test_detect_image_rejects_empty_base64():
@@ -88,4 +91,466 @@ def test_detect_image_rejects_invalid_base64():
 
 def test_detect_image_rejects_missing_field():
     response = client.post("/detect-image", json={})
-    assert response.status_code == 422  # pydantic validation error
\ No newline at end of file
+    assert response.status_code == 422  # pydantic validation error
+
+# ── priority / deadline tests ────────────────────────────────────
+
+def test_detect_expired_deadline_returns_504():
+    response = client.post("/detect", json={"text": "a post that scrolled away long ago", "deadline_ms": 0})
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Deadline exceeded before inference"
+    body = client.get("/metrics").text
+    assert 'slopmop_deadline_expired_total{model="text",priority="normal"} 1' in body
+
+
+def test_detect_image_accepts_priority_and_reports_queue_wait():
+    response = client.post(
+        "/detect-image", json={"image_base64": _make_test_image_base64(), "priority": "high", "deadline_ms": 60000}
+    )
+    assert response.status_code == 200
+    assert "inference_queue;dur=" in response.headers["Server-Timing"]
+    body = client.get("/metrics").text
+    assert 'slopmop_inference_queue_wait_seconds_count{model="image",priority="high"}' in body
+
+
+def test_detect_rejects_unknown_priority():
+    response = client.post("/detect", json={"text": "hello", "priority": "urgent"})
+    assert response.status_code == 422
+
+
+# ── admission control tests ──────────────────────────────────────
+
+def test_detect_rate_limits_a_client_with_retry_after(monkeypatch):
+    import main
+    from admission import AdmissionController, ClientLimits
+
+    monkeypatch.setattr(main, "admission", AdmissionController(ClientLimits(text_rate=1, text_burst=20)))
+    text = "a fairly long post " * 4  # ~20 estimated tokens
+    assert client.post("/detect", json={"text": text}).status_code == 200
+    response = client.post("/detect", json={"text": text})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # another client is unaffected
+    other = TestClient(app, client=("10.0.0.2", 5000))
+    assert other.post("/detect", json={"text": text}).status_code == 200
+    body = client.get("/metrics").text
+    assert 'slopmop_throttled_total{model="text",reason="rate_limited"}' in body
+
+
+def test_detect_post_rejected_for_images_is_not_charged_for_text(monkeypatch):
+    import main
+    from admission import AdmissionController, ClientLimits
+
+    limits = ClientLimits(text_rate=1, text_burst=20, image_rate=1, image_burst=1)
+    monkeypatch.setattr(main, "admission", AdmissionController(limits))
+    text = "a fairly long post " * 4  # ~20 estimated tokens
+    main.admission.admit("addr:testclient", "image", lambda: 1000)
+    response = client.post("/detect-post", json={"text": text, "images": [{"image_base64": _make_test_image_base64()}]})
+    assert response.status_code == 429
+    # the text budget is untouched, so a text-only request still goes through
+    assert client.post("/detect", json={"text": text}).status_code == 200
+
+
+def test_detect_image_sheds_load_when_queue_is_full(monkeypatch):
+    import threading
+    import main
+    from inference_queue import PriorityExecutor
+
+    executor = PriorityExecutor(1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    executor.submit(release.wait)
+    monkeypatch.setattr(main, "image_executor", executor)
+    monkeypatch.setattr(main, "MAX_QUEUED_JOBS", 1)
+    try:
+        response = client.post("/detect-image", json={"image_base64": _make_test_image_base64()})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_image_cost_reads_pixels_from_header_only():
+    import main
+
+    assert main.image_cost(_make_test_image_base64()) == 224 * 224
+    assert main.image_cost("bm90IGFuIGltYWdl") == len("bm90IGFuIGltYWdl") * 6
+
+
+# ── /detect-post tests ───────────────────────────────────────────
+
+def test_detect_post_scores_text_and_images():
+    b64 = _make_test_image_base64()
+    response = client.post(
+        "/detect-post",
+        json={"text": "a post with two photos attached", "images": [{"image_base64": b64}, {"image_base64": b64}]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["text"]["model_version"].startswith("text:")
+    assert len(data["images"]) == 2
+    assert all(image["model_version"].startswith("image:") for image in data["images"])
+    parts = [data["text"]] + data["images"]
+    assert data["confidence"] == max(part["confidence"] for part in parts)
+    assert data["label"] == ("ai" if any(part["label"] == "ai" for part in parts) else "human")
+    # stages recorded on the worker threads still land on the request
+    timing = response.headers["Server-Timing"]
+    for stage in ["queue", "decode", "tokenize", "forward", "total"]:
+        assert f"{stage};dur=" in timing
+
+
+def test_detect_post_images_only():
+    response = client.post("/detect-post", json={"images": [{"image_base64": _make_test_image_base64()}]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["text"] is None
+    assert data["confidence"] == data["images"][0]["confidence"]
+
+
+def test_detect_post_rejects_empty_post():
+    response = client.post("/detect-post", json={"text": "   ", "images": []})
+    assert response.status_code == 400
+
+
+def test_detect_post_reports_invalid_image_index():
+    response = client.post(
+        "/detect-post",
+        json={"text": "hello", "images": [{"image_base64": _make_test_image_base64()}, {"image_base64": "nope!!"}]},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "images[1]: Invalid image data"
+
+
+def test_detect_post_applies_priority_and_deadline_to_every_part():
+    b64 = _make_test_image_base64()
+    response = client.post(
+        "/detect-post", json={"text": "a post on screen", "images": [{"image_base64": b64}], "priority": "high"}
+    )
+    assert response.status_code == 200
+    body = client.get("/metrics").text
+    assert 'slopmop_inference_queue_wait_seconds_count{model="text",priority="high"}' in body
+    assert 'slopmop_inference_queue_wait_seconds_count{model="image",priority="high"}' in body
+
+    response = client.post("/detect-post", json={"text": "a post that scrolled away", "deadline_ms": 0})
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Deadline exceeded before inference"
+
+
+def test_detect_post_rejects_per_image_priority():
+    image = {"image_base64": _make_test_image_base64(), "priority": "high"}
+    response = client.post("/detect-post", json={"images": [image]})
+    assert response.status_code == 422
+    assert "set priority/deadline_ms on the request" in response.text
+
+
+# ── /detect-batch tests ──────────────────────────────────────────
+
+def test_detect_batch_returns_results_in_request_order():
+    b64 = _make_test_image_base64()
+    response = client.post(
+        "/detect-batch",
+        json={"texts": ["first batch post here", "   ", "second batch post here"], "images": [{"image_base64": b64}]},
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(r["kind"], r["index"]) for r in results] == [("text", 0), ("text", 1), ("text", 2), ("image", 0)]
+    assert results[0]["result"]["model_version"].startswith("text:")
+    assert results[1]["error"] == "Text is required"
+    assert results[3]["result"]["model_version"].startswith("image:")
+
+
+def test_detect_batch_streams_ndjson_with_cache_hits_first():
+    import json
+
+    client.post("/detect", json={"text": "an already scored feed post about gardening"})
+    response = client.post(
+        "/detect-batch",
+        json={"texts": ["a never seen feed post about sailing", "an already scored feed post about gardening"]},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert [(item["index"], item["cached"]) for item in items] == [(1, True), (0, False)]
+    assert all("confidence" in item["result"] for item in items)
+
+
+def test_detect_batch_streams_sse():
+    response = client.post(
+        "/detect-batch",
+        json={"images": [{"image_base64": _make_test_image_base64()}, {"image_base64": "nope!!"}]},
+        headers={"Accept": "text/event-stream"},
+    )
+    assert response.status_code == 200
+    events = [e for e in response.text.split("\n\n") if e]
+    assert events[-1] == "event: done\ndata: {}"
+    assert sum(e.startswith("event: result\ndata: ") for e in events) == 2
+    assert '"error":"Invalid image data"' in response.text
+
+
+def test_detect_batch_expired_deadline_reports_each_queued_item():
+    client.post("/detect", json={"text": "a cached post about birdwatching"})
+    response = client.post(
+        "/detect-batch",
+        json={
+            "texts": ["a cached post about birdwatching", "an unseen post about kayaking"],
+            "images": [{"image_base64": _make_test_image_base64()}],
+            "priority": "low",
+            "deadline_ms": 0,
+        },
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["cached"] is True
+    assert [r["error"] for r in results[1:]] == ["Deadline exceeded before inference"] * 2
+    body = client.get("/metrics").text
+    assert 'slopmop_deadline_expired_total{model="image",priority="low"}' in body
+
+
+def test_detect_batch_rejects_per_image_deadline():
+    image = {"image_base64": _make_test_image_base64(), "deadline_ms": 100}
+    assert client.post("/detect-batch", json={"images": [image]}).status_code == 422
+
+
+def test_detect_batch_rejects_empty_and_oversized_batches():
+    from main import MAX_BATCH_ITEMS
+
+    assert client.post("/detect-batch", json={}).status_code == 400
+    response = client.post("/detect-batch", json={"texts": ["hello"] * (MAX_BATCH_ITEMS + 1)})
+    assert response.status_code == 400
+
+
+# ── /ws session tests ────────────────────────────────────────────
+
+def test_ws_session_scores_text_and_image_jobs():
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"id": "t1", "type": "text", "text": "a post seen while scrolling"})
+        ws.send_json({"id": "i1", "type": "image", "image_base64": _make_test_image_base64()})
+        ws.send_json({"id": "t2", "type": "text", "text": "   "})
+        messages = {m["id"]: m for m in (ws.receive_json() for _ in range(3))}
+    assert messages["t1"]["type"] == "result"
+    assert messages["t1"]["result"]["model_version"].startswith("text:")
+    assert messages["i1"]["result"]["model_version"].startswith("image:")
+    assert messages["t2"] == {"id": "t2", "type": "error", "error": "Text is required"}
+
+
+def test_ws_session_drops_cancelled_queued_jobs(monkeypatch):
+    import threading
+    import main
+    from inference_queue import PriorityExecutor
+
+    # one busy worker, so the next job stays queued until released
+    executor = PriorityExecutor(1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    monkeypatch.setattr(main, "text_executor", executor)
+    try:
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"id": "gone", "type": "text", "text": "scrolled off screen"})
+            ws.send_json({"id": "gone", "type": "cancel"})
+            assert ws.receive_json() == {"id": "gone", "type": "cancelled", "dropped": True}
+            ws.send_json({"id": "gone", "type": "cancel"})
+            assert ws.receive_json()["type"] == "error"
+            release.set()
+            ws.send_json({"id": "kept", "type": "text", "text": "still on screen"})
+            assert ws.receive_json()["id"] == "kept"
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_ws_session_rejects_malformed_messages():
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"id": "x", "type": "video"})
+        assert ws.receive_json() == {"id": "x", "type": "error", "error": "unknown message type: video"}
+
+
+# ── single-flight tests ──────────────────────────────────────────
+
+def test_identical_concurrent_images_share_one_forward_pass(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import main
+    from inference_queue import PriorityExecutor
+
+    # two workers: waiting followers must leave the second one free
+    executor = PriorityExecutor(2)
+    monkeypatch.setattr(main, "image_executor", executor)
+    active = main.models.get("image")
+    release, calls = threading.Event(), []
+    real_score = main.score_images
+    viral = _make_test_image_base64()
+
+    def slow_score(model_version, tensors):
+        calls.append(len(tensors))
+        if len(calls) == 1:  # hold only the viral image
+            release.wait(5)
+        return real_score(model_version, tensors)
+
+    monkeypatch.setattr(main, "score_images", slow_score)
+    before = main.in_flight["image"].stats()["shared"]
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(client.post, "/detect-image", json={"image_base64": viral}) for _ in range(4)]
+            for _ in range(500):
+                if main.in_flight["image"].stats()["shared"] - before == 3:
+                    break
+                threading.Event().wait(0.01)
+            # a different image still gets a worker while the viral one is held
+            other = Image.new("RGB", (224, 224), color=(10, 200, 30))
+            buf = io.BytesIO()
+            other.save(buf, format="JPEG")
+            other_response = client.post("/detect-image", json={"image_base64": base64.b64encode(buf.getvalue()).decode()})
+            assert other_response.status_code == 200
+            release.set()
+            results = [f.result().json() for f in futures]
+    finally:
+        release.set()
+        executor.shutdown()
+
+    assert calls == [1, 1]
+    assert all(r == results[0] for r in results)
+    assert results[0]["model_version"] == active.version
+    body = client.get("/metrics").text
+    assert 'slopmop_single_flight_shared_total{model="image"}' in body
+
+
+# ── /metrics + Server-Timing tests ───────────────────────────────
+
+def test_detect_returns_server_timing_header():
+    response = client.post("/detect", json={"text": "a brand new post about metrics and timing"})
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    for stage in ["queue", "clean", "tokenize", "forward", "postprocess", "total"]:
+        assert f"{stage};dur=" in timing
+
+
+def test_detect_image_returns_server_timing_header():
+    response = client.post("/detect-image", json={"image_base64": _make_test_image_base64()})
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    for stage in ["decode", "clean", "forward", "postprocess", "total"]:
+        assert f"{stage};dur=" in timing
+
+
+def test_metrics_endpoint_prometheus_format():
+    client.post("/detect", json={"text": "hello team, meeting at 3pm"})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE slopmop_stage_seconds histogram" in body
+    assert 'slopmop_stage_seconds_count{endpoint="/detect",stage="forward"}' in body
+    assert "slopmop_process_resident_memory_bytes" in body
+    assert 'slopmop_cache_hits_total{cache="near_duplicate"}' in body
+
+
+# ── /ready tests ─────────────────────────────────────────────────
+
+def test_ready_after_startup_warmup():
+    from main import readiness
+
+    with TestClient(app) as started:
+        assert readiness.wait(timeout=120)
+        response = started.get("/ready")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["text_mode"] in ["off", "torchscript", "compile"]
+
+
+# ── /admin/models tests ──────────────────────────────────────────
+
+def test_admin_models_disabled_without_token(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/admin/models").status_code == 403
+    assert client.post("/admin/models/text", json={}).status_code == 403
+
+
+def test_admin_models_rejects_wrong_token(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    response = client.get("/admin/models", headers={"X-Admin-Token": "nope"})
+    assert response.status_code == 401
+
+
+def test_admin_hot_swaps_image_model(monkeypatch):
+    import time
+    import main
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    previous = main.models.get("image")
+    assert client.post("/admin/models/audio", json={}, headers=headers).status_code == 404
+    assert client.post(
+        "/admin/models/image", json={"filename": "../main.py"}, headers=headers
+    ).status_code == 400
+
+    response = client.post("/admin/models/image", json={"version": "image:test-v2"}, headers=headers)
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    for _ in range(600):
+        jobs = client.get("/admin/models", headers=headers).json()["jobs"]
+        job = next(j for j in jobs if j["id"] == job_id)
+        if job["state"] in ("active", "failed"):
+            break
+        time.sleep(0.1)
+    assert job["state"] == "active", job
+
+    payload = {"image_base64": _make_test_image_base64()}
+    try:
+        assert client.post("/detect-image", json=payload).json()["model_version"] == "image:test-v2"
+        assert 'slopmop_model_info{kind="image",version="image:test-v2"} 1' in client.get("/metrics").text
+    finally:
+        main.models.activate(previous)
+
+
+def test_unconverted_text_checkpoint_is_not_replaced_by_the_base_model(monkeypatch, tmp_path):
+    import main
+
+    (tmp_path / "detector.pt.gz").write_bytes(b"pickled")
+    monkeypatch.setattr(main, "TEXT_MODEL_DIR", str(tmp_path))
+    with pytest.raises(FileNotFoundError, match="checkpoint_io.py"):
+        main.load_text_model(filename="detector.safetensors")
+
+
+def test_multi_head_text_model_needs_a_distilbert_base():
+    from multi_head_detector import MultiHeadTextModel
+    from text_detector import DesklibAIDetectionModel
+    from transformers import DebertaV2Config
+
+    config = DebertaV2Config(vocab_size=32, hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32)
+    with pytest.raises(ValueError, match="DistilBertForSequenceClassification base"):
+        MultiHeadTextModel.from_sequence_classifier(DesklibAIDetectionModel(config))
+
+
+def test_multi_head_text_model_returns_satire_score(monkeypatch, tmp_path):
+    import main
+    from checkpoint_io import save_checkpoint, snapshot_state_dict
+    from multi_head_detector import MultiHeadTextModel
+
+    payload = {"text": "hello team, meeting at 3pm. see you at the offsite"}
+    before = client.post("/detect", json=payload).json()
+    assert before["satire_score"] is None
+
+    previous = main.models.get("text")
+    multi_head = MultiHeadTextModel.from_sequence_classifier(previous.model.model)
+    save_checkpoint(snapshot_state_dict(multi_head.state_dict()), str(tmp_path / "multi.safetensors"))
+    monkeypatch.setattr(main, "TEXT_MODEL_DIR", str(tmp_path))
+
+    main.models.activate(main.load_text_model(filename="multi.safetensors"))
+    try:
+        data = client.post("/detect", json=payload).json()
+        assert 0.0 <= data["satire_score"] <= 1.0
+        # the AI head is the single-head model's head on the same encoder
+        assert data["confidence"] == before["confidence"]
+        assert data["model_version"] != before["model_version"]
+    finally:
+        main.models.activate(previous)
@@ -0,0 +1,38 @@
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    hist = metrics.Histogram("test_latency_seconds", "Test.", ("stage",), buckets=(0.1, 1.0), registry=registry)
+    hist.observe(0.05, stage="forward")
+    hist.observe(0.5, stage="forward")
+    hist.observe(5.0, stage="forward")
+
+    body = registry.render()
+    assert 'test_latency_seconds_bucket{stage="forward",le="0.1"} 1' in body
+    assert 'test_latency_seconds_bucket{stage="forward",le="1.0"} 2' in body
+    assert 'test_latency_seconds_bucket{stage="forward",le="+Inf"} 3' in body
+    assert 'test_latency_seconds_count{stage="forward"} 3' in body
+
+
+def test_counter_and_callback_gauge():
+    registry = metrics.Registry()
+    counter = metrics.Counter("test_requests", "Test.", ("endpoint",), registry=registry)
+    counter.inc(endpoint="/detect")
+    counter.inc(2, endpoint="/detect")
+    metrics.Gauge("test_entries", "Test.", registry=registry, function=lambda: 7)
+
+    body = registry.render()
+    assert 'test_requests_total{endpoint="/detect"} 3' in body
+    assert "test_entries 7" in body
+
+
+def test_stage_records_into_current_request():
+    timings = metrics.start_request("/unit-test")
+    with metrics.stage("forward"):
+        pass
+
+    assert [name for name, _ in timings.stages] == ["forward"]
+    header = timings.server_timing(0.01)
+    assert header.startswith("forward;dur=")
+    assert header.endswith("total;dur=10.00")
@@ -0,0 +1,30 @@
+from benchmarks.model_bench import recommend
+
+
+def _row(backend, threads, batch, seq_len, sps, p95):
+    return {"model": "text", "backend": backend, "threads": threads, "batch": batch,
+            "seq_len": seq_len, "samples_per_sec": sps, "p95_ms": p95}
+
+
+def test_recommend_prefers_throughput_within_budget():
+    rows = [
+        _row("eager", 1, 1, 128, 10.0, 100.0),
+        _row("eager", 1, 16, 128, 40.0, 400.0),  # over budget
+        _row("torchscript", 1, 4, 128, 20.0, 200.0),
+    ]
+    best = recommend(rows, latency_budget_ms=250.0, cores=4)["text"]
+    assert (best["backend"], best["batch"]) == ("torchscript", 4)
+    assert best["workers"] == 4
+    assert best["est_samples_per_sec"] == 80.0
+
+
+def test_recommend_uses_worst_sequence_length():
+    rows = [
+        _row("eager", 2, 8, 64, 100.0, 50.0),
+        _row("eager", 2, 8, 512, 10.0, 300.0),
+        _row("eager", 2, 1, 64, 20.0, 10.0),
+        _row("eager", 2, 1, 512, 5.0, 100.0),
+    ]
+    best = recommend(rows, latency_budget_ms=250.0, cores=2)["text"]
+    assert best["batch"] == 1
+    assert best["worst_p95_ms"] == 100.0
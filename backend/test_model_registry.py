@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from model_registry import ModelRegistry, ModelVersion, RegistryBusy
+
+
+def _version(kind, version):
+    return ModelVersion(kind, version, model=object(), runner=None, source="test")
+
+
+def _wait(registry, job, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        job = registry.job(job["id"])
+        if job["state"] in ("active", "failed"):
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job did not finish: {job}")
+
+
+def test_activate_swaps_and_returns_previous():
+    registry = ModelRegistry()
+    v1, v2 = _version("text", "v1"), _version("text", "v2")
+
+    assert registry.activate(v1) is None
+    held = registry.get("text")
+    assert registry.activate(v2) is v1
+    # a request that grabbed v1 keeps using it after the swap
+    assert held is v1
+    assert registry.get("text") is v2
+    assert registry.versions() == {"text": "v2"}
+
+
+def test_background_load_warms_up_before_activating():
+    registry = ModelRegistry()
+    registry.activate(_version("image", "v1"))
+    warmed = []
+
+    def warmup(model_version):
+        # still serving the old version while the new one warms up
+        assert registry.get("image").version == "v1"
+        warmed.append(model_version.version)
+
+    job = _wait(registry, registry.load_in_background("image", lambda: _version("image", "v2"), warmup))
+
+    assert job["state"] == "active"
+    assert job["replaced"] == "v1"
+    assert warmed == ["v2"]
+    assert registry.get("image").version == "v2"
+
+
+def test_failed_load_keeps_serving_old_version():
+    registry = ModelRegistry()
+    registry.activate(_version("text", "v1"))
+
+    def loader():
+        raise FileNotFoundError("missing weights")
+
+    job = _wait(registry, registry.load_in_background("text", loader, lambda mv: None))
+
+    assert job["state"] == "failed"
+    assert "missing weights" in job["error"]
+    assert registry.get("text").version == "v1"
+
+
+def test_concurrent_load_of_same_kind_is_rejected():
+    registry = ModelRegistry()
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        return _version("text", "v2")
+
+    job = registry.load_in_background("text", loader, lambda mv: None)
+    with pytest.raises(RegistryBusy):
+        registry.load_in_background("text", loader, lambda mv: None)
+    release.set()
+    _wait(registry, job)
+
+    # once finished, a new load is accepted again
+    _wait(registry, registry.load_in_background("text", lambda: _version("text", "v3"), lambda mv: None))
+    assert registry.get("text").version == "v3"
+
+
+def test_only_the_last_jobs_are_kept_and_described_as_snapshots():
+    registry = ModelRegistry(max_jobs=2)
+    jobs = [_wait(registry, registry.load_in_background("text", lambda: _version("text", "v"), lambda mv: None))
+            for _ in range(3)]
+
+    described = registry.describe()["jobs"]
+    assert [j["id"] for j in described] == [jobs[2]["id"], jobs[1]["id"]]  # newest first
+    assert registry.job(jobs[0]["id"]) is None
+    described[0]["state"] = "edited"
+    assert registry.job(jobs[2]["id"])["state"] == "active"
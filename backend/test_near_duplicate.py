@@ -0,0 +1,67 @@
+from near_duplicate import NearDuplicateIndex
+
+COPYPASTA = (
+    "I'd just like to interject for a moment. What you're referring to as Linux, "
+    "is in fact, GNU/Linux, or as I've recently taken to calling it, GNU plus Linux. "
+    "Linux is not an operating system unto itself, but rather another free component "
+    "of a fully functioning GNU system made useful by the GNU corelibs, shell "
+    "utilities and vital system components comprising a full OS as defined by POSIX."
+)
+
+
+def test_exact_duplicate_is_found():
+    index = NearDuplicateIndex(threshold=0.9)
+    index.add(index.signature(COPYPASTA), (0.91, "ai"))
+
+    assert index.query(index.signature(COPYPASTA)) == (0.91, "ai")
+    assert index.stats()["hits"] == 1
+
+
+def test_small_edit_is_found():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add(index.signature(COPYPASTA), (0.91, "ai"))
+
+    edited = COPYPASTA.replace("for a moment", "for a sec") + " lol"
+    assert index.query(index.signature(edited)) == (0.91, "ai")
+
+
+def test_unrelated_text_is_not_found():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add(index.signature(COPYPASTA), (0.91, "ai"))
+
+    other = "hello team, the meeting has been moved to 3pm on thursday in room 204"
+    assert index.query(index.signature(other)) is None
+    stats = index.stats()
+    assert stats["lookups"] == 1
+    assert stats["misses"] == 1
+
+
+def test_eviction_bounds_memory():
+    index = NearDuplicateIndex(threshold=0.9, max_entries=2)
+    texts = [f"post number {i} about something completely different {i * 7}" for i in range(3)]
+    for i, text in enumerate(texts):
+        index.add(index.signature(text), i)
+
+    stats = index.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert index.query(index.signature(texts[0])) is None
+    assert index.query(index.signature(texts[2])) == 2
+
+
+def test_zero_max_entries_disables_index():
+    index = NearDuplicateIndex(max_entries=0)
+    index.add(index.signature(COPYPASTA), (0.91, "ai"))
+    assert index.query(index.signature(COPYPASTA)) is None
+
+
+def test_entries_only_match_their_namespace():
+    index = NearDuplicateIndex(threshold=0.9)
+    index.add(index.signature(COPYPASTA), (0.91, "ai"), namespace="v1")
+
+    assert index.query(index.signature(COPYPASTA), namespace="v2") is None
+    assert index.stats()["hits"] == 0
+    index.add(index.signature(COPYPASTA), (0.12, "human"), namespace="v2")
+    assert index.query(index.signature(COPYPASTA), namespace="v2") == (0.12, "human")
+    assert index.query(index.signature(COPYPASTA), namespace="v1") == (0.91, "ai")
+    assert index.stats()["hits"] == 2
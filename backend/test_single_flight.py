@@ -0,0 +1,80 @@
+from concurrent.futures import CancelledError, Future
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _starter(jobs):
+    # hands out plain futures the test resolves, standing in for queued work
+    def start():
+        jobs.append(Future())
+        return jobs[-1]
+
+    return start
+
+
+def test_concurrent_identical_joins_share_one_job():
+    flight, jobs = SingleFlight(), []
+    tickets = [flight.join("k", _starter(jobs)) for _ in range(5)]
+
+    assert len(jobs) == 1
+    assert flight.stats() == {"calls": 5, "shared": 4, "in_flight": 1}
+    jobs[0].set_result("verdict")
+
+    assert [t.result(timeout=1) for t in tickets] == ["verdict"] * 5
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_and_later_calls_start_separately():
+    flight, jobs = SingleFlight(), []
+    flight.join("a", _starter(jobs))
+    flight.join("b", _starter(jobs))
+    assert len(jobs) == 2
+    jobs[0].set_result(1)
+    # finished keys are forgotten: a later identical call starts again
+    flight.join("a", _starter(jobs))
+    assert len(jobs) == 3
+    assert flight.stats()["shared"] == 0
+
+
+def test_followers_receive_the_leaders_exception():
+    flight, jobs = SingleFlight(), []
+    tickets = [flight.join("k", _starter(jobs)) for _ in range(3)]
+    jobs[0].set_exception(ValueError("bad input"))
+
+    for ticket in tickets:
+        with pytest.raises(ValueError, match="bad input"):
+            ticket.result(timeout=1)
+
+
+def test_cancelling_one_ticket_keeps_the_job_for_the_others():
+    flight, jobs = SingleFlight(), []
+    first, second = flight.join("k", _starter(jobs)), flight.join("k", _starter(jobs))
+
+    assert first.cancel()
+    assert first.cancelled()
+    assert not jobs[0].cancelled()
+    jobs[0].set_result("verdict")
+    assert second.result(timeout=1) == "verdict"
+
+
+def test_last_cancel_cancels_a_queued_job():
+    flight, jobs = SingleFlight(), []
+    tickets = [flight.join("k", _starter(jobs)) for _ in range(2)]
+
+    assert all(t.cancel() for t in tickets)
+    assert jobs[0].cancelled()
+    assert flight.stats()["in_flight"] == 0
+    with pytest.raises(CancelledError):
+        tickets[1].result(timeout=1)
+
+
+def test_last_cancel_of_a_running_job_fails_and_still_resolves():
+    flight, jobs = SingleFlight(), []
+    ticket = flight.join("k", _starter(jobs))
+    assert jobs[0].set_running_or_notify_cancel()
+
+    assert not ticket.cancel()
+    jobs[0].set_result("verdict")
+    assert ticket.result(timeout=1) == "verdict"
@@ -0,0 +1,59 @@
+import time
+
+import thread_tuning
+from thread_tuning import ThreadLayout, candidate_layouts, cgroup_cpu_limit, tune
+
+
+def _cgroup_files(monkeypatch, tmp_path, v2=None, quota=None, period=None):
+    paths = {"v2": tmp_path / "cpu.max", "quota": tmp_path / "quota", "period": tmp_path / "period"}
+    for key, value in (("v2", v2), ("quota", quota), ("period", period)):
+        if value is not None:
+            paths[key].write_text(value)
+    monkeypatch.setattr(thread_tuning, "CGROUP_V2_CPU_MAX", str(paths["v2"]))
+    monkeypatch.setattr(thread_tuning, "CGROUP_V1_QUOTA", str(paths["quota"]))
+    monkeypatch.setattr(thread_tuning, "CGROUP_V1_PERIOD", str(paths["period"]))
+
+
+def test_cgroup_v2_quota(monkeypatch, tmp_path):
+    _cgroup_files(monkeypatch, tmp_path, v2="250000 100000\n")
+    assert cgroup_cpu_limit() == 2.5
+
+
+def test_cgroup_v2_unlimited(monkeypatch, tmp_path):
+    _cgroup_files(monkeypatch, tmp_path, v2="max 100000\n")
+    assert cgroup_cpu_limit() is None
+
+
+def test_cgroup_v1_quota_and_unlimited(monkeypatch, tmp_path):
+    _cgroup_files(monkeypatch, tmp_path, quota="150000", period="100000")
+    assert cgroup_cpu_limit() == 1.5
+    _cgroup_files(monkeypatch, tmp_path, quota="-1", period="100000")
+    assert cgroup_cpu_limit() is None
+
+
+def test_available_cpus_is_capped_by_quota(monkeypatch, tmp_path):
+    _cgroup_files(monkeypatch, tmp_path, v2="150000 100000")
+    monkeypatch.setattr(thread_tuning.os, "sched_getaffinity", lambda pid: set(range(64)), raising=False)
+    assert thread_tuning.available_cpus() == 2
+
+
+def test_candidate_layouts_fill_the_cpus():
+    layouts = [(l.workers, l.threads) for l in candidate_layouts(8)]
+    assert layouts == [(8, 1), (4, 2), (2, 4), (1, 8)]
+    assert [(l.workers, l.threads) for l in candidate_layouts(6)] == [(6, 1), (3, 2), (1, 4), (1, 6)]
+    assert [(l.workers, l.threads) for l in candidate_layouts(8, threads=2)] == [(4, 2)]
+    assert [(l.workers, l.threads) for l in candidate_layouts(4, workers=1)] == [(1, 1), (1, 2), (1, 4)]
+    # a fixed worker count never gets more threads than its share of the CPUs
+    assert [(l.workers, l.threads) for l in candidate_layouts(8, workers=2)] == [(2, 1), (2, 2), (2, 4)]
+    assert [(l.workers, l.threads) for l in candidate_layouts(6, workers=2)] == [(2, 1), (2, 2), (2, 3)]
+
+
+def test_tune_prefers_the_layout_with_best_combined_throughput():
+    # sleeping releases the GIL, so more workers means more calls per second
+    workloads = {"a": lambda: time.sleep(0.002), "b": lambda: time.sleep(0.004)}
+    candidates = [ThreadLayout(1, 4, "tuned"), ThreadLayout(4, 1, "tuned")]
+    layout, results = tune(workloads, candidates, seconds=0.1)
+    assert (layout.workers, layout.threads, layout.source) == (4, 1, "tuned")
+    assert [row["workers"] for row in results] == [1, 4]
+    assert results[1]["score"] == 1.0
+    assert results[1]["a"] > results[0]["a"]
@@ -0,0 +1,143 @@
+"""CPU thread topology for torch inference: how many forward passes run at
+once (workers) and how many intra-op threads each one uses.
+
+Left alone, torch gives every forward pass all cores, so a handful of
+concurrent requests oversubscribe the machine and throughput collapses. At
+startup the tuner measures a few ``workers x threads`` layouts that fit the
+available CPUs (cgroup quota and affinity aware, so a container limited to 2
+CPUs on a 64-core host is treated as 2) and picks the one with the best
+combined throughput over the loaded models.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import torch
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """CPUs allowed by the cgroup CFS quota, or None when unlimited."""
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota, period = _read(CGROUP_V1_QUOTA), _read(CGROUP_V1_PERIOD)
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: affinity mask capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(cpus, 1)
+
+
+class ThreadLayout:
+    def __init__(self, workers: int, threads: int, source: str = "default"):
+        self.workers = workers
+        self.threads = threads
+        self.source = source  # "tuned", "env" or "default"
+
+    def describe(self) -> dict:
+        return {"workers": self.workers, "threads": self.threads, "source": self.source}
+
+    def __repr__(self) -> str:
+        return f"{self.workers} workers x {self.threads} threads ({self.source})"
+
+
+def candidate_layouts(cpus: int, workers: Optional[int] = None, threads: Optional[int] = None) -> list[ThreadLayout]:
+    """Layouts that use every CPU without oversubscribing: threads in powers of
+    two (plus ``cpus`` itself), workers = cpus // threads. Fixing ``workers``
+    or ``threads`` restricts the candidates to match; with ``workers`` fixed,
+    threads go up to ``cpus // workers`` instead."""
+    per_worker = max(cpus // workers, 1) if workers else cpus
+    thread_options = (
+        [threads] if threads
+        else sorted({min(2**i, per_worker) for i in range(per_worker.bit_length())} | {per_worker})
+    )
+    layouts = []
+    for t in thread_options:
+        w = workers or max(cpus // t, 1)
+        layouts.append(ThreadLayout(w, t, "tuned"))
+    return layouts
+
+
+def measure_throughput(fn: Callable[[], object], workers: int, threads: int, seconds: float) -> float:
+    """Calls of ``fn`` per second with ``workers`` threads running it concurrently."""
+    torch.set_num_threads(threads)
+    # fresh threads pick up the new intra-op setting on their first parallel op
+    counts = [0] * workers
+    start = threading.Barrier(workers + 1)
+
+    def run(i: int) -> None:
+        fn()  # warm this thread up outside the timed window
+        start.wait()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            fn()
+            counts[i] += 1
+
+    pool = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(workers)]
+    for thread in pool:
+        thread.start()
+    start.wait()
+    begin = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return sum(counts) / max(time.perf_counter() - begin, 1e-9)
+
+
+def tune(
+    workloads: dict[str, Callable[[], object]],
+    candidates: list[ThreadLayout],
+    seconds: float = 0.3,
+) -> tuple[ThreadLayout, list[dict]]:
+    """Benchmark every candidate on every workload and return the best layout.
+
+    Each workload's throughput is normalised by its best result, and layouts
+    are ranked by the geometric mean of those ratios, so a cheap model can't
+    outvote an expensive one.
+    """
+    previous = torch.get_num_threads()
+    results = []
+    try:
+        for layout in candidates:
+            row = {**layout.describe()}
+            for name, fn in workloads.items():
+                row[name] = round(measure_throughput(fn, layout.workers, layout.threads, seconds), 2)
+            results.append(row)
+    finally:
+        torch.set_num_threads(previous)
+
+    best = {name: max(row[name] for row in results) or 1e-9 for name in workloads}
+    for row in results:
+        ratios = [max(row[name], 1e-9) / best[name] for name in workloads]
+        row["score"] = round(math.prod(ratios) ** (1 / len(ratios)), 4)
+    winner = max(results, key=lambda row: row["score"])
+    return ThreadLayout(winner["workers"], winner["threads"], "tuned"), results
@@ -16,6 +16,8 @@ import copy
 
 
 # use distilbert-base-uncased for satire detection as well
+# (for serving, train a satire head on the text detector's encoder instead:
+# model_training/text_model/multi_head_detector.py scores both from one pass)
 class SatireDetector:
 
     def __init__(self):
@@ -0,0 +1,250 @@
+"""Score a large text corpus with the text detector.
+
+Streams a JSONL, CSV or Parquet file, cleans posts with ``preprocess_text``
+in worker processes and scores them in length-sorted batches padded only to
+the smallest bucket that fits (dynamic padding). Results are appended to a
+JSONL or CSV file as each chunk finishes. A ``<output>.progress.json`` file
+records how many input rows are done and how long the output was at that
+point, so a crashed or interrupted run picks up where it stopped:
+
+  python bulk_score.py posts.jsonl scores.jsonl
+  python bulk_score.py archive.parquet scores.csv --text-column body --id-column post_id
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from tqdm.auto import tqdm
+
+from checkpoint_io import legacy_checkpoint_for
+from multi_head_detector import load_text_weights
+from text_detector import TextDetectors, preprocess_text
+
+PAD_BUCKETS = (64, 128, 256, 512)
+FIELDS = ("id", "confidence", "label", "error")
+
+
+# input
+
+def iter_rows(path, text_column="text", id_column=None):
+  """Yield ``(id, text)`` for every row; ids default to the row number."""
+  ext = os.path.splitext(path)[1].lower()
+  if ext in (".jsonl", ".ndjson"):
+    rows = _iter_jsonl(path)
+  elif ext == ".csv":
+    rows = _iter_csv(path)
+  elif ext == ".parquet":
+    rows = _iter_parquet(path, [c for c in (text_column, id_column) if c])
+  else:
+    raise ValueError(f"unsupported input format {ext!r} (expected .jsonl, .csv or .parquet)")
+  for index, row in enumerate(rows):
+    yield (row.get(id_column) if id_column else index), row.get(text_column)
+
+
+def _iter_jsonl(path):
+  with open(path, encoding="utf-8") as f:
+    for line in f:
+      if line.strip():
+        yield json.loads(line)
+
+
+def _iter_csv(path):
+  with open(path, encoding="utf-8", newline="") as f:
+    yield from csv.DictReader(f)
+
+
+def _iter_parquet(path, columns):
+  import pyarrow.parquet as pq  # type: ignore[import-untyped]
+  for batch in pq.ParquetFile(path).iter_batches(batch_size=4096, columns=columns):
+    yield from batch.to_pylist()
+
+
+def chunked(rows, size):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+# runs in the worker processes
+def clean_chunk(chunk):
+  return [(row_id, preprocess_text(text) if isinstance(text, str) else None) for row_id, text in chunk]
+
+
+def cleaned_chunks(chunks, workers):
+  """Clean chunks in ``workers`` processes, in input order, with at most
+  ``2 * workers`` chunks in flight so a huge input is never read ahead."""
+  if workers <= 1:
+    for chunk in chunks:
+      yield clean_chunk(chunk)
+    return
+  with multiprocessing.Pool(workers) as pool:
+    pending = deque()
+    for chunk in chunks:
+      pending.append(pool.apply_async(clean_chunk, (chunk,)))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
+
+
+# scoring
+
+def score_chunk(detector, chunk, batch_size):
+  """Score one cleaned chunk; results come back in the chunk's order."""
+  results = [None] * len(chunk)
+  scorable = []
+  for i, (row_id, text) in enumerate(chunk):
+    if text is None:
+      results[i] = {"id": row_id, "confidence": None, "label": None, "error": "missing text"}
+    elif not text:
+      results[i] = {"id": row_id, "confidence": None, "label": None, "error": "empty after cleaning"}
+    else:
+      scorable.append(i)
+
+  # similar lengths share a batch, so little of it is padding
+  scorable.sort(key=lambda i: len(chunk[i][1]))
+  for start in range(0, len(scorable), batch_size):
+    batch = scorable[start:start + batch_size]
+    texts = [chunk[i][1] for i in batch]
+    probs = detector.predict_probs(detector.tokenize(texts, pad_buckets=PAD_BUCKETS))
+    for i, text, prob in zip(batch, texts, probs):
+      confidence, label = detector.finalize(text, prob)
+      results[i] = {"id": chunk[i][0], "confidence": round(confidence, 6), "label": label, "error": None}
+  return results
+
+
+# output and progress
+
+class ResultWriter:
+  """Appends results to a JSONL or CSV file, truncated to ``size`` bytes
+  first so rows written after the last progress save are dropped."""
+
+  def __init__(self, path, size):
+    self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+    self.file = open(path, "a+", encoding="utf-8", newline="")
+    self.file.truncate(size)
+    self.file.seek(size)
+    if self.format == "csv":
+      self.csv = csv.DictWriter(self.file, fieldnames=FIELDS)
+      if size == 0:
+        self.csv.writeheader()
+
+  def write(self, results):
+    for result in results:
+      if self.format == "csv":
+        self.csv.writerow(result)
+      else:
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+  def sync(self):
+    """Flush to disk and return the file size."""
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    return self.file.tell()
+
+  def close(self):
+    self.file.close()
+
+
+def progress_path(output):
+  return output + ".progress.json"
+
+
+def read_progress(output, input_path):
+  path = progress_path(output)
+  if not os.path.exists(path):
+    return {"input": os.path.abspath(input_path), "rows": 0, "output_bytes": 0}
+  with open(path) as f:
+    progress = json.load(f)
+  if progress["input"] != os.path.abspath(input_path):
+    raise SystemExit(f"{output} belongs to a run over {progress['input']}; pass --restart to overwrite it")
+  return progress
+
+
+def write_progress(output, progress):
+  # write-then-rename so a crash never leaves a half-written progress file
+  path = progress_path(output)
+  with open(path + ".tmp", "w") as f:
+    json.dump(progress, f)
+  os.replace(path + ".tmp", path)
+
+
+def load_detector(checkpoint):
+  # scores from the untrained base model would look just as plausible, so a missing checkpoint is fatal
+  if not os.path.exists(checkpoint):
+    legacy = legacy_checkpoint_for(checkpoint)
+    hint = f"; convert {legacy} with `python checkpoint_io.py {legacy} {checkpoint}`" if legacy else ""
+    raise SystemExit(f"No text detector checkpoint at {checkpoint}{hint}")
+  detector = TextDetectors()
+  try:
+    multi_head = load_text_weights(detector, checkpoint)
+  except ValueError as e:
+    raise SystemExit(str(e))
+  # multi-head checkpoints share their "ai" head with detector.model, which is what gets scored
+  heads = ", ".join(multi_head.heads) if multi_head is not None else "ai"
+  print(f"Loaded text detector weights from {checkpoint} (heads: {heads}; scoring ai)")
+  return detector
+
+
+def run(args):
+  if args.restart and os.path.exists(progress_path(args.output)):
+    os.remove(progress_path(args.output))
+  has_progress = os.path.exists(progress_path(args.output))
+  if not args.restart and not has_progress and os.path.exists(args.output) and os.path.getsize(args.output) > 0:
+    raise SystemExit(f"{args.output} already exists but has no progress file; pass --restart to overwrite it")
+  progress = read_progress(args.output, args.input)
+  if progress["rows"] == 0:
+    progress["output_bytes"] = 0
+  detector = load_detector(args.checkpoint)
+
+  rows = iter_rows(args.input, args.text_column, args.id_column)
+  for _ in range(progress["rows"]):  # already scored
+    next(rows, None)
+
+  writer = ResultWriter(args.output, progress["output_bytes"])
+  bar = tqdm(initial=progress["rows"], unit="post", desc="Scoring", dynamic_ncols=True)
+  started, scored = time.perf_counter(), 0
+  try:
+    for chunk in cleaned_chunks(chunked(rows, args.chunk_size), args.workers):
+      writer.write(score_chunk(detector, chunk, args.batch_size))
+      progress["rows"] += len(chunk)
+      progress["output_bytes"] = writer.sync()
+      write_progress(args.output, progress)
+      scored += len(chunk)
+      bar.update(len(chunk))
+      bar.set_postfix(posts_per_sec=f"{scored / (time.perf_counter() - started):.1f}")
+  finally:
+    bar.close()
+    writer.close()
+
+  elapsed = time.perf_counter() - started
+  print(f"Scored {scored} posts in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):.1f} posts/sec); "
+        f"{progress['rows']} rows done in total")
+
+
+if __name__ == "__main__":
+  script_dir = os.path.dirname(__file__)
+  parser = argparse.ArgumentParser(description="Bulk-score a JSONL/CSV/Parquet text corpus, resumably")
+  parser.add_argument("input", help=".jsonl, .csv or .parquet file")
+  parser.add_argument("output", help=".jsonl or .csv results file (appended to when resuming)")
+  parser.add_argument("--text-column", default="text")
+  parser.add_argument("--id-column", help="Column copied to the results as id (default: row number)")
+  parser.add_argument("--checkpoint", default=os.path.join(script_dir, "best_text_detector_smaller.safetensors"))
+  parser.add_argument("--workers", type=int, default=max(min(os.cpu_count() or 1, 8) - 1, 1),
+                      help="Processes cleaning text; 1 cleans in the scoring process")
+  parser.add_argument("--batch-size", type=int, default=32)
+  parser.add_argument("--chunk-size", type=int, default=1024,
+                      help="Rows cleaned, sorted, scored and checkpointed together")
+  parser.add_argument("--restart", action="store_true",
+                      help="Ignore saved progress and overwrite the output from the start")
+  run(parser.parse_args())
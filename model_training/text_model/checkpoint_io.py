@@ -0,0 +1,192 @@
+"""Safetensors checkpoints for the text pipeline.
+
+Checkpoints are written as ``.safetensors`` next to a small
+``<name>.manifest.json`` holding their sha256, size and tensor count. Writes
+happen on a background thread (``AsyncCheckpointWriter``), and loads
+memory-map the file instead of unpickling it. A successful sha256 check is
+remembered in ``<name>.verified.json`` (size + mtime), so only new or changed
+files are hashed again on load.
+
+Convert a legacy pickled checkpoint (``.pt`` or ``.pt.gz``) once with:
+
+  python checkpoint_io.py best_text_detector_smaller.pt.gz best_text_detector_smaller.safetensors
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+from safetensors.torch import load_file, save_file
+
+MANIFEST_SUFFIX = ".manifest.json"
+VERIFIED_SUFFIX = ".verified.json"
+LEGACY_SUFFIXES = (".pt", ".pt.gz")
+
+
+class ChecksumMismatch(Exception):
+  pass
+
+
+def manifest_path(path):
+  return os.path.splitext(path)[0] + MANIFEST_SUFFIX
+
+
+def verified_path(path):
+  return os.path.splitext(path)[0] + VERIFIED_SUFFIX
+
+
+def file_sha256(path, chunk_size=1 << 20):
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+# copy a state dict to CPU so training can keep mutating the live weights;
+# clone() also breaks storage sharing, which safetensors refuses to write
+def snapshot_state_dict(state_dict, dtype=None):
+  snapshot = {}
+  for name, tensor in state_dict.items():
+    tensor = tensor.detach()
+    if dtype is not None and tensor.is_floating_point():
+      tensor = tensor.to(dtype)
+    snapshot[name] = tensor.to("cpu", copy=True).contiguous()
+  return snapshot
+
+
+# write tensors + manifest; the file is written to a temp name and renamed so
+# readers never see a partial checkpoint
+def save_checkpoint(state_dict, path, metadata=None):
+  tmp = path + ".tmp"
+  save_file(state_dict, tmp, metadata={k: str(v) for k, v in (metadata or {}).items()})
+  os.replace(tmp, path)
+  manifest = {
+    "file": os.path.basename(path),
+    "format": "safetensors",
+    "sha256": file_sha256(path),
+    "bytes": os.path.getsize(path),
+    "tensors": len(state_dict),
+    "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    "metadata": metadata or {},
+  }
+  tmp = manifest_path(path) + ".tmp"
+  with open(tmp, "w") as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(tmp, manifest_path(path))
+  return manifest
+
+
+def _read_json(path):
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+
+def read_manifest(path):
+  return _read_json(manifest_path(path))
+
+
+# hash the file against its manifest, unless this exact file (same size and
+# mtime) was already verified against the same manifest sha256
+def verify_checkpoint(path):
+  manifest = read_manifest(path)
+  if manifest is None:
+    warnings.warn(f"{path} has no {MANIFEST_SUFFIX}; loading it unverified", stacklevel=3)
+    return False
+  stat = os.stat(path)
+  stamp = {"sha256": manifest["sha256"], "bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+  try:
+    if _read_json(verified_path(path)) == stamp:
+      return True
+  except (OSError, ValueError):
+    pass  # unreadable stamp: hash again
+  if stat.st_size != manifest.get("bytes", stat.st_size):
+    raise ChecksumMismatch(f"{path}: {stat.st_size} bytes, manifest says {manifest['bytes']}")
+  actual = file_sha256(path)
+  if actual != manifest["sha256"]:
+    raise ChecksumMismatch(f"{path}: sha256 {actual[:12]} does not match manifest {manifest['sha256'][:12]}")
+  try:
+    tmp = verified_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+      json.dump(stamp, f)
+    os.replace(tmp, verified_path(path))
+  except OSError:
+    pass  # read-only model directory: verify again next time
+  return True
+
+
+# memory-mapped load; never unpickles. With verify=True the file's sha256 is
+# checked against its manifest first (cached, see verify_checkpoint); a
+# missing manifest is warned about.
+def load_checkpoint(path, device="cpu", verify=False):
+  if not path.endswith(".safetensors"):
+    raise ValueError(f"refusing to load non-safetensors checkpoint {path}; convert it with checkpoint_io.py")
+  if verify:
+    verify_checkpoint(path)
+  return load_file(path, device=str(device))
+
+
+class AsyncCheckpointWriter:
+  """Snapshots a state dict on the caller's thread and writes it on a background one.
+
+  Only the device-to-CPU copy blocks training; serialization, hashing and the
+  disk write overlap with the next steps. Writes run in submission order.
+  """
+
+  def __init__(self):
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+    self._pending = []
+    self._lock = threading.Lock()
+
+  def submit(self, state_dict, path, metadata=None, dtype=None) -> Future:
+    snapshot = snapshot_state_dict(state_dict, dtype)
+    future = self._executor.submit(save_checkpoint, snapshot, path, metadata)
+    with self._lock:
+      self._pending = [f for f in self._pending if not f.done()] + [future]
+    return future
+
+  # block until every submitted checkpoint is on disk; re-raises write errors
+  def wait(self):
+    with self._lock:
+      pending, self._pending = self._pending, []
+    return [f.result() for f in pending]
+
+  def close(self):
+    self.wait()
+    self._executor.shutdown()
+
+
+# an unconverted pickled checkpoint (<stem>.pt or <stem>.pt.gz) next to a
+# .safetensors path, or None
+def legacy_checkpoint_for(path):
+  stem = path[: -len(".safetensors")] if path.endswith(".safetensors") else path
+  return next((stem + suffix for suffix in LEGACY_SUFFIXES if os.path.exists(stem + suffix)), None)
+
+
+# one-off migration from pickled torch.save checkpoints (optionally gzipped)
+def convert_legacy_checkpoint(src, dst):
+  opener = gzip.open if src.endswith(".gz") else open
+  try:
+    with opener(src, "rb") as f:
+      state = torch.load(f, map_location="cpu", weights_only=True)
+  except gzip.BadGzipFile:
+    with open(src, "rb") as f:
+      state = torch.load(f, map_location="cpu", weights_only=True)
+  return save_checkpoint(snapshot_state_dict(state), dst, metadata={"converted_from": os.path.basename(src)})
+
+
+if __name__ == "__main__":
+  if len(sys.argv) != 3:
+    print(__doc__)
+    sys.exit(1)
+  manifest = convert_legacy_checkpoint(sys.argv[1], sys.argv[2])
+  print(f"Wrote {sys.argv[2]} ({manifest['bytes']} bytes, sha256 {manifest['sha256'][:12]})")
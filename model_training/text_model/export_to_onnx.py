@@ -1,29 +1,18 @@
 import os
-import gzip
 import torch
 from text_detector import TextDetectors
+from checkpoint_io import load_checkpoint
 
 # load the detector 
 detector = TextDetectors()
 model = detector.model
 device = detector.device
 
-# load the best model state from file if it exists
+# load the best model state from file if it exists (memory-mapped safetensors)
 script_dir = os.path.dirname(__file__)
-best_gz = os.path.join(script_dir, "best_text_detector_smaller.pt.gz")
-best_pt = os.path.join(script_dir, "best_text_detector_smaller.pt")
-best_model_path = best_gz if os.path.exists(best_gz) else best_pt
+best_model_path = os.path.join(script_dir, "best_text_detector_smaller.safetensors")
 if os.path.exists(best_model_path):
-  if best_model_path.endswith(".gz"):
-    try:
-      with gzip.open(best_model_path, "rb") as f:
-        state = torch.load(f, map_location=device)
-    except gzip.BadGzipFile:
-      with open(best_model_path, "rb") as f:
-        state = torch.load(f, map_location=device)
-  else:
-    with open(best_model_path, "rb") as f:
-      state = torch.load(f, map_location=device)
+  state = load_checkpoint(best_model_path, device=device, verify=True)
   is_desklib_checkpoint = any(k.startswith("model.") for k in state.keys())
   if (detector.use_binary_logit and is_desklib_checkpoint) or (not detector.use_binary_logit and not is_desklib_checkpoint):
     model.load_state_dict(state, strict=True)
@@ -0,0 +1,197 @@
+import argparse
+import os
+import random
+
+import torch  # type: ignore[import-untyped]
+import torch.nn as nn
+from datasets import load_dataset  # type: ignore[import-untyped]
+from torch.utils.data import DataLoader  # type: ignore[import-untyped]
+from tqdm.auto import tqdm
+
+from checkpoint_io import load_checkpoint, save_checkpoint, snapshot_state_dict
+from text_detector import TextDetectors, clean_example, get_text_column, tokenize_batch
+
+HEADS = ("ai", "satire")
+
+
+# same layout as DistilBertForSequenceClassification's head, so the trained
+# AI-text head can be reused as-is
+class ClassificationHead(nn.Module):
+  def __init__(self, dim, num_labels=2, dropout=0.2, pre_classifier=None, classifier=None):
+    super().__init__()
+    self.pre_classifier = pre_classifier if pre_classifier is not None else nn.Linear(dim, dim)
+    self.classifier = classifier if classifier is not None else nn.Linear(dim, num_labels)
+    self.dropout = nn.Dropout(dropout)
+
+  def forward(self, pooled):
+    return self.classifier(self.dropout(torch.relu(self.pre_classifier(pooled))))
+
+
+# one DistilBERT encoder shared by several classification heads: every head
+# is scored from a single encoder pass
+class MultiHeadTextModel(nn.Module):
+  def __init__(self, encoder, heads):
+    super().__init__()
+    self.encoder = encoder
+    self.heads = nn.ModuleDict(heads)
+
+  # wrap a trained DistilBertForSequenceClassification: its encoder and head
+  # become the shared encoder and the "ai" head (shared modules, not copies,
+  # so the original model keeps working and no weights are duplicated)
+  @classmethod
+  def from_sequence_classifier(cls, model, extra_heads=("satire",)):
+    config = model.config
+    # the desklib fallback (DesklibAIDetectionModel) has a single-logit,
+    # mean-pooled head that can't be shared this way
+    is_distilbert = all(hasattr(model, name) for name in ("distilbert", "pre_classifier", "classifier"))
+    if config.model_type != "distilbert" or not is_distilbert:
+      raise ValueError(
+        f"multi-head text models need a DistilBertForSequenceClassification base, got {type(model).__name__} "
+        f"({config.model_type}); TextDetectors falls back to desklib when its DistilBERT base can't be loaded"
+      )
+    dropout = config.seq_classif_dropout
+    heads = {"ai": ClassificationHead(config.dim, dropout=dropout, pre_classifier=model.pre_classifier, classifier=model.classifier)}
+    for name in extra_heads:
+      heads[name] = ClassificationHead(config.dim, num_labels=2, dropout=dropout)
+    return cls(model.distilbert, heads).to(next(model.parameters()).device)
+
+  @staticmethod
+  def is_multi_head_state(state):
+    return any(k.startswith("heads.") for k in state)
+
+  def forward(self, input_ids, attention_mask=None):
+    hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+    pooled = hidden[:, 0]  # [CLS]
+    return {name: head(pooled) for name, head in self.heads.items()}
+
+  # freeze (or unfreeze) the shared encoder for head-only training
+  def freeze_encoder(self, frozen=True):
+    self.encoder.requires_grad_(not frozen)
+
+
+# load a trained checkpoint into detector.model; a multi-head checkpoint comes
+# back as a MultiHeadTextModel whose "ai" head and encoder are detector.model's
+# own modules, so detector keeps scoring AI text either way. Returns None for a
+# single-head checkpoint. Shared by the backend and bulk_score.py.
+def load_text_weights(detector, path):
+  state = load_checkpoint(path, device=detector.device, verify=True)
+  multi_head = None
+  if MultiHeadTextModel.is_multi_head_state(state):
+    multi_head = MultiHeadTextModel.from_sequence_classifier(detector.model)
+    multi_head.load_state_dict(state, strict=True)
+    multi_head.eval()
+  else:
+    is_desklib_checkpoint = any(k.startswith("model.") for k in state.keys())
+    if detector.use_binary_logit != is_desklib_checkpoint:
+      raise ValueError(f"{path} doesn't match the loaded base model [{detector.model_name}]")
+    detector.model.load_state_dict(state, strict=True)
+  detector.model.eval()
+  return multi_head
+
+
+# train heads on per-task loaders, interleaving batches of every task; each
+# batch only contributes loss to its own head. With freeze_encoder, the
+# encoder runs in eval mode without gradients and only the heads are updated.
+def train_multi_head(model, loaders, device, epochs=3, lr=None, freeze_encoder=False):
+  model.freeze_encoder(freeze_encoder)
+  params = [p for p in model.parameters() if p.requires_grad]
+  optimizer = torch.optim.AdamW(params, lr=lr or (1e-3 if freeze_encoder else 5e-5))
+  loss_fn = nn.CrossEntropyLoss()
+  history = []
+
+  for epoch in range(epochs):
+    model.train()
+    if freeze_encoder:
+      model.encoder.eval()
+    schedule = [name for name, loader in loaders.items() for _ in range(len(loader))]
+    random.shuffle(schedule)
+    iterators = {name: iter(loader) for name, loader in loaders.items()}
+    totals = {name: 0.0 for name in loaders}
+
+    for name in tqdm(schedule, desc=f"Epoch {epoch + 1}", unit="batch"):
+      batch = next(iterators[name])
+      input_ids = batch["input_ids"].to(device)
+      attention_mask = batch["attention_mask"].to(device)
+      labels = batch["label"].to(device)
+
+      with torch.set_grad_enabled(not freeze_encoder):
+        hidden = model.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+      logits = model.heads[name](hidden[:, 0])
+      loss = loss_fn(logits, labels)
+
+      optimizer.zero_grad()
+      loss.backward()
+      optimizer.step()
+      totals[name] += loss.item()
+
+    history.append({name: totals[name] / max(len(loaders[name]), 1) for name in loaders})
+    print(f"Epoch {epoch + 1}: " + " | ".join(f"{name} loss {loss:.4f}" for name, loss in history[-1].items()))
+
+  model.freeze_encoder(False)
+  return history
+
+
+# accuracy of one head on a tokenized loader
+def evaluate_head(model, loader, head, device):
+  model.eval()
+  correct = total = 0
+  with torch.no_grad():
+    for batch in loader:
+      logits = model(batch["input_ids"].to(device), attention_mask=batch["attention_mask"].to(device))[head]
+      correct += (logits.argmax(dim=-1).cpu() == batch["label"]).sum().item()
+      total += batch["label"].size(0)
+  return correct / total if total else 0.0
+
+
+# load a (text, label) CSV, clean, tokenize and split it into train/val loaders
+def csv_loaders(path, tokenizer, batch_size=16, val_fraction=0.2, seed=42):
+  dataset = load_dataset("csv", data_files=path)["train"]
+  dataset = dataset.map(lambda x: {"label": int(x["label"]) if x.get("label") is not None else 0})
+  text_column = get_text_column(dataset)
+  dataset = dataset.map(lambda ex: clean_example(ex, text_column))
+  dataset = dataset.map(lambda x: tokenize_batch(x, tokenizer, text_column), batched=True, batch_size=1000)
+  dataset.set_format(type="torch", columns=["input_ids", "attention_mask", "label"])
+  split = dataset.train_test_split(test_size=val_fraction, seed=seed)
+  return (
+    DataLoader(split["train"], batch_size=batch_size, shuffle=True),
+    DataLoader(split["test"], batch_size=batch_size, shuffle=False),
+  )
+
+
+if __name__ == "__main__":
+  script_dir = os.path.dirname(__file__)
+  parser = argparse.ArgumentParser(description="Train the shared-encoder AI-text + satire model")
+  parser.add_argument("--satire-csv", required=True, help="CSV with text,label columns (1 = satire)")
+  parser.add_argument("--ai-csv", help="CSV with text,label columns (1 = AI); trains the AI head jointly")
+  parser.add_argument("--text-checkpoint", default=os.path.join(script_dir, "best_text_detector_smaller.safetensors"))
+  parser.add_argument("--output", default=os.path.join(script_dir, "multi_head_detector.safetensors"))
+  parser.add_argument("--freeze-encoder", action="store_true", help="Train heads only; AI-text scores stay unchanged without --ai-csv")
+  parser.add_argument("--epochs", type=int, default=3)
+  parser.add_argument("--lr", type=float)
+  args = parser.parse_args()
+
+  random.seed(42)
+  torch.manual_seed(42)
+  detector = TextDetectors()
+  if detector.use_binary_logit:
+    raise SystemExit("The multi-head model needs the DistilBERT text detector, not the desklib fallback")
+  if os.path.exists(args.text_checkpoint):
+    detector.model.load_state_dict(load_checkpoint(args.text_checkpoint, device=detector.device, verify=True), strict=True)
+    print(f"Loaded text detector weights from {args.text_checkpoint}")
+  model = MultiHeadTextModel.from_sequence_classifier(detector.model)
+
+  train_loaders, val_loaders = {}, {}
+  train_loaders["satire"], val_loaders["satire"] = csv_loaders(args.satire_csv, detector.tokenizer)
+  if args.ai_csv:
+    train_loaders["ai"], val_loaders["ai"] = csv_loaders(args.ai_csv, detector.tokenizer)
+
+  train_multi_head(model, train_loaders, detector.device, epochs=args.epochs, lr=args.lr, freeze_encoder=args.freeze_encoder)
+  for name, loader in val_loaders.items():
+    print(f"Validation accuracy [{name}]: {evaluate_head(model, loader, name, detector.device) * 100:.2f}%")
+
+  manifest = save_checkpoint(
+    snapshot_state_dict(model.state_dict()),
+    args.output,
+    metadata={"heads": ",".join(model.heads), "freeze_encoder": args.freeze_encoder, "epochs": args.epochs},
+  )
+  print(f"Saved multi-head model to {args.output} (sha256 {manifest['sha256'][:12]})")
@@ -1,133 +1,204 @@
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
 import nlpaug.augmenter.char as nac
 import nlpaug.augmenter.word as naw
-import random
+
+# bump when augmentation logic changes so cached stress sets are regenerated
+STRESS_TEST_VERSION = 2
+
+LEETS = {'e': '3', 'i': '1', 'a': '@', 's': '5', 'o': '0'}
+HOMOGLYPHS = {'a': 'а', 'e': 'е', 'o': 'о', 'p': 'р', 's': 'ѕ'}
+
+# generated by gemini
+AI_SLOPS = [
+    "In conclusion, it is important to remember that ",
+    "Furthermore, it should be noted that ",
+    "To summarize the multifaceted nature of ",
+    "I am thrilled and humbled to announce that ",
+    "In today’s rapidly evolving digital landscape, ",
+    "Let that sink in for a moment. ",
+    "What most people fail to realize is that ",
+    "This is a common misconception, and it's actually ",
+    "The reality is much more nuanced than ",
+    "The secret to unlocking your true potential lies in ",
+    "It’s almost as if we are living in a society where ",
+    "I’ve been doing a deep dive into the intersection of ",
+    "Imagine a world where we didn't have to choose between ",
+    "I didn't believe it at first, but then I realized that ",
+    "The one simple trick that changed everything for me was ",
+    "If you only read one thing today, make it this: ",
+    "We need to have a serious conversation about the future of ",
+    "To be fair, you have to realize that ",
+    "This is a common misconception, and it's actually much more ",
+    "While I see where you’re coming from, the reality is ",
+    "It’s almost as if [sarcastic summary of the user's point]... ",
+    "The sheer level of cognitive dissonance required to ",
+    "This is the quintessential example of the Dunning-Kruger effect in ",
+    "Can we talk about how problematic it is that ",
+    "I’ve been doing a deep dive into this topic, and honestly, ",
+    "I suspect I’ll be downvoted for this, but the truth is ",
+    "Edit: Thanks for the gold! Just wanted to add that ",
+    "It is crucial to consider the broader implications of ",
+    "In the rapidly evolving landscape of ",
+    "Ultimately, the key takeaway remains that ",
+    "The answer is multifaceted and deeply nuanced, as ",
+    "Moreover, one must take into account the fact that ",
+    "In summary, the interplay between these various elements ",
+    "As we delve deeper into the complexities of ",
+    "It is essential to strike a balance between ",
+    "This serves as a poignant testament to "
+]
+
 
 class StressTestGenerator:
 
   # initilize the augmenters for each type of stress test
-  def __init__(self):
+  # every random choice is drawn from a per-example generator seeded by
+  # (seed, example index), so a stress set is reproducible regardless of
+  # how examples are split across worker processes
+  def __init__(self, seed: int = 0, homoglyph_intensity: float = 0.1, typo_char_p: float = 0.1, typo_word_p: float = 0.1):
+    self.seed = seed
+    self.homoglyph_intensity = homoglyph_intensity
+    self.typo_char_p = typo_char_p
+    self.typo_word_p = typo_word_p
+
     # case augmentation
     self.char_augmenter = nac.RandomCharAug(action="substitute", verbose=0)
     # word augmentation
     self.word_augmenter = naw.RandomWordAug(action="swap", verbose=0)
 
     # typo augmentation
-    self.typo_aug = nac.KeyboardAug(aug_char_p=0.1, aug_word_p=0.1, verbose=0)
+    self.typo_aug = nac.KeyboardAug(aug_char_p=typo_char_p, aug_word_p=typo_word_p, verbose=0)
 
     # homoglyphs augmentation
-    self.homoglyphs = {'a': 'а', 'e': 'е', 'o': 'о', 'p': 'р', 's': 'ѕ'}
+    self.homoglyphs = HOMOGLYPHS
+    self.leet_table = str.maketrans(LEETS)
+    self.homoglyph_table = str.maketrans(HOMOGLYPHS)
+
+  # everything that changes the generated text; part of the cache key
+  def config(self) -> dict:
+    return {
+      "version": STRESS_TEST_VERSION,
+      "seed": self.seed,
+      "homoglyph_intensity": self.homoglyph_intensity,
+      "typo_char_p": self.typo_char_p,
+      "typo_word_p": self.typo_word_p,
+    }
 
-  # inject leetspeak  into the text
+  # independent random generator for one example
+  def example_rng(self, index: int) -> np.random.Generator:
+    return np.random.default_rng([self.seed, index])
+
+  # inject leetspeak into the text
   def inject_leetspeak(self, text):
-    leets = {'e': '3', 'i': '1', 'a': '@', 's': '5', 'o': '0'}
-    words = text.split()
-    for i, word in enumerate(words):
-      for char, leet in leets.items():
-        if char in word:
-          words[i] = word.replace(char, leet)
-    return ' '.join(words)
-  
-  # inject homoglyphs into the text
-  def inject_homoglyphs(self, text, intensity=0.1):
-    chars = list(text)
-    for i in range(len(chars)):
-        if chars[i] in self.homoglyphs and random.random() < intensity:
-            chars[i] = self.homoglyphs[chars[i]]
-    return "".join(chars)
+    return text.translate(self.leet_table)
+
+  # inject homoglyphs into the text: swap each candidate char with probability `intensity`
+  def inject_homoglyphs(self, text, intensity=0.1, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    swapped = text.translate(self.homoglyph_table)
+    if swapped == text:
+      return text
+    # compare code points as arrays instead of looping over characters
+    original = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    candidate = np.frombuffer(swapped.encode("utf-32-le"), dtype=np.uint32)
+    mask = (original != candidate) & (rng.random(original.shape[0]) < intensity)
+    return np.where(mask, candidate, original).astype(np.uint32).tobytes().decode("utf-32-le")
 
   # add an AI slop to the text
-  def add_ai_slop(self, text):
-    # generated by gemini
-    slops = [
-        "In conclusion, it is important to remember that ",
-        "Furthermore, it should be noted that ",
-        "To summarize the multifaceted nature of ",
-        "I am thrilled and humbled to announce that ",
-        "In today’s rapidly evolving digital landscape, ",
-        "Let that sink in for a moment. ",
-        "What most people fail to realize is that ",
-        "This is a common misconception, and it's actually ",
-        "The reality is much more nuanced than ",
-        "The secret to unlocking your true potential lies in ",
-        "It’s almost as if we are living in a society where ",
-        "I’ve been doing a deep dive into the intersection of ",
-        "Imagine a world where we didn't have to choose between ",
-        "I didn't believe it at first, but then I realized that ",
-        "The one simple trick that changed everything for me was ",
-        "If you only read one thing today, make it this: ",
-        "We need to have a serious conversation about the future of ",
-        "To be fair, you have to realize that ",
-        "This is a common misconception, and it's actually much more ",
-        "While I see where you’re coming from, the reality is ",
-        "It’s almost as if [sarcastic summary of the user's point]... ",
-        "The sheer level of cognitive dissonance required to ",
-        "This is the quintessential example of the Dunning-Kruger effect in ",
-        "Can we talk about how problematic it is that ",
-        "I’ve been doing a deep dive into this topic, and honestly, ",
-        "I suspect I’ll be downvoted for this, but the truth is ",
-        "Edit: Thanks for the gold! Just wanted to add that ",
-        "It is crucial to consider the broader implications of ",
-        "In the rapidly evolving landscape of ",
-        "Ultimately, the key takeaway remains that ",
-        "The answer is multifaceted and deeply nuanced, as ",
-        "Moreover, one must take into account the fact that ",
-        "In summary, the interplay between these various elements ",
-        "As we delve deeper into the complexities of ",
-        "It is essential to strike a balance between ",
-        "This serves as a poignant testament to "
-    ]
-    return random.choice(slops) + text
-  
+  def add_ai_slop(self, text, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    return AI_SLOPS[rng.integers(len(AI_SLOPS))] + text
+
+  # run an nlpaug augmenter; nlpaug draws from the global random/numpy state,
+  # so seed both from the example's generator first and restore the caller's
+  # state afterwards (the training script's own draws stay untouched)
+  @staticmethod
+  def _nlpaug(augmenter, text, rng):
+    seed = int(rng.integers(2**32))
+    python_state, numpy_state = random.getstate(), np.random.get_state()
+    try:
+      random.seed(seed)
+      np.random.seed(seed)
+      augmented = augmenter.augment(text)
+    finally:
+      random.setstate(python_state)
+      np.random.set_state(numpy_state)
+    if isinstance(augmented, list):
+      augmented = augmented[0]
+    return augmented
+
   # generate a stress test for a single text
-  def generate_stress_test(self, text: str) -> str:
+  def generate_stress_test(self, text: str, index: int = None) -> str:
+    rng = self.example_rng(index) if index is not None else np.random.default_rng()
+    # one coin per stage: char, word, leetspeak, homoglyphs, AI slop, typos
+    apply = rng.integers(0, 2, size=6).astype(bool)
     augmented_text = text
-    # make everything random
-
-    # randomly apply char augmentation
-    if random.randint(0, 1):  # 1 = apply
-      # print("applying char augmentation")
-      augmented_text = self.char_augmenter.augment(augmented_text)
-      if isinstance(augmented_text, list):
-        augmented_text = augmented_text[0]
-
-    # randomly apply word augmentation
-    if random.randint(0, 1):
-      # print("applying word augmentation")
-      augmented_text = self.word_augmenter.augment(augmented_text)
-      if isinstance(augmented_text, list):
-        augmented_text = augmented_text[0]
-
-    # randomly apply leetspeak
-    if random.randint(0, 1):
-      # print("applying leetspeak")
-      augmented_text = self.inject_leetspeak(augmented_text)
 
-    # randomly apply homoglyphs
-    if random.randint(0, 1):
-      # print("applying homoglyphs")
-      augmented_text = self.inject_homoglyphs(augmented_text)
+    if apply[0]:
+      augmented_text = self._nlpaug(self.char_augmenter, augmented_text, rng)
+    if apply[1]:
+      augmented_text = self._nlpaug(self.word_augmenter, augmented_text, rng)
+    if apply[2]:
+      augmented_text = self.inject_leetspeak(augmented_text)
+    if apply[3]:
+      augmented_text = self.inject_homoglyphs(augmented_text, self.homoglyph_intensity, rng)
+    if apply[4]:
+      augmented_text = self.add_ai_slop(augmented_text, rng)
+    if apply[5]:
+      augmented_text = self._nlpaug(self.typo_aug, augmented_text, rng)
 
-    # randomly add AI slop
-    if random.randint(0, 1):
-      # print("adding AI slop")
-      augmented_text = self.add_ai_slop(augmented_text)
+    return augmented_text
 
-    # randomly apply typos
-    if random.randint(0, 1):
-      # print("applying typos")
-      augmented_text = self.typo_aug.augment(augmented_text)
-      if isinstance(augmented_text, list):
-        augmented_text = augmented_text[0]
+  # augment one batch of a HuggingFace Dataset (used with batched=True, with_indices=True)
+  def _augment_batch(self, batch, indices, text_column):
+    batch[text_column] = [
+      self.generate_stress_test(text, index) for text, index in zip(batch[text_column], indices)
+    ]
+    return batch
 
-    return augmented_text
+  # cache key: generator config plus the exact source texts
+  def cache_key(self, dataset, text_column: str = "text") -> str:
+    h = hashlib.sha256(json.dumps({**self.config(), "text_column": text_column}, sort_keys=True).encode())
+    for text in dataset[text_column]:
+      h.update(text.encode("utf-8"))
+      h.update(b"\0")
+    return h.hexdigest()[:16]
 
   # generate a stress-tested version of an entire HuggingFace Dataset
-  def generate_stress_test_dataset(self, dataset, text_column: str = "text"):
-    def _augment(example):
-      example[text_column] = self.generate_stress_test(example[text_column])
-      return example
-    return dataset.map(_augment)
+  # batched across `num_proc` processes; with `cache_dir`, the result is saved
+  # under a key of (seed, config, source texts) and reloaded on later runs
+  def generate_stress_test_dataset(self, dataset, text_column: str = "text", num_proc: int = None, batch_size: int = 256, cache_dir: str = None):
+    cache_path = None
+    if cache_dir:
+      cache_path = os.path.join(cache_dir, f"stress-{self.cache_key(dataset, text_column)}")
+      if os.path.exists(os.path.join(cache_path, "dataset_info.json")):
+        from datasets import load_from_disk
+        print(f"Loaded cached stress test set from {cache_path}")
+        return load_from_disk(cache_path)
+
+    if num_proc is None:
+      num_proc = max(1, min(os.cpu_count() or 1, len(dataset) // batch_size))
+    stressed = dataset.map(
+      self._augment_batch,
+      batched=True,
+      batch_size=batch_size,
+      with_indices=True,
+      fn_kwargs={"text_column": text_column},
+      num_proc=num_proc if num_proc > 1 else None,
+      load_from_cache_file=False,
+      desc="Generating stress tests",
+    )
+
+    if cache_path:
+      stressed.save_to_disk(cache_path)
+      print(f"Saved stress test set to {cache_path}")
+    return stressed
 
 if __name__ == "__main__":
   tester = StressTestGenerator()
-  print(tester.generate_stress_test("The quick brown fox jumps over the lazy dog."))
\ No newline at end of file
+  print(tester.generate_stress_test("The quick brown fox jumps over the lazy dog."))
@@ -16,10 +16,9 @@ from torch.utils.data import DataLoader # type: ignore[import-untyped]
 
 # for training loop
 from torch.optim import AdamW
-import copy
 
 # for saving the model
-import gzip
+from checkpoint_io import AsyncCheckpointWriter, load_checkpoint
 
 # for training progress tracking
 from tqdm.auto import tqdm
@@ -196,6 +195,21 @@ def tokenize_batch(batch, tokenizer, text_column="text"):
     max_length=512
   )
 
+# run the frozen teacher once over a dataset and store its probability as a
+# "teacher_prob" column, so distillation epochs only pay for the student
+def add_teacher_probs(dataset, teacher_model, teacher_tokenizer, device, text_column="text", batch_size=32):
+  teacher_model.eval()
+
+  def _teacher_batch(batch):
+    # pad to the longest text in the batch instead of 512; the attention mask hides padding
+    enc = teacher_tokenizer(batch[text_column], padding=True, truncation=True, max_length=512, return_tensors="pt")
+    with torch.no_grad():
+      outputs = teacher_model(enc["input_ids"].to(device), attention_mask=enc["attention_mask"].to(device))
+      probs = torch.sigmoid(outputs["logits"].squeeze(-1).float())
+    return {"teacher_prob": probs.cpu().tolist()}
+
+  return dataset.map(_teacher_batch, batched=True, batch_size=batch_size, desc="Teacher probabilities")
+
 class TextDetectors:
   """
   Implementation of the TextDetector class (design section 3)
@@ -257,27 +271,67 @@ class TextDetectors:
     # clean the text if needed
     if clean:
       text = preprocess_text(text)
-    # tokenize the text
+    enc = self.tokenize([text])
+    prob = self.predict_probs(enc)[0]
+    return self.finalize(text, prob, human_max=human_max, ai_min=ai_min, return_pct=return_pct)
+
+  # tokenize a batch of (already cleaned) texts and move it to the device
+  # with pad_buckets (e.g. (64, 128, 256, 512)) the batch is padded to the smallest
+  # bucket that fits its longest text instead of always to 512 tokens
+  def tokenize(self, texts, pad_buckets=None):
+    if not pad_buckets:
+      enc = self.tokenizer(
+        texts,
+        padding="max_length",
+        truncation=True,
+        max_length=512,
+        return_tensors="pt",
+      )
+      return {k: v.to(self.device) for k, v in enc.items()}
+
+    buckets = sorted(pad_buckets)
     enc = self.tokenizer(
-      text,
-      padding="max_length",
+      texts,
+      padding="longest",
       truncation=True,
-      max_length=512,
+      max_length=buckets[-1],
       return_tensors="pt",
     )
-    # move the text to the device
-    enc = {k: v.to(self.device) for k, v in enc.items()}
+    length = enc["input_ids"].shape[1]
+    target = next((b for b in buckets if b >= length), length)
+    out = {}
+    for k, v in enc.items():
+      pad_value = self.tokenizer.pad_token_id if k == "input_ids" else 0
+      out[k] = nn.functional.pad(v, (0, target - length), value=pad_value).to(self.device)
+    return out
+
+  # forward pass over a tokenized batch, returns the AI probability of every row
+  def predict_probs(self, enc):
     # evaluation mode
     self.model.eval()
     # output, no weights are updated
     with torch.no_grad():
       outputs = self.model(**enc)
     logits = outputs["logits"] if isinstance(outputs, dict) else outputs.logits
+    return self.logits_to_probs(logits)
+
+  # convert a batch of logits to the AI probability of every row
+  def logits_to_probs(self, logits):
     if self.use_binary_logit:
-      prob = torch.sigmoid(logits.squeeze(-1)).item()
+      probs = torch.sigmoid(logits.squeeze(-1))
     else:
-      prob = torch.softmax(logits, dim=1)[0, 1].item()
+      probs = torch.softmax(logits, dim=1)[:, 1]
+    return probs.tolist()
 
+  # apply the LLM metadata boost and thresholds to a raw model probability
+  def finalize(
+    self,
+    text: str,
+    prob: float,
+    human_max: float = 0.40,
+    ai_min: float = 0.70,
+    return_pct: bool = False,
+  ):
     # add 50% or 30% to confidence if LLM metadata (version; Engine: text-xxx; etc.) is present
     if has_llm_metadata(text):
       if prob <= 0.1:
@@ -326,14 +380,14 @@ if __name__ == "__main__":
     detector = TextDetectors()
 
     # load the best model state from file if it exists
-    best_model_path = os.path.join(os.path.dirname(__file__), "best_text_detector(smaller).pt")
-    best_model_gzip_path = os.path.join(os.path.dirname(__file__), "best_text_detector(smaller).pt.gz")
+    best_model_path = os.path.join(os.path.dirname(__file__), "best_text_detector_smaller.safetensors")
+    best_model_fp16_path = os.path.join(os.path.dirname(__file__), "best_text_detector_smaller_fp16.safetensors")
     state = None
     is_desklib_checkpoint = False
 
 
     if os.path.exists(best_model_path):
-      state = torch.load(best_model_path, map_location=detector.device)
+      state = load_checkpoint(best_model_path, device=detector.device, verify=True)
       is_desklib_checkpoint = any(k.startswith("model.") for k in state.keys())
       if detector.use_binary_logit and is_desklib_checkpoint:
         detector.model.load_state_dict(state, strict=True)
@@ -365,7 +419,8 @@ if __name__ == "__main__":
     gsingh = raw_gsingh["train"] if isinstance(raw_gsingh, dict) else raw_gsingh
     if "Human_story" in gsingh.column_names and "label" not in gsingh.column_names:
       gsingh = gsingh1_to_text_label(gsingh)
-    gsingh = sample_subset(gsingh, n_human=250, n_ai=250, n_mixed=250, seed=None)
+    # fixed seed so the splits (and the cached stress test set) are reproducible
+    gsingh = sample_subset(gsingh, n_human=250, n_ai=250, n_mixed=250, seed=42)
 
     csv_path = os.path.join(os.path.dirname(__file__), "test_dataset.csv")
     raw_csv = load_dataset("csv", data_files=csv_path)
@@ -414,6 +469,15 @@ if __name__ == "__main__":
     test_normal_dataset = test_dataset.select(range(half))
     test_stress_dataset = test_dataset.select(range(half, n_test))
 
+    # augment the stress split before cleaning/tokenizing; generated in parallel
+    # and cached on disk by seed, generator config and source texts
+    tester = StressTestGenerator(seed=42)
+    test_stress_dataset = tester.generate_stress_test_dataset(
+      test_stress_dataset,
+      text_column=get_text_column(test_stress_dataset),
+      cache_dir=os.path.join(os.path.dirname(__file__), "stress_cache"),
+    )
+
     # get the text column from the dataset, clean, tokenize, and set the format for both training and validation
     text_column = get_text_column(train_dataset)
     if is_desklib_checkpoint:
@@ -446,13 +510,16 @@ if __name__ == "__main__":
       USE_KNOWLEDGE_DISTILLATION = True
       print("Knowledge distillation enabled: teacher=desklib (from .pt), student=distilbert")
 
-      # collate the text batch
-      def collate_text_batch(batch):
-        texts = [b["text"] for b in batch]
-        labels = torch.tensor([b["label"] for b in batch], dtype=torch.long)
-        return {"text": texts, "label": labels}
-      
-      train_dataloader_distill = DataLoader(cleaned_train_dataset, batch_size=16, shuffle=True, collate_fn=collate_text_batch) if USE_KNOWLEDGE_DISTILLATION else None
+      # the teacher is frozen: score the training set once, then free it
+      distill_train_dataset = add_teacher_probs(cleaned_train_dataset, teacher_model, teacher_tokenizer, detector.device, text_column)
+      del teacher_model
+      if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+      # pre-tokenize the student inputs alongside the cached teacher probabilities
+      tokenized_train_dataset = distill_train_dataset.map(lambda x: tokenize_batch(x, detector.tokenizer, text_column), batched=True, batch_size=1000)
+      tokenized_train_dataset.set_format(type='torch', columns=['input_ids', 'attention_mask', 'label', 'teacher_prob'])
+      train_dataloader = DataLoader(tokenized_train_dataset, batch_size=16, shuffle=True)
     else:
       tokenized_train_dataset = cleaned_train_dataset.map(lambda x: tokenize_batch(x, detector.tokenizer, text_column), batched=True, batch_size=1000)
       tokenized_train_dataset.set_format(type='torch', columns=['input_ids', 'attention_mask', 'label'])
@@ -484,8 +551,10 @@ if __name__ == "__main__":
     # for improving training efficiency
     early_stopping_patience = 3
     early_stopping_counter = 0
-    best_model_state = None
+    best_model_saved = False
     best_epoch = 0
+    # best weights are written to disk off the training thread instead of deep-copied in memory
+    checkpoint_writer = AsyncCheckpointWriter()
 
     # for export file
     batch_counter = 0
@@ -517,31 +586,15 @@ if __name__ == "__main__":
       total_train_samples = 0
       detector.model.train()
       batch_counter = 0
-      dataloader = train_dataloader_distill if USE_KNOWLEDGE_DISTILLATION else train_dataloader
+      dataloader = train_dataloader
 
       for batch in tqdm(dataloader, desc=f"Training", unit="batch"):
         batch_counter += 1
         start = time.time()
 
-        # if knowledge distillation is enabled, use the teacher model to get the logits
-        if USE_KNOWLEDGE_DISTILLATION:
-          # get the texts and labels
-          texts, labels = batch["text"], batch["label"].to(detector.device)
-          # tokenize the texts
-          student_enc = detector.tokenizer(texts, padding="max_length", truncation=True, max_length=512, return_tensors="pt")
-          # tokenize the texts for the teacher model
-          teacher_enc = teacher_tokenizer(texts, padding="max_length", truncation=True, max_length=512, return_tensors="pt")
-          # move the input ids and attention mask to the device
-          input_ids = student_enc["input_ids"].to(detector.device)
-          # move the attention mask to the device
-          attention_mask = student_enc["attention_mask"].to(detector.device)
-          teacher_input_ids = teacher_enc["input_ids"].to(detector.device)
-          teacher_attention_mask = teacher_enc["attention_mask"].to(detector.device)
-        else:
-          # if knowledge distillation is not enabled, just use current model to get the logits
-          input_ids = batch["input_ids"].to(detector.device)
-          attention_mask = batch["attention_mask"].to(detector.device)
-          labels = batch["label"].to(detector.device)
+        input_ids = batch["input_ids"].to(detector.device)
+        attention_mask = batch["attention_mask"].to(detector.device)
+        labels = batch["label"].to(detector.device)
 
         # zero the gradients
         optimizer.zero_grad()
@@ -550,13 +603,9 @@ if __name__ == "__main__":
         # get the logits
         logits = outputs["logits"] if isinstance(outputs, dict) else outputs.logits
 
-        # if knowledge distillation is enabled, use the teacher model to get the logits
+        # if knowledge distillation is enabled, compare against the precomputed teacher probabilities
         if USE_KNOWLEDGE_DISTILLATION:
-          # get the outputs from the teacher model
-          with torch.no_grad():
-            teacher_outputs = teacher_model(teacher_input_ids, attention_mask=teacher_attention_mask)
-            teacher_logits = teacher_outputs["logits"].squeeze(-1)
-            teacher_prob = torch.sigmoid(teacher_logits)
+          teacher_prob = batch["teacher_prob"].to(detector.device, dtype=torch.float32)
           # get the probabilities from the student model
           student_prob = torch.softmax(logits, dim=1)[:, 1]
           # get the cross-entropy loss
@@ -677,8 +726,9 @@ if __name__ == "__main__":
         # reset the early stopping counter (no overfitting)
         early_stopping_counter = 0
 
-        # copy the best model state so that we can load it for later runs as well
-        best_model_state = copy.deepcopy(detector.model.state_dict())
+        # checkpoint the best model state so that we can load it for later runs as well
+        checkpoint_writer.submit(detector.model.state_dict(), best_model_path, metadata={"epoch": epoch + 1, "val_loss": avg_val_loss})
+        best_model_saved = True
         best_epoch = epoch
       else:
         # increment the early stopping counter
@@ -703,17 +753,13 @@ if __name__ == "__main__":
       f.write(f"Best model from epoch: {best_epoch + 1}\n")
 
     # load the best model state if it exists
-    if best_model_state:
+    checkpoint_writer.wait()
+    if best_model_saved:
       print(f"Loading best model state from epoch {best_epoch+1}")
-      detector.model.load_state_dict(best_model_state)
-      # save the best model state to a file
-      torch.save(detector.model.state_dict(), "model_training/text_model/best_text_detector(smaller).pt")
-
-      best_model_state_fp = detector.model.state_dict()
-      best_model_state_fp16 = {k: v.half() for k, v in best_model_state_fp.items()}
-      torch.save(best_model_state_fp16, os.path.join(os.path.dirname(__file__), "best_text_detector_fp16(smaller).pt"))
-      torch.save(best_model_state, best_model_path)
-      print(f"Saved best model weights to {best_model_path} and best_text_detector_fp16(smaller).pt")
+      detector.model.load_state_dict(load_checkpoint(best_model_path, device=detector.device))
+      checkpoint_writer.submit(detector.model.state_dict(), best_model_fp16_path, metadata={"epoch": best_epoch + 1}, dtype=torch.float16)
+      print(f"Saved best model weights to {best_model_path} and {os.path.basename(best_model_fp16_path)}")
+    checkpoint_writer.close()
     writer.close()
     print("Training complete.")
 
@@ -755,12 +801,7 @@ if __name__ == "__main__":
     print("Testing complete.")
 
     print("Start stress testing...")
-    # stress test the model
-
-    tester = StressTestGenerator()
-
-    stress_test_dataset = tester.generate_stress_test_dataset(test_stress_dataset)
-    stress_test_dataloader = DataLoader(stress_test_dataset, batch_size=16, shuffle=False)
+    # stress test the model on the augmented split prepared above
 
     detector.model.eval()
     total_stress_test_loss = 0.0